@@ -1,9 +1,27 @@
 import argparse
+import time
 import traceback
 from cli.lib.argparse_util import get_parser
-from lib.constants import DOCUMENT_KEY, SCORE_KEY, TITLE_KEY
+from lib.constants import (
+    BM25F_FIELD_WEIGHTS,
+    DESCRIPTION_KEY,
+    DOCUMENT_KEY,
+    SCORE_KEY,
+    TITLE_KEY,
+)
 from lib.keyword_search import (
+    add_documents,
+    bm25_search_batch,
     bm25_search_title,
+    bm25f_search_title,
+    boolean_search_title,
+    delete_document,
+    fuzzy_terms,
+    merge,
+    phrase_search_title,
+    prefix_terms,
+    proximity_search_title,
+    query_cache_stats,
     search_title,
     get_idf,
     get_tf,
@@ -16,37 +34,89 @@ from lib.keyword_search import (
 commands = {
     "search": ["query"],
     "bm25search": ["query"],
+    "bm25fsearch": ["query"],
+    "bm25batch": ["queries_path"],
+    "phrasesearch": ["query"],
+    "proximitysearch": ["query"],
+    "boolsearch": ["query"],
     "build": [],
     "tf": ["doc_id", "term"],
     "bm25tf": ["doc_id", "term"],
     "idf": ["term"],
     "bm25idf": ["term"],
     "tfidf": ["doc_id", "term"],
+    "add": ["path"],
+    "delete": ["doc_id"],
+    "merge": [],
+    "cachestats": [],
+    "prefix": ["term"],
+    "fuzzyterms": ["term"],
+}
+
+opt_args = {
+    "build": [("workers", 1)],
+    "bm25fsearch": [
+        ("title-weight", BM25F_FIELD_WEIGHTS[TITLE_KEY]),
+        ("description-weight", BM25F_FIELD_WEIGHTS[DESCRIPTION_KEY]),
+    ],
 }
 
-query_type = {"query": str, "doc_id": int, "term": str}
+bool_args = {
+    "build": [("positions", "store_true"), ("compress", "store_true")],
+    "bm25search": [("fuzzy", "store_true")],
+}
+
+query_type = {
+    "query": str,
+    "doc_id": int,
+    "term": str,
+    "path": str,
+    "queries_path": str,
+    "workers": int,
+    "title-weight": float,
+    "description-weight": float,
+}
 
 help = {
     # Command help
     "search": "Search movies using BM25",
     "bm25search": "Improved search with bm25",
+    "bm25fsearch": "BM25F search weighting title and description matches separately",
+    "bm25batch": "BM25 search every query of a file in vectorized batches",
+    "phrasesearch": "Search movies containing the exact phrase",
+    "proximitysearch": "BM25 search boosted when query terms appear close together",
+    "boolsearch": 'Boolean search with AND, OR, NOT, parentheses and "phrases"',
     "build": "Build cache",
     "tf": "Check term frequency for a term in a document",
     "bm25tf": "Check term frequency for a term in a document",
     "idf": "Get inverse document frequency for a term",
     "bm25idf": "Get BM25 IDF for a term",
     "tfidf": "Get tfidf for a term in a document",
+    "add": "Add or update the movies of a JSON file in the index",
+    "delete": "Delete a movie from the index",
+    "merge": "Merge the index segments into one",
+    "cachestats": "Show hit and miss counts of the bm25search result cache",
+    "prefix": "List index terms starting with a prefix",
+    "fuzzyterms": "List index terms within one or two edits of a term",
     # Argument help
     "query": "Search query",
     "doc_id": "Document ID for the term",
     "term": "Term to search for in the document",
+    "path": "JSON file with a movies list, in the movies.json format",
+    "queries_path": "Text file with one query per line",
+    "workers": "Number of processes used to tokenize movies (Default 1)",
+    "positions": "Store token positions for phrase and proximity search",
+    "compress": "Bit pack postings and drop precomputed impacts to shrink the index",
+    "fuzzy": "Expand misspelled query terms to close index terms",
+    "title-weight": "Weight of title matches in BM25F (Default 3.0)",
+    "description-weight": "Weight of description matches in BM25F (Default 1.0)",
 }
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
 
-    parser = get_parser(parser, commands, {}, {}, {}, query_type, help)
+    parser = get_parser(parser, commands, opt_args, {}, bool_args, query_type, help)
     args = parser.parse_args()
 
     match args.command:
@@ -60,15 +130,65 @@ def main() -> None:
                 traceback.print_exc()
         case "bm25search":
             print(f"Searching for: {args.query} using bm25")
-            filtered_movies = bm25_search_title(args.query)
+            filtered_movies = bm25_search_title(args.query, fuzzy=args.fuzzy)
+            for index, movie_dict in enumerate(filtered_movies):
+                movie, score = movie_dict[DOCUMENT_KEY], movie_dict[SCORE_KEY]
+                print(
+                    f"{index + 1}. ({movie['id']}) {movie[TITLE_KEY]} - Score: {score:.2f}"
+                )
+        case "bm25fsearch":
+            print(f"Searching for: {args.query} using bm25f")
+            field_weights = {
+                TITLE_KEY: args.title_weight,
+                DESCRIPTION_KEY: args.description_weight,
+            }
+            filtered_movies = bm25f_search_title(args.query, field_weights)
+            for index, movie_dict in enumerate(filtered_movies):
+                movie, score = movie_dict[DOCUMENT_KEY], movie_dict[SCORE_KEY]
+                print(
+                    f"{index + 1}. ({movie['id']}) {movie[TITLE_KEY]} - Score: {score:.2f}"
+                )
+        case "bm25batch":
+            with open(args.queries_path, "r") as file:
+                queries = [line.strip() for line in file if line.strip()]
+            print(f"Searching for {len(queries)} queries using bm25")
+            start = time.perf_counter()
+            results = bm25_search_batch(queries)
+            elapsed = time.perf_counter() - start
+            for query, filtered_movies in zip(queries, results, strict=True):
+                titles = [
+                    movie_dict[DOCUMENT_KEY][TITLE_KEY]
+                    for movie_dict in filtered_movies
+                ]
+                print(f"- {query}: {', '.join(titles)}")
+            print(f"Searched {len(queries)} queries in {elapsed:.2f}s")
+        case "phrasesearch":
+            print(f"Searching for the phrase: {args.query}")
+            filtered_movies = phrase_search_title(args.query)
+            for index, movie_dict in enumerate(filtered_movies):
+                movie, score = movie_dict[DOCUMENT_KEY], movie_dict[SCORE_KEY]
+                print(
+                    f"{index + 1}. ({movie['id']}) {movie[TITLE_KEY]} - Score: {score:.2f}"
+                )
+        case "proximitysearch":
+            print(f"Searching for: {args.query} using bm25 with term proximity")
+            filtered_movies = proximity_search_title(args.query)
+            for index, movie_dict in enumerate(filtered_movies):
+                movie, score = movie_dict[DOCUMENT_KEY], movie_dict[SCORE_KEY]
+                print(
+                    f"{index + 1}. ({movie['id']}) {movie[TITLE_KEY]} - Score: {score:.2f}"
+                )
+        case "boolsearch":
+            print(f"Searching for: {args.query} using a boolean query")
+            filtered_movies = boolean_search_title(args.query)
             for index, movie_dict in enumerate(filtered_movies):
                 movie, score = movie_dict[DOCUMENT_KEY], movie_dict[SCORE_KEY]
                 print(
                     f"{index + 1}. ({movie['id']}) {movie[TITLE_KEY]} - Score: {score:.2f}"
                 )
         case "build":
-            print("Building pickle files")
-            build()
+            print("Building index")
+            build(args.workers, args.positions, args.compress)
         case "tf":
             print(f"Fetching term frequency from {args.doc_id} of {args.term}")
             count = get_tf(args.doc_id, args.term)
@@ -91,6 +211,32 @@ def main() -> None:
             print(
                 f"The TF-IDF for term {args.term} in doc_id {args.doc_id} is {tfidf:.2f}"
             )
+        case "add":
+            print(f"Adding movies from {args.path}")
+            count = add_documents(args.path)
+            print(f"Indexed {count} movies")
+        case "delete":
+            print(f"Deleting movie {args.doc_id}")
+            count = delete_document(args.doc_id)
+            print(f"Deleted {count} movies")
+        case "merge":
+            print("Merging index segments")
+            merge()
+        case "prefix":
+            print(f"Index terms starting with {args.term}")
+            for term in prefix_terms(args.term):
+                print(f"  {term}")
+        case "fuzzyterms":
+            print(f"Index terms close to {args.term}")
+            for term, distance, term_doc_count in fuzzy_terms(args.term):
+                print(f"  {term} - Edits: {distance}, Documents: {term_doc_count}")
+        case "cachestats":
+            stats = query_cache_stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_rate = stats["hits"] / lookups if lookups else 0.0
+            print(f"Hits: {stats['hits']}, Misses: {stats['misses']}")
+            print(f"Hit rate: {hit_rate:.2%}")
+            print(f"Cached queries: {stats['entries']} ({stats['bytes']} bytes)")
         case _:
             parser.print_help()
 
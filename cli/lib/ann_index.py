@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+
+from .constants import (
+    IVF_ASSIGN_BATCH,
+    IVF_KMEANS_ITERATIONS,
+    IVF_TRAINING_ROWS_PER_LIST,
+)
+from .segment import Segment, write_segment
+from .vector_search import normalize_rows, top_k_indexes
+
+
+def default_list_count(rows: int) -> int:
+    return max(1, int(round(np.sqrt(rows))))
+
+
+def nearest_centroids(unit_vectors, centroids) -> tuple[np.ndarray, np.ndarray]:
+    # Closest centroid of every row and its cosine, in batches so the score
+    # matrix stays small
+    assignments = np.zeros(len(unit_vectors), dtype=np.int64)
+    similarities = np.zeros(len(unit_vectors), dtype=np.float32)
+    for start in range(0, len(unit_vectors), IVF_ASSIGN_BATCH):
+        batch = slice(start, start + IVF_ASSIGN_BATCH)
+        scores = unit_vectors[batch] @ centroids.T
+        assignments[batch] = np.argmax(scores, axis=1)
+        similarities[batch] = scores[np.arange(len(scores)), assignments[batch]]
+    return assignments, similarities
+
+
+def spherical_kmeans(
+    unit_vectors, n_clusters, iterations=IVF_KMEANS_ITERATIONS, seed=0
+) -> np.ndarray:
+    # k-means under cosine: centroids are renormalized means of their rows.
+    # A cluster left empty restarts on the row its centroid serves worst
+    rng = np.random.default_rng(seed)
+    seeds = rng.choice(len(unit_vectors), n_clusters, replace=False)
+    centroids = unit_vectors[np.sort(seeds)].copy()
+    for _ in range(iterations):
+        assignments, similarities = nearest_centroids(unit_vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        order = np.argsort(assignments, kind="stable")
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        starts = np.cumsum(counts) - counts
+        sums[filled] = np.add.reduceat(unit_vectors[order], starts[filled])
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = unit_vectors[np.argsort(similarities)[: len(empty)]]
+        updated = normalize_rows(sums)
+        if np.array_equal(updated, centroids):
+            break
+        centroids = updated
+    return centroids
+
+
+class IVFIndex:
+    # Inverted file over unit vectors: rows are grouped by their nearest
+    # k-means centroid and a query only scores the rows of the nprobe lists
+    # whose centroids are closest to it
+    def __init__(self, centroids, list_offsets, list_rows, metadata):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.metadata = metadata
+
+    @classmethod
+    def build(cls, unit_vectors, n_lists=None, source=None, seed=0) -> "IVFIndex":
+        unit_vectors = np.asarray(unit_vectors, dtype=np.float32)
+        if not len(unit_vectors):
+            raise ValueError("No vectors to index")
+        n_lists = min(
+            n_lists or default_list_count(len(unit_vectors)), len(unit_vectors)
+        )
+        # Centroids are trained on a sample, every row is then assigned
+        rng = np.random.default_rng(seed)
+        training = unit_vectors
+        if len(unit_vectors) > n_lists * IVF_TRAINING_ROWS_PER_LIST:
+            sample = rng.choice(
+                len(unit_vectors), n_lists * IVF_TRAINING_ROWS_PER_LIST, replace=False
+            )
+            training = unit_vectors[np.sort(sample)]
+        centroids = spherical_kmeans(training, n_lists, seed=seed)
+        assignments, _ = nearest_centroids(unit_vectors, centroids)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        metadata = {
+            "rows": len(unit_vectors),
+            "dims": unit_vectors.shape[1],
+            "lists": n_lists,
+            "source": source,
+        }
+        return cls(
+            centroids, list_offsets, np.argsort(assignments, kind="stable"), metadata
+        )
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_segment(
+            path,
+            {
+                "centroids": self.centroids,
+                "list_offsets": self.list_offsets,
+                "list_rows": self.list_rows,
+            },
+            self.metadata,
+        )
+
+    @classmethod
+    def open(cls, path: str) -> "IVFIndex":
+        segment = Segment(path)
+        metadata = segment.metadata
+        centroids = segment.array("centroids").reshape(
+            metadata["lists"], metadata["dims"]
+        )
+        return cls(
+            centroids,
+            segment.array("list_offsets"),
+            segment.array("list_rows"),
+            metadata,
+        )
+
+    def __len__(self) -> int:
+        return self.metadata["lists"]
+
+    def candidates(self, unit_query, nprobe) -> np.ndarray:
+        # Rows of the nprobe lists closest to the query, in row order
+        lists = top_k_indexes(self.centroids @ unit_query, nprobe)
+        rows = [
+            self.list_rows[self.list_offsets[index] : self.list_offsets[index + 1]]
+            for index in lists.tolist()
+        ]
+        return np.sort(np.concatenate(rows))
+
+    def search(
+        self, unit_vectors, query, limit, nprobe
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Same result shape as cosine_top_k, exact scores over the probed rows
+        unit_query = normalize_rows(query)
+        rows = self.candidates(unit_query, nprobe)
+        scores = unit_vectors[rows] @ unit_query
+        top = top_k_indexes(scores, limit)
+        return rows[top], scores[top]
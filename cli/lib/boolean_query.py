@@ -0,0 +1,249 @@
+import re
+from bisect import bisect_left
+from typing import NamedTuple
+
+import numpy as np
+
+from .preprocess import preprocess
+from .wand import EXHAUSTED
+
+OPERATORS = ("AND", "OR", "NOT")
+
+QUERY_TOKEN = re.compile(r'"([^"]*)"|(\()|(\))|(")|([^\s()"]+)')
+
+
+class Term(NamedTuple):
+    token: str
+
+
+class Phrase(NamedTuple):
+    tokens: list[str]
+
+
+class And(NamedTuple):
+    children: list
+
+
+class Or(NamedTuple):
+    children: list
+
+
+class Not(NamedTuple):
+    child: object
+
+
+def lex_query(query: str) -> list[tuple[str, str]]:
+    lexemes = []
+    for match in QUERY_TOKEN.finditer(query):
+        phrase, open_paren, close_paren, quote, word = match.groups()
+        if phrase is not None:
+            lexemes.append(("phrase", phrase))
+        elif open_paren:
+            lexemes.append(("(", open_paren))
+        elif close_paren:
+            lexemes.append((")", close_paren))
+        elif quote:
+            raise ValueError("Unbalanced quote in query")
+        elif word in OPERATORS:
+            lexemes.append((word, word))
+        else:
+            lexemes.append(("word", word))
+    return lexemes
+
+
+class QueryParser:
+    # query   := or_expr
+    # or_expr := and_expr (OR and_expr)*
+    # and_expr := not_expr ([AND] not_expr)*
+    # not_expr := NOT not_expr | "(" or_expr ")" | phrase | word
+    def __init__(self, query: str):
+        self.lexemes = lex_query(query)
+        self.position = 0
+
+    def parse(self):
+        if not self.lexemes:
+            return None
+        node = self.__or_expr()
+        if self.position < len(self.lexemes):
+            raise ValueError(f"Unexpected {self.lexemes[self.position][1]!r} in query")
+        return node
+
+    def __peek(self) -> str | None:
+        if self.position < len(self.lexemes):
+            return self.lexemes[self.position][0]
+        return None
+
+    def __take(self) -> tuple[str, str]:
+        if self.position >= len(self.lexemes):
+            raise ValueError("Query ended unexpectedly")
+        lexeme = self.lexemes[self.position]
+        self.position += 1
+        return lexeme
+
+    def __or_expr(self):
+        children = [self.__and_expr()]
+        while self.__peek() == "OR":
+            self.__take()
+            children.append(self.__and_expr())
+        return combine(Or, children)
+
+    def __and_expr(self):
+        children = [self.__not_expr()]
+        # Adjacent operands without an operator are ANDed
+        while self.__peek() not in (None, "OR", ")"):
+            if self.__peek() == "AND":
+                self.__take()
+            children.append(self.__not_expr())
+        return combine(And, children)
+
+    def __not_expr(self):
+        kind, value = self.__take()
+        if kind == "NOT":
+            child = self.__not_expr()
+            return Not(child) if child is not None else None
+        if kind == "(":
+            node = self.__or_expr()
+            if self.__take()[0] != ")":
+                raise ValueError("Missing closing parenthesis in query")
+            return node
+        if kind == "phrase":
+            tokens = preprocess(value)
+            if len(tokens) > 1:
+                return Phrase(tokens)
+            return Term(tokens[0]) if tokens else None
+        if kind == "word":
+            # A word can analyze to no token (stopword) or to several
+            return combine(And, [Term(token) for token in preprocess(value)])
+        raise ValueError(f"Unexpected {value!r} in query")
+
+
+def combine(node_type, children):
+    # Stopwords drop out of the tree, a single child needs no wrapper
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return node_type(children)
+
+
+def parse_query(query: str):
+    return QueryParser(query).parse()
+
+
+def scoring_tokens(node, negated=False) -> list[str]:
+    # Terms a match is scored on, everything under an odd number of NOTs only
+    # filters
+    if isinstance(node, Term):
+        return [] if negated else [node.token]
+    if isinstance(node, Phrase):
+        return [] if negated else list(node.tokens)
+    if isinstance(node, Not):
+        return scoring_tokens(node.child, not negated)
+    return [
+        token for child in node.children for token in scoring_tokens(child, negated)
+    ]
+
+
+def gallop(docs, target, position) -> int:
+    # Exponential probe from the current position, then a binary search in the
+    # last bracket, cheap when the target is near and still log n when far
+    if position >= len(docs) or docs[position] >= target:
+        return position
+    step = 1
+    high = position + 1
+    while high < len(docs) and docs[high] < target:
+        position = high
+        step *= 2
+        high = position + step
+    return bisect_left(docs, target, position + 1, min(high, len(docs)))
+
+
+class PostingIterator:
+    def __init__(self, docs):
+        # gallop and bisect index single elements, far cheaper on a list
+        # than on an ndarray
+        self.docs = docs.tolist() if isinstance(docs, np.ndarray) else docs
+        self.cost = len(self.docs)
+        self.position = 0
+        self.doc = self.docs[0] if self.docs else EXHAUSTED
+
+    def __move(self, position) -> None:
+        self.position = position
+        self.doc = self.docs[position] if position < len(self.docs) else EXHAUSTED
+
+    def next(self) -> None:
+        self.__move(self.position + 1)
+
+    def seek(self, target) -> None:
+        self.__move(gallop(self.docs, target, self.position))
+
+
+class AndIterator:
+    def __init__(self, includes: list, excludes: list):
+        # Rarest list leads, every other list only gallops to its candidates
+        self.includes = sorted(includes, key=lambda x: x.cost)
+        self.excludes = excludes
+        self.cost = self.includes[0].cost
+        self.doc = None
+        self.__align()
+
+    def __excluded(self, candidate) -> bool:
+        for exclude in self.excludes:
+            exclude.seek(candidate)
+            if exclude.doc == candidate:
+                return True
+        return False
+
+    def __align(self) -> None:
+        lead = self.includes[0]
+        while lead.doc != EXHAUSTED:
+            candidate = lead.doc
+            for other in self.includes[1:]:
+                other.seek(candidate)
+                if other.doc != candidate:
+                    # Skip the lead straight past the gap the other list found
+                    lead.seek(other.doc)
+                    break
+            else:
+                if not self.__excluded(candidate):
+                    self.doc = candidate
+                    return
+                lead.next()
+        self.doc = EXHAUSTED
+
+    def next(self) -> None:
+        self.includes[0].next()
+        self.__align()
+
+    def seek(self, target) -> None:
+        if self.doc < target:
+            self.includes[0].seek(target)
+            self.__align()
+
+
+class OrIterator:
+    def __init__(self, children: list):
+        self.children = children
+        self.cost = sum(child.cost for child in children)
+        self.doc = min(child.doc for child in children)
+
+    def next(self) -> None:
+        current = self.doc
+        for child in self.children:
+            if child.doc == current:
+                child.next()
+        self.doc = min(child.doc for child in self.children)
+
+    def seek(self, target) -> None:
+        if self.doc < target:
+            for child in self.children:
+                child.seek(target)
+            self.doc = min(child.doc for child in self.children)
+
+
+def iterate_matches(iterator):
+    # Matches are produced one at a time, in ascending doc order
+    while iterator.doc != EXHAUSTED:
+        yield iterator.doc
+        iterator.next()
@@ -1,151 +1,359 @@
 import os
+import time
+from functools import partial
 from pathlib import Path
 import numpy as np
-import json
 
 from lib.constants import (
     CACHE_PATH,
+    CHUNK_CENTROIDS_PATH,
     CHUNK_INDEX,
-    CHUNK_KEY,
+    CHUNK_IVF_PATH,
+    CHUNK_MAX_SENTENCES,
+    CHUNK_OVERLAP_SENTENCES,
     DESCRIPTION_KEY,
-    DESCRIPTION_LEN,
     DOCUMENT_KEY,
+    DOCUMENT_VECTOR_SOURCES,
     MOVIE_INDEX,
     SCORE_PRECISION,
     TITLE_KEY,
     TOTAL_CHUNKS,
 )
 from lib.search_utils import import_json, semantic_chunk_text
-from .semantic_search import SemanticSearch, cosine_similarity
+from .ann_index import IVFIndex
+from .document_store import source_signature
+from .embedding_manifest import (
+    content_hash,
+    content_hashes,
+    manifest_settings,
+    previous_build,
+    splice_vectors,
+)
+from .quantization import load_or_create_quantizer, rescored_top_k
+from .segment import Segment, write_segment
+from .semantic_search import SemanticSearch, golden_queries
+from .vector_search import (
+    cosine_top_k,
+    normalize_rows,
+    pool_segments,
+    read_vectors,
+    segment_starts,
+    top_k_indexes,
+    write_vectors,
+)
+
+# Columns of the chunk metadata file, one int32 value per chunk
+CHUNK_COLUMNS = (MOVIE_INDEX, CHUNK_INDEX, TOTAL_CHUNKS)
 
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(
+        self, model_name="all-MiniLM-L6-v2", quantization=None, backend="torch"
+    ) -> None:
+        super().__init__(model_name, quantization, backend=backend)
         self.chunk_embeddings = None
         self.chunk_metadata = None
-        self.chunk_embeddings_path = os.path.join(CACHE_PATH, "chunk_embeddings.npy")
-        self.chunk_metadata_path = os.path.join(CACHE_PATH, "chunk_metadata.json")
+        self.movie_starts = None
+        self.movie_ends = None
+        self.movie_indexes = None
+        # First stage of two stage search, one row per movie and the chunk
+        # segment it stands for (-1 for movies without chunks)
+        self.document_vectors = None
+        self.document_segments = None
+        self.chunk_centroids_path = CHUNK_CENTROIDS_PATH
+        self.chunk_embeddings_path = os.path.join(
+            CACHE_PATH, "chunk_embeddings.vectors"
+        )
+        self.chunk_metadata_path = os.path.join(CACHE_PATH, "chunk_metadata.bin")
+        self.ann_index = None
+        self.ann_index_path = CHUNK_IVF_PATH
 
-    def build_chunk_embeddings(self, documents):
+    def build_chunk_embeddings(self, documents, workers=1):
+        # Incremental like build_embeddings. Movies whose description is in
+        # the previous build reuse its chunks without splitting them again,
+        # new descriptions are split and only chunks never seen are encoded
         print("Building new chunk embeddings")
-        self.documents = documents
-        chunks: list[str] = []
-        metadata: list[dict] = []
-        description_len = 0
+        self.documents.load(documents)
+        settings = self.chunk_settings()
+        previous = previous_build(self.chunk_embeddings_path, settings)
+        previous_vectors, previous_chunk_hashes = None, None
+        previous_chunks = dict()
+        if previous is not None:
+            previous_vectors, segment = previous
+            previous_chunk_hashes = segment.array("chunk_hashes")
+            offsets = segment.array("chunk_offsets").tolist()
+            for position, content in enumerate(segment.array("doc_hashes").tolist()):
+                previous_chunks[content] = (offsets[position], offsets[position + 1])
+
+        chunks: list[str | None] = []
+        chunk_hashes: list[np.ndarray] = []
+        doc_positions: list[int] = []
+        doc_hashes: list[int] = []
+        chunk_counts: list[int] = []
+        split_documents = 0
         for index, document in enumerate(documents):
             if document.get("id") is None or not document.get(DESCRIPTION_KEY):
                 continue
-            description_len += len(document[DESCRIPTION_KEY])
-            self.document_map[document["id"]] = document
 
-            curr_chunks: list[str] = semantic_chunk_text(
-                document[DESCRIPTION_KEY], 4, 1
-            )
+            description_hash = content_hash(document[DESCRIPTION_KEY])
+            if description_hash in previous_chunks:
+                start, end = previous_chunks[description_hash]
+                curr_chunks = [None] * (end - start)
+                curr_hashes = previous_chunk_hashes[start:end]
+            else:
+                curr_chunks = semantic_chunk_text(
+                    document[DESCRIPTION_KEY],
+                    CHUNK_MAX_SENTENCES,
+                    CHUNK_OVERLAP_SENTENCES,
+                )
+                curr_hashes = content_hashes(curr_chunks)
+                split_documents += 1
             chunks.extend(curr_chunks)
-            total_chunks = len(curr_chunks)
-            for chunk_index in range(len(curr_chunks)):
-                chunk_dict = {
-                    MOVIE_INDEX: index,
-                    CHUNK_INDEX: chunk_index,
-                    TOTAL_CHUNKS: total_chunks,
-                }
-                metadata.append(chunk_dict)
+            chunk_hashes.append(curr_hashes)
+            doc_positions.append(index)
+            doc_hashes.append(description_hash)
+            chunk_counts.append(len(curr_chunks))
 
         print("Total chunks are: ", len(chunks))
-        self.chunk_embeddings = self.model.encode(chunks, show_progress_bar=True)
-        self.chunk_metadata = metadata
+        chunk_offsets = np.zeros(len(chunk_counts) + 1, dtype=np.int64)
+        np.cumsum(chunk_counts, out=chunk_offsets[1:])
+        manifest = {
+            "chunk_hashes": np.concatenate(chunk_hashes or [np.zeros(0, np.uint64)]),
+            "doc_hashes": np.array(doc_hashes, dtype=np.uint64),
+            "doc_positions": np.array(doc_positions, dtype=np.int64),
+            "chunk_offsets": chunk_offsets,
+        }
+        metadata = {
+            "settings": settings,
+            "documents": self.documents.metadata["source"],
+        }
+        if previous is None or not self.is_unchanged(previous[1], manifest, metadata):
+            pipeline = self.embedding_pipeline(
+                self.chunk_embeddings_path, settings, workers
+            )
+            vectors, encoded = splice_vectors(
+                pipeline.encode,
+                manifest["chunk_hashes"],
+                chunks,
+                previous_vectors,
+                previous_chunk_hashes,
+            )
+            print(f"Embedded {encoded} of {len(chunks)} chunks")
+            # Documents that were split again, their chunks are most of the
+            # encoded ones
+            pipeline.report(split_documents)
 
-        cache_path = Path(CACHE_PATH)
-        if not cache_path.is_dir():
-            os.mkdir(CACHE_PATH)
+            cache_path = Path(CACHE_PATH)
+            if not cache_path.is_dir():
+                os.mkdir(CACHE_PATH)
+            write_vectors(self.chunk_embeddings_path, vectors, metadata, manifest)
+            pipeline.finish()
+        return self.open_chunk_embeddings()
 
-        if self.chunk_embeddings is None:
-            raise ValueError("No chunk embeddings to save")
-        with open(self.chunk_embeddings_path, "wb") as file:
-            np.save(file, self.chunk_embeddings)
+    def chunk_settings(self) -> dict:
+        return manifest_settings(
+            self.model_name,
+            chunking=[CHUNK_MAX_SENTENCES, CHUNK_OVERLAP_SENTENCES],
+        )
 
-        if self.chunk_metadata is None:
-            raise ValueError("No chunk metadata to save")
-        with open(self.chunk_metadata_path, "w") as file:
-            json.dump(
-                {
-                    CHUNK_KEY: self.chunk_metadata,
-                    TOTAL_CHUNKS: len(chunks),
-                    DESCRIPTION_LEN: description_len,
-                },
-                file,
-                indent=2,
+    def open_chunk_embeddings(self) -> np.ndarray:
+        self.chunk_embeddings, segment = self.open_vectors(self.chunk_embeddings_path)
+        # The chunk columns are derived from the manifest and rewritten
+        # whenever the embeddings file changed
+        signature = source_signature(self.chunk_embeddings_path)
+        if (
+            not os.path.isfile(self.chunk_metadata_path)
+            or Segment(self.chunk_metadata_path).metadata.get("vectors") != signature
+        ):
+            offsets = segment.array("chunk_offsets")
+            counts = np.diff(offsets)
+            columns = {
+                MOVIE_INDEX: np.repeat(segment.array("doc_positions"), counts),
+                CHUNK_INDEX: np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts),
+                TOTAL_CHUNKS: np.repeat(counts, counts),
+            }
+            write_segment(
+                self.chunk_metadata_path,
+                {name: values.astype(np.int32) for name, values in columns.items()},
+                {TOTAL_CHUNKS: int(offsets[-1]), "vectors": signature},
             )
+        metadata_segment = Segment(self.chunk_metadata_path)
+        self.chunk_metadata = {
+            name: metadata_segment.array(name) for name in CHUNK_COLUMNS
+        }
+        # First chunk row of every movie that has chunks
+        chunk_offsets = segment.array("chunk_offsets")
+        chunked = np.diff(chunk_offsets) > 0
+        self.movie_starts = chunk_offsets[:-1][chunked]
+        self.movie_ends = chunk_offsets[1:][chunked]
+        self.movie_indexes = segment.array("doc_positions")[chunked]
         return self.chunk_embeddings
 
-    def load_or_create_embeddings(self, documents: list[dict]) -> np.ndarray:
+    def load_or_create_embeddings(self, documents=None, workers=1) -> np.ndarray:
         print("Loading or creating embeddings")
-        if (
-            Path(self.chunk_metadata_path).is_file()
-            and Path(self.chunk_embeddings_path).is_file()
+        documents = self.documents.load(documents)
+        if documents is None and self.is_current(
+            self.chunk_embeddings_path, self.chunk_settings()
         ):
-            description_len = 0
-            self.documents = documents
-            for document in documents:
-                if document.get("id") is None or not document.get(DESCRIPTION_KEY):
-                    continue
-                self.document_map[document["id"]] = document
-                description_len += len(document[DESCRIPTION_KEY])
-            with open(self.chunk_metadata_path, "r") as file:
-                metadata = json.load(file)
-
-            self.chunk_metadata = metadata[CHUNK_KEY]
-            if metadata[DESCRIPTION_LEN] != description_len:
-                print(
-                    f"Expecting size {metadata[DESCRIPTION_LEN]} but got {description_len}"
+            return self.open_chunk_embeddings()
+        return self.build_chunk_embeddings(
+            documents if documents is not None else import_json(), workers
+        )
+
+    def load_or_create_ann_index(self, n_lists=None) -> IVFIndex:
+        # The IVF index is rebuilt whenever the chunk embeddings file changed
+        # since it was trained, or a different list count is asked for
+        if self.chunk_embeddings is None:
+            raise ValueError("No embeddings present build embeddings first")
+        signature = source_signature(self.chunk_embeddings_path)
+        if os.path.isfile(self.ann_index_path):
+            index = IVFIndex.open(self.ann_index_path)
+            if index.metadata["source"] == signature and n_lists in (None, len(index)):
+                self.ann_index = index
+                return index
+        print("Building new ANN index")
+        self.ann_index = IVFIndex.build(self.chunk_embeddings, n_lists, signature)
+        self.ann_index.save(self.ann_index_path)
+        return self.ann_index
+
+    def load_document_vectors(self, source="chunk_mean") -> np.ndarray:
+        # The mean of each movie's chunk vectors is derived from the chunk
+        # embeddings and rewritten whenever they changed. The movie
+        # embeddings are built from title and description, and movies
+        # without chunks are skipped by their segment
+        if self.chunk_embeddings is None:
+            raise ValueError("No embeddings present build embeddings first")
+        if source == "chunk_mean":
+            signature = source_signature(self.chunk_embeddings_path)
+            if (
+                not os.path.isfile(self.chunk_centroids_path)
+                or Segment(self.chunk_centroids_path).metadata.get("vectors")
+                != signature
+            ):
+                sums = np.zeros(
+                    (len(self.movie_starts), self.chunk_embeddings.shape[1]),
+                    dtype=np.float32,
                 )
-                embeddings = self.build_chunk_embeddings(documents)
-                if embeddings is None:
-                    raise ValueError("No Embeddings were created")
-                return embeddings
+                if len(self.movie_starts):
+                    sums = np.add.reduceat(self.chunk_embeddings, self.movie_starts)
+                write_vectors(
+                    self.chunk_centroids_path,
+                    normalize_rows(sums),
+                    {"vectors": signature},
+                )
+            self.document_vectors = read_vectors(self.chunk_centroids_path)[0]
+            self.document_segments = np.arange(len(self.movie_starts))
+        elif source == "documents":
+            SemanticSearch.load_or_create_embeddings(self)
+            segments = np.searchsorted(self.movie_indexes, self.doc_positions)
+            found = np.minimum(segments, max(0, len(self.movie_indexes) - 1))
+            chunked = (segments < len(self.movie_indexes)) & (
+                self.movie_indexes[found] == self.doc_positions
+            )
+            self.document_vectors = self.embeddings
+            self.document_segments = np.where(chunked, segments, -1)
+        else:
+            raise ValueError(f"Unknown document vector source {source!r}")
+        return self.document_vectors
+
+    def document_candidates(self, unit_query, docs) -> np.ndarray:
+        # Chunk rows of the docs movies whose vectors score best, in row order
+        if self.document_vectors is None:
+            self.load_document_vectors()
+        top = top_k_indexes(self.document_vectors @ unit_query, docs)
+        segments = self.document_segments[top]
+        return self.segment_rows(segments[segments >= 0])
 
-            self.chunk_embeddings = np.load(file=self.chunk_embeddings_path)
+    def row_segments(self, rows) -> np.ndarray:
+        # Movie segment of every chunk row
+        return np.searchsorted(self.movie_starts, rows, side="right") - 1
 
-            return self.chunk_embeddings
+    def quantized_candidates(self, quantizer, unit_query, limit, rows):
+        # Chunk rows, out of rows when given, of the limit * rescore_factor
+        # movies whose best chunk scores highest on the codes. Taking the
+        # best chunks instead lets a few movies with many close chunks fill
+        # every slot, leaving fewer than limit movies
+        approximate = quantizer.scores(unit_query, rows)
+        if rows is None:
+            segments, starts = np.arange(len(self.movie_starts)), self.movie_starts
         else:
-            embeddings = self.build_chunk_embeddings(documents)
-            if embeddings is None:
-                raise ValueError("No embeddings were created")
-            return embeddings
+            row_segments = self.row_segments(rows)
+            starts = segment_starts(row_segments)
+            segments = row_segments[starts]
+        best = pool_segments(approximate, starts, "max")
+        chosen = segments[top_k_indexes(best, limit * quantizer.rescore_factor)]
+        if rows is None:
+            return self.segment_rows(chosen)
+        return rows[np.isin(row_segments, chosen)]
 
-    def search_chunks(self, query: str, limit: int = 10):
-        q_embedding = self.generate_embedding(query)
-        chunk_score = []
+    def segment_rows(self, segments) -> np.ndarray:
+        # Every chunk row of the given movie segments, in row order
+        segments = np.sort(segments)
+        starts = self.movie_starts[segments]
+        counts = self.movie_ends[segments] - starts
+        # Each run of counts rows counts up from its start
+        run_offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return run_offsets + np.arange(counts.sum())
 
+    def rank_movies(
+        self, q_embedding, limit, nprobe=None, pooling="max", docs=None
+    ) -> list[tuple[int, float]]:
+        # Movies by their pooled chunk scores, see pool_segments. With nprobe
+        # only the chunks of the closest IVF lists are scored, with docs only
+        # the chunks of the docs best movies by document vector, otherwise
+        # every chunk is. With a quantizer the codes choose the candidate
+        # movies first. Pooling other than max scores every chunk of the
+        # movies found by nprobe
         if self.chunk_embeddings is None:
             raise ValueError("No embeddings present build embeddings first")
         if self.chunk_metadata is None:
             raise ValueError("No metadata present build embeddings first")
 
-        for index, chunk_embedding in enumerate(self.chunk_embeddings):
-            score = cosine_similarity(q_embedding, chunk_embedding)
-            chunk_score.append(
-                {
-                    "score": score,
-                    CHUNK_INDEX: self.chunk_metadata[index][CHUNK_INDEX],
-                    MOVIE_INDEX: self.chunk_metadata[index][MOVIE_INDEX],
-                }
-            )
+        unit_query = normalize_rows(q_embedding)
+        rows = None
+        if docs:
+            rows = self.document_candidates(unit_query, docs)
+        if nprobe:
+            if self.ann_index is None:
+                self.load_or_create_ann_index()
+            probed = self.ann_index.candidates(unit_query, nprobe)
+            rows = probed if rows is None else np.intersect1d(rows, probed)
+        quantizer = self.quantizers.get(self.chunk_embeddings_path)
+        if quantizer is not None:
+            # The codes only pick the movies, their chunks are rescored
+            rows = self.quantized_candidates(quantizer, unit_query, limit, rows)
+        if pooling != "max" and nprobe:
+            # mean_top and softmax depend on every chunk of a movie, not only
+            # those that were probed. Quantized candidates already hold every
+            # chunk of their movies that was not probed away
+            rows = self.segment_rows(np.unique(self.row_segments(rows)))
+        if rows is None:
+            chunk_scores = self.chunk_embeddings @ unit_query
+        else:
+            chunk_scores = self.chunk_embeddings[rows] @ unit_query
+        # Chunks are stored grouped by movie, so any sorted set of rows
+        # splits into one run per movie
+        if rows is None:
+            movie_indexes, starts = self.movie_indexes, self.movie_starts
+        else:
+            chunk_movies = self.chunk_metadata[MOVIE_INDEX][rows]
+            starts = segment_starts(chunk_movies)
+            movie_indexes = chunk_movies[starts]
 
-        movie_score = {}
-        for score in chunk_score:
-            if (
-                score[MOVIE_INDEX] not in movie_score
-                or score["score"] > movie_score[score[MOVIE_INDEX]]
-            ):
-                movie_score[score[MOVIE_INDEX]] = score["score"]
+        movie_scores = pool_segments(chunk_scores, starts, pooling)
+        top = top_k_indexes(movie_scores, limit)
+        return list(
+            zip(movie_indexes[top].tolist(), movie_scores[top].tolist(), strict=True)
+        )
 
-        movie_score_list = sorted(movie_score.items(), key=lambda x: x[1], reverse=True)
-        limit = min(limit, len(movie_score_list))
+    def search_chunks(
+        self, query: str, limit: int = 10, nprobe=None, pooling="max", docs=None
+    ):
+        q_embedding = self.generate_embedding(query)
+        movie_score_list = self.rank_movies(q_embedding, limit, nprobe, pooling, docs)
 
         res = []
-        for movie_index, score in movie_score_list[:limit]:
+        for movie_index, score in movie_score_list:
             movie = self.documents[movie_index]
             res.append(
                 {
@@ -161,14 +369,179 @@ class ChunkedSemanticSearch(SemanticSearch):
         return res
 
 
-def embed_chunks() -> np.ndarray:
-    documents = import_json()
+def embed_chunks(workers=1) -> np.ndarray:
     ch_sem_search = ChunkedSemanticSearch()
-    return ch_sem_search.load_or_create_embeddings(documents)
+    return ch_sem_search.load_or_create_embeddings(workers=workers)
 
 
-def search_chunked(query: str, limit) -> list[dict]:
+def search_chunked(
+    query: str,
+    limit,
+    nprobe=None,
+    quantization=None,
+    pooling="max",
+    backend="torch",
+    docs=None,
+    document_source="chunk_mean",
+) -> list[dict]:
+    ch_sem_search = ChunkedSemanticSearch(quantization=quantization, backend=backend)
+    ch_sem_search.load_or_create_embeddings()
+    if docs:
+        ch_sem_search.load_document_vectors(document_source)
+    return ch_sem_search.search_chunks(query, limit, nprobe, pooling, docs)
+
+
+def build_ann_index(n_lists=None) -> IVFIndex:
+    ch_sem_search = ChunkedSemanticSearch()
+    ch_sem_search.load_or_create_embeddings()
+    return ch_sem_search.load_or_create_ann_index(n_lists)
+
+
+def ann_recall(limit, nprobes) -> dict:
+    # Recall@limit of IVF search against exact search over the golden
+    # dataset queries, for chunks and for the movies they rank. Times are
+    # per query and leave out embedding the query
+    ch_sem_search = ChunkedSemanticSearch()
+    ch_sem_search.load_or_create_embeddings()
+    index = ch_sem_search.load_or_create_ann_index()
+    query_embeddings = golden_query_embeddings(ch_sem_search)
+    unit_vectors = ch_sem_search.chunk_embeddings
+    timed = partial(time_queries, query_embeddings)
+
+    exact_chunks, _ = timed(partial(exact_rows, unit_vectors, limit))
+    exact_movies, exact_ms = timed(partial(ranked_movies, ch_sem_search, limit))
+    report = {
+        "queries": len(query_embeddings),
+        "lists": len(index),
+        "exact_ms": exact_ms,
+    }
+    report["probes"] = []
+    for nprobe in nprobes:
+        chunks, _ = timed(partial(probed_rows, index, unit_vectors, limit, nprobe))
+        movies, ms = timed(partial(ranked_movies, ch_sem_search, limit, nprobe=nprobe))
+        report["probes"].append(
+            {
+                "nprobe": nprobe,
+                "chunk_recall": recall(chunks, exact_chunks),
+                "movie_recall": recall(movies, exact_movies),
+                "ms": ms,
+            }
+        )
+    return report
+
+
+def two_stage_recall(limit, docs_values) -> list[dict]:
+    # Recall@limit of the movies two stage search ranks against full chunk
+    # search over the golden dataset queries, for every document vector
+    # source and number of first stage movies. Times are per query and
+    # leave out embedding the query
     ch_sem_search = ChunkedSemanticSearch()
-    documents = import_json()
-    ch_sem_search.load_or_create_embeddings(documents)
-    return ch_sem_search.search_chunks(query, limit)
+    ch_sem_search.load_or_create_embeddings()
+    query_embeddings = golden_query_embeddings(ch_sem_search)
+    timed = partial(time_queries, query_embeddings)
+    exact, exact_ms = timed(partial(ranked_movies, ch_sem_search, limit))
+    chunk_count = len(ch_sem_search.chunk_embeddings)
+    report = []
+    for source in DOCUMENT_VECTOR_SOURCES:
+        ch_sem_search.load_document_vectors(source)
+        for docs in docs_values:
+            movies, ms = timed(partial(ranked_movies, ch_sem_search, limit, docs=docs))
+            scored = [
+                len(ch_sem_search.document_candidates(normalize_rows(q), docs))
+                for q in query_embeddings
+            ]
+            report.append(
+                {
+                    "source": source,
+                    "docs": docs,
+                    "recall": recall(movies, exact),
+                    "chunk_fraction": float(np.mean(scored)) / max(1, chunk_count),
+                    "ms": ms,
+                    "exact_ms": exact_ms,
+                }
+            )
+    return report
+
+
+def quantization_recall(limit, kinds) -> list[dict]:
+    # Recall@limit of quantized search against exact search over the golden
+    # dataset queries, for the movie and the chunk embeddings, with and
+    # without rescoring the candidates with their float vectors
+    ch_sem_search = ChunkedSemanticSearch()
+    SemanticSearch.load_or_create_embeddings(ch_sem_search)
+    ch_sem_search.load_or_create_embeddings()
+    query_embeddings = golden_query_embeddings(ch_sem_search)
+    timed = partial(time_queries, query_embeddings)
+    report = []
+    for vectors_path in (
+        ch_sem_search.embedding_path,
+        ch_sem_search.chunk_embeddings_path,
+    ):
+        unit_vectors = read_vectors(vectors_path)[0]
+        exact, exact_ms = timed(partial(exact_rows, unit_vectors, limit))
+        for kind in kinds:
+            quantizer = load_or_create_quantizer(vectors_path, kind)
+            codes_bytes = sum(part.nbytes for part in quantizer.sections().values())
+            approximate, _ = timed(partial(quantized_rows, quantizer, limit))
+            found, ms = timed(partial(rescored_rows, quantizer, unit_vectors, limit))
+            report.append(
+                {
+                    "vectors": os.path.basename(vectors_path),
+                    "kind": kind,
+                    "ratio": unit_vectors.nbytes / codes_bytes,
+                    "first_pass_recall": recall(approximate, exact),
+                    "recall": recall(found, exact),
+                    "ms": ms,
+                    "exact_ms": exact_ms,
+                }
+            )
+    return report
+
+
+# Result sets of one query for the recall reports, the measured settings
+# come first so they can be bound with partial
+
+
+def exact_rows(unit_vectors, limit, q_embedding) -> set:
+    return set(cosine_top_k(unit_vectors, q_embedding, limit)[0].tolist())
+
+
+def probed_rows(index, unit_vectors, limit, nprobe, q_embedding) -> set:
+    return set(index.search(unit_vectors, q_embedding, limit, nprobe)[0].tolist())
+
+
+def ranked_movies(ch_sem_search, limit, q_embedding, **options) -> set:
+    return {
+        movie for movie, _ in ch_sem_search.rank_movies(q_embedding, limit, **options)
+    }
+
+
+def quantized_rows(quantizer, limit, q_embedding) -> set:
+    scores = quantizer.scores(normalize_rows(q_embedding))
+    return set(top_k_indexes(scores, limit).tolist())
+
+
+def rescored_rows(quantizer, unit_vectors, limit, q_embedding) -> set:
+    rows, scores = rescored_top_k(
+        quantizer, unit_vectors, normalize_rows(q_embedding), limit
+    )
+    return set(rows[top_k_indexes(scores, limit)].tolist())
+
+
+def golden_query_embeddings(sem_search) -> list[np.ndarray]:
+    queries = golden_queries()
+    if not queries:
+        raise ValueError("No golden dataset queries to measure recall with")
+    return [sem_search.generate_embedding(query) for query in queries]
+
+
+def time_queries(query_embeddings, rank) -> tuple[list, float]:
+    # Results of rank for every query and the mean milliseconds per query
+    start = time.perf_counter()
+    results = [rank(q_embedding) for q_embedding in query_embeddings]
+    return results, (time.perf_counter() - start) * 1000 / len(query_embeddings)
+
+
+def recall(found: list[set], expected: list[set]) -> float:
+    hits = sum(len(f & e) for f, e in zip(found, expected, strict=True))
+    return hits / max(1, sum(len(e) for e in expected))
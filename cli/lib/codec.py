@@ -0,0 +1,205 @@
+import numpy as np
+
+# LEB128 style varints: 7 payload bits per byte, high bit set on every byte
+# except the last one of a value
+
+
+def varint_lengths(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    return lengths
+
+
+def varint_encode(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = varint_lengths(values)
+    starts = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    encoded = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    # One pass per byte position, at most ten for 64 bit values
+    for group in range(int(lengths.max(initial=0))):
+        mask = lengths > group
+        payload = (values[mask] >> np.uint64(7 * group)) & np.uint64(0x7F)
+        more = (lengths[mask] > group + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + group] = payload | more
+    return encoded
+
+
+def varint_decode(encoded) -> np.ndarray:
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.int64)
+    last = encoded < 0x80
+    value_ids = np.zeros(len(encoded), dtype=np.int64)
+    np.cumsum(last[:-1], out=value_ids[1:])
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    shifts = (np.arange(len(encoded)) - starts[value_ids]) * 7
+    payload = (encoded & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(payload, starts).astype(np.int64)
+
+
+def delta_encode(values, counts) -> np.ndarray:
+    # Gaps within each run of counts values, each run starts from zero
+    values = np.asarray(values, dtype=np.int64)
+    gaps = np.diff(values, prepend=0)
+    starts = run_starts(counts)
+    gaps[starts] = values[starts]
+    return gaps
+
+
+def delta_decode(gaps, counts) -> np.ndarray:
+    gaps = np.asarray(gaps, dtype=np.int64)
+    totals = np.cumsum(gaps)
+    starts = run_starts(counts)
+    counts = np.asarray(counts, dtype=np.int64)[np.asarray(counts) > 0]
+    return totals - np.repeat(totals[starts] - gaps[starts], counts)
+
+
+def run_starts(counts) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return starts[counts > 0]
+
+
+# Patched frame of reference (PForDelta): all values of a run share one bit
+# width, the one that makes the packed run plus its exceptions smallest.
+# Values wider than that keep their low bits in place and their high bits in
+# an exception list that is patched in after unpacking
+MAX_BIT_WIDTH = 64
+# Arrays of a PForDelta encoded column, see pfor_encode
+PFOR_PARTS = ("packed", "offsets", "widths", "xoffsets", "xpos", "xhigh")
+# Values handled at once when packing or unpacking several runs
+BITS_CHUNK = 1 << 16
+
+
+def bit_widths(values) -> np.ndarray:
+    # Exponent of the float is the bit length, exact below 2 ** 53
+    return np.frexp(np.asarray(values, dtype=np.float64))[1].astype(np.int64)
+
+
+def pfor_widths(values, counts, exception_bytes) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.int64)
+    run_ids = np.repeat(np.arange(len(counts)), counts)
+    histogram = np.bincount(
+        run_ids * (MAX_BIT_WIDTH + 1) + bit_widths(values),
+        minlength=len(counts) * (MAX_BIT_WIDTH + 1),
+    ).reshape(len(counts), MAX_BIT_WIDTH + 1)
+    # Values of each run that do not fit in each candidate width
+    exceptions = counts[:, None] - np.cumsum(histogram, axis=1)
+    widths = np.arange(MAX_BIT_WIDTH + 1)
+    sizes = -(-counts[:, None] * widths // 8) + exceptions * exception_bytes
+    return np.argmin(sizes, axis=1)
+
+
+def run_bit_offsets(counts, widths, byte_offsets) -> np.ndarray:
+    # Bit offset of every value, each run starting on its own byte
+    counts = np.asarray(counts, dtype=np.int64)
+    within = np.arange(int(counts.sum())) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    return np.repeat(byte_offsets[:-1] * 8, counts) + within * np.repeat(widths, counts)
+
+
+def pack_bits(values, counts, widths) -> tuple[np.ndarray, np.ndarray]:
+    # Values must already fit the width of their run
+    values = np.asarray(values, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    byte_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(-(-counts * widths // 8), out=byte_offsets[1:])
+    value_widths = np.repeat(widths, counts)
+    bit_offsets = run_bit_offsets(counts, widths, byte_offsets)
+    bits = np.zeros(int(byte_offsets[-1]) * 8, dtype=np.uint8)
+    shifts = np.arange(int(np.max(widths, initial=0)))
+    for start in range(0, len(values), BITS_CHUNK):
+        chunk = slice(start, start + BITS_CHUNK)
+        used = shifts < value_widths[chunk, None]
+        positions = bit_offsets[chunk, None] + shifts
+        bits[positions[used]] = ((values[chunk, None] >> shifts) & 1)[used]
+    return np.packbits(bits, bitorder="little"), byte_offsets
+
+
+def unpack_run(packed, byte_offset, width, count) -> np.ndarray:
+    # A single width makes a run one reshape of its bits
+    if not width:
+        return np.zeros(count, dtype=np.int64)
+    end = byte_offset + -(-count * width // 8)
+    bits = np.unpackbits(
+        packed[byte_offset:end], count=count * width, bitorder="little"
+    )
+    return bits.reshape(count, width) @ (1 << np.arange(width))
+
+
+def unpack_bits(packed, byte_offsets, widths, counts) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.int64)
+    value_widths = np.repeat(widths, counts)
+    bit_offsets = run_bit_offsets(counts, widths, byte_offsets)
+    bits = np.unpackbits(packed, bitorder="little")
+    values = np.zeros(int(counts.sum()), dtype=np.int64)
+    shifts = np.arange(int(np.max(widths, initial=0)))
+    for start in range(0, len(values), BITS_CHUNK):
+        chunk = slice(start, start + BITS_CHUNK)
+        used = shifts < value_widths[chunk, None]
+        positions = np.where(used, bit_offsets[chunk, None] + shifts, 0)
+        values[chunk] = (bits[positions] * used).astype(np.int64) @ (1 << shifts)
+    return values
+
+
+def pfor_encode(values, counts) -> dict[str, np.ndarray]:
+    values = np.asarray(values, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    # Exceptions store their index in the run and their high bits
+    position_dtype = np.min_scalar_type(max(int(np.max(counts, initial=1)) - 1, 0))
+    high_dtype = np.min_scalar_type(int(np.max(values, initial=0)))
+    exception_bytes = position_dtype.itemsize + high_dtype.itemsize
+    widths = pfor_widths(values, counts, exception_bytes)
+
+    value_widths = np.repeat(widths, counts)
+    highs = values >> value_widths
+    exceptional = highs > 0
+    run_ids = np.repeat(np.arange(len(counts)), counts)
+    within = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+    exception_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(run_ids[exceptional], minlength=len(counts)),
+        out=exception_offsets[1:],
+    )
+    packed, byte_offsets = pack_bits(values & ((1 << value_widths) - 1), counts, widths)
+    return {
+        "packed": packed,
+        "offsets": byte_offsets,
+        "widths": widths.astype(np.uint8),
+        "xoffsets": exception_offsets,
+        "xpos": within[exceptional].astype(position_dtype),
+        "xhigh": highs[exceptional].astype(high_dtype),
+    }
+
+
+def pfor_decode_run(encoded, run, count) -> np.ndarray:
+    # encoded maps the names pfor_encode returns to their arrays
+    width = int(encoded["widths"][run])
+    values = unpack_run(encoded["packed"], int(encoded["offsets"][run]), width, count)
+    first = int(encoded["xoffsets"][run])
+    last = int(encoded["xoffsets"][run + 1])
+    if first < last:
+        highs = encoded["xhigh"][first:last].astype(np.int64) << width
+        values[encoded["xpos"][first:last]] |= highs
+    return values
+
+
+def pfor_decode(encoded, counts) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.int64)
+    widths = np.asarray(encoded["widths"], dtype=np.int64)
+    values = unpack_bits(encoded["packed"], encoded["offsets"], widths, counts)
+    exception_counts = np.diff(encoded["xoffsets"])
+    run_starts = np.cumsum(counts) - counts
+    exceptions = np.repeat(run_starts, exception_counts) + encoded["xpos"]
+    values[exceptions] |= encoded["xhigh"].astype(np.int64) << np.repeat(
+        widths, exception_counts
+    )
+    return values
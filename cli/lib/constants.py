@@ -20,6 +20,36 @@ DESCRIPTION_KEY = "description"
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+# Score cells (queries x documents) accumulated at once by batch search
+BM25_BATCH_CELLS = 1 << 24
+# BM25F, per field weights and length normalization
+SEARCH_FIELDS = [TITLE_KEY, DESCRIPTION_KEY]
+BM25F_FIELD_WEIGHTS = {TITLE_KEY: 3.0, DESCRIPTION_KEY: 1.0}
+BM25F_FIELD_B = {TITLE_KEY: 0.5, DESCRIPTION_KEY: 0.75}
+# Bounded memo of Porter stems shared by every analyze call
+STEM_CACHE_SIZE = 100_000
+# Postings a WAND cursor turns into Python lists at a time
+WAND_BLOCK_SIZE = 128
+# Incremental updates trigger a background merge past this many segments
+MAX_INDEX_SEGMENTS = 8
+# BM25 candidates re-scored with term proximity
+PROXIMITY_RERANK_DEPTH = 100
+# Fuzzy matching: minimum token length for one and two edits, how many
+# vocabulary terms a token may expand to and the weight lost per edit
+FUZZY_ONE_EDIT_LENGTH = 3
+FUZZY_TWO_EDITS_LENGTH = 6
+FUZZY_MAX_EXPANSIONS = 5
+FUZZY_DISTANCE_DECAY = 0.5
+# Keyword result cache, dropped whenever the saved index changes
+QUERY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+QUERY_CACHE_PATH = os.path.join(CACHE_PATH, "query_cache.sqlite")
+# Decoded posting runs kept by each compressed index segment
+DECODED_POSTINGS_MAX_BYTES = 32 * 1024 * 1024
+# Stored documents: size of the sampled deflate dictionary, and how many
+# decoded documents each store keeps
+RECORD_DICTIONARY_SIZE = 32 * 1024
+STORED_FIELDS_CACHE_SIZE = 256
+DOCUMENT_STORE_PATH = os.path.join(CACHE_PATH, "documents.store")
 
 # Chunked Semantic search
 MOVIE_INDEX = "movie_idx"
@@ -31,6 +61,52 @@ DESCRIPTION_LEN = "description_len"
 TOTAL_DOCUMENTS = "total_documents"
 SCORE_PRECISION = 4
 DOCUMENT_KEY = "document"
+# Sentences per chunk and sentences shared by neighbouring chunks
+CHUNK_MAX_SENTENCES = 4
+CHUNK_OVERLAP_SENTENCES = 1
+# Movie score from its chunk scores: best chunk, mean of the best
+# CHUNK_POOLING_TOP_N chunks, or a softmax weighted sum at this temperature
+CHUNK_POOLING_MODES = ["max", "mean_top", "softmax"]
+CHUNK_POOLING_TOP_N = 2
+CHUNK_POOLING_TEMPERATURE = 0.1
+# IVF index over chunk embeddings: k-means rounds, training rows sampled
+# per list and rows assigned to lists per matrix product
+IVF_KMEANS_ITERATIONS = 20
+IVF_TRAINING_ROWS_PER_LIST = 256
+IVF_ASSIGN_BATCH = 1 << 14
+CHUNK_IVF_PATH = os.path.join(CACHE_PATH, "chunk_ivf.index")
+# Two stage chunked search ranks movies by one vector each first: the mean
+# of its chunk vectors, kept in this file, or its movie embedding
+DOCUMENT_VECTOR_SOURCES = ["chunk_mean", "documents"]
+CHUNK_CENTROIDS_PATH = os.path.join(CACHE_PATH, "chunk_centroids.vectors")
+# Quantized embeddings: dimensions per PQ subvector (16x smaller than
+# float32 at 256 centroids), codebook training, and rows decoded per block,
+# small enough for the float temporaries to stay in cache. Each result is
+# picked from this many times more candidates rescored with float vectors
+PQ_SUBVECTOR_DIMS = 4
+PQ_CENTROIDS = 256
+PQ_TRAINING_ROWS = 10000
+PQ_KMEANS_ITERATIONS = 10
+QUANTIZED_SCORE_BATCH = 512
+INT8_RESCORE_FACTOR = 4
+PQ_RESCORE_FACTOR = 20
+# Query embeddings kept in memory, and the sqlite file every one is saved to
+EMBEDDING_CACHE_SIZE = 4096
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_PATH, "query_embeddings.sqlite")
+# Embedding builds: texts per encode call, and finished batches between
+# checkpoints of an interrupted build
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_CHECKPOINT_BATCHES = 8
+# Query encoder backends. onnx runs the int8 quantized graph written by
+# export_onnx, accepted when every validation text embeds within
+# ONNX_MIN_COSINE of the torch model. Validation uses the golden queries
+# and this many movies
+ENCODER_BACKENDS = ["torch", "onnx"]
+ONNX_MODEL_PATH = os.path.join(CACHE_PATH, "onnx")
+ONNX_MODEL_FILE = os.path.join("onnx", "model_qint8.onnx")
+ONNX_QUANTIZATION_CONFIG = "avx2"
+ONNX_MIN_COSINE = 0.98
+ONNX_VALIDATION_DOCUMENTS = 256
 
 BM25_SCORE = "bm25_score"
 SEM_SCORE = "semantic_score"
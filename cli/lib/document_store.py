@@ -0,0 +1,117 @@
+import hashlib
+import os
+
+import numpy as np
+
+from .constants import DATA_PATH, DOCUMENT_STORE_PATH, ID_KEY
+from .search_utils import import_json
+from .segment import Segment, StoredFields, write_segment
+
+
+def records_hash(records: list[bytes]) -> str:
+    # Every stored byte in order, each record length prefixed so moving a
+    # boundary changes the hash
+    digest = hashlib.blake2b(digest_size=16)
+    for record in records:
+        digest.update(len(record).to_bytes(8, "little"))
+        digest.update(record)
+    return digest.hexdigest()
+
+
+def source_signature(source_path: str) -> list[int]:
+    stat = os.stat(source_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class DocumentStore:
+    # The movies in input order, kept on disk as compressed records behind an
+    # offsets table. Only the documents a search returns are ever decoded
+    def __init__(self, path=DOCUMENT_STORE_PATH):
+        self.path = path
+        self.fields = None
+        self.doc_ids = None
+        self.doc_order = None
+        self.metadata = dict()
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def is_open(self) -> bool:
+        return self.fields is not None
+
+    def open(self) -> None:
+        segment = Segment(self.path)
+        self.fields = StoredFields(
+            segment.array("record_offsets"),
+            segment.array("records"),
+            segment.array("record_dictionary"),
+        )
+        self.doc_ids = segment.array("doc_ids")
+        self.doc_order = segment.array("doc_order")
+        self.metadata = segment.metadata
+
+    def build(self, documents: list[dict], source_path=None) -> None:
+        records = [StoredFields.encode_document(document) for document in documents]
+        record_offsets, packed_records, dictionary = StoredFields.pack(records)
+        # Documents without an id are stored but never found by id
+        doc_ids = np.array(
+            [document.get(ID_KEY, -1) for document in documents], dtype=np.int64
+        )
+        metadata = {
+            "count": len(documents),
+            "content_hash": records_hash(records),
+            "source": source_signature(source_path) if source_path else None,
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_segment(
+            self.path,
+            {
+                "doc_ids": doc_ids,
+                "doc_order": np.argsort(doc_ids, kind="stable"),
+                "record_offsets": record_offsets,
+                "records": packed_records,
+                "record_dictionary": dictionary,
+            },
+            metadata,
+        )
+        self.open()
+
+    def load(self, documents=None, source_path=DATA_PATH) -> list[dict] | None:
+        # Opens the store, rebuilding it when it no longer holds the given
+        # documents, or without documents those of source_path. The file is
+        # only read when it changed since the store was built from it, and the
+        # documents are returned whenever they had to be in memory
+        if self.exists():
+            self.open()
+        if documents is not None:
+            # Caller documents carry no file signature, unless the store
+            # already holds exactly them
+            if not self.exists() or not self.matches(documents):
+                self.build(documents)
+            return documents
+        if self.exists() and self.metadata["source"] == source_signature(source_path):
+            return None
+        documents = import_json(source_path)
+        self.build(documents, source_path)
+        return documents
+
+    def matches(self, documents: list[dict]) -> bool:
+        # Any edit counts, also one that keeps every length the same
+        if self.metadata["count"] != len(documents):
+            return False
+        records = [StoredFields.encode_document(document) for document in documents]
+        return self.metadata.get("content_hash") == records_hash(records)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __getitem__(self, index) -> dict:
+        return self.fields[index]
+
+    def get(self, doc_id) -> dict | None:
+        position = int(np.searchsorted(self.doc_ids, doc_id, sorter=self.doc_order))
+        if position < len(self.doc_order):
+            index = int(self.doc_order[position])
+            if self.doc_ids[index] == doc_id:
+                return self.fields[index]
+        return None
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import unicodedata
+
+import numpy as np
+
+from .lru_cache import LRUCache
+
+
+def normalize_query(text: str) -> str:
+    # Only changes that cannot change what the model sees: unicode form and
+    # runs of whitespace. Case is kept as not every model is uncased
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    # Query embeddings keyed by model name and normalized text. The most
+    # recent ones stay in memory, every one is also written to an optional
+    # sqlite file so later processes skip the model as well
+    def __init__(self, max_entries: int, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        # Every embedding of a model has the same size, so counting entries
+        # bounds memory
+        self.entries = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        if path is not None:
+            self.__connect()
+
+    def __connect(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        # WAL lets concurrent readers and one writer share the file without
+        # an fsync per insert
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, text TEXT, "
+            "dtype TEXT, vector BLOB, PRIMARY KEY (model, text)) WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.connection.commit()
+
+    def get(self, model_name: str, text: str) -> np.ndarray | None:
+        key = (model_name, normalize_query(text))
+        embedding = self.entries.get(key)
+        if embedding is not None:
+            self.hits += 1
+            return embedding
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT dtype, vector FROM embeddings WHERE model = ? AND text = ?",
+                key,
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                embedding = np.frombuffer(row[1], dtype=row[0])
+                # Promoted so repeats of a stored query skip sqlite
+                self.entries.put(key, embedding)
+                return embedding
+        self.misses += 1
+        return None
+
+    def put(self, model_name: str, text: str, embedding) -> np.ndarray:
+        # Returns the cached array, read only as every hit shares it
+        key = (model_name, normalize_query(text))
+        embedding = np.array(embedding)
+        embedding.flags.writeable = False
+        self.entries.put(key, embedding)
+        if self.connection is not None:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                (*key, embedding.dtype.str, embedding.tobytes()),
+            )
+            self.connection.commit()
+        return embedding
+
+    def stats(self) -> dict:
+        stats = {"hits": self.hits, "misses": self.misses}
+        stats["memory_entries"] = len(self.entries)
+        stats["stored_entries"] = 0
+        if self.connection is not None:
+            for name, value in self.connection.execute(
+                "SELECT name, value FROM counters"
+            ):
+                stats[name] += value
+            stats["stored_entries"] = self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+        return stats
+
+    def close(self) -> None:
+        # Hit and miss counts are added to the stored totals once per process
+        if self.connection is None:
+            return
+        for name, value in (("hits", self.hits), ("misses", self.misses)):
+            self.connection.execute(
+                "INSERT INTO counters VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, value),
+            )
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
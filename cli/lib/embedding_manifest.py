@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import numpy as np
+
+from .vector_search import VECTOR_DTYPE, normalize_rows, read_vectors
+
+# Bumped when the manifest sections change, older builds are then rejected
+MANIFEST_VERSION = 1
+
+
+def content_hash(text: str) -> int:
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def content_hashes(texts: list[str]) -> np.ndarray:
+    return np.array([content_hash(text) for text in texts], dtype=np.uint64)
+
+
+def manifest_settings(model_name: str, **settings) -> dict:
+    # Everything that changes the vectors of the same text. A build made
+    # under other settings is never reused
+    settings["version"] = MANIFEST_VERSION
+    settings["model"] = model_name
+    settings["dtype"] = np.dtype(VECTOR_DTYPE).name
+    return settings
+
+
+def previous_build(path, settings):
+    # The mapped vectors and segment of the last build, if it is compatible
+    if not os.path.isfile(path):
+        return None
+    vectors, segment = read_vectors(path)
+    if segment.metadata.get("settings") != settings:
+        print("Embedding settings changed, rebuilding every vector")
+        return None
+    return vectors, segment
+
+
+def splice_vectors(encode, hashes, texts, previous_vectors, previous_hashes):
+    # Unit rows for every hash. Rows the previous build already has are
+    # copied from it, the rest are encoded in one batch. texts only needs
+    # entries for hashes that may be new, the others can be None
+    previous_rows = dict()
+    if previous_vectors is not None:
+        previous_rows = {
+            content: row for row, content in enumerate(previous_hashes.tolist())
+        }
+    rows = np.array(
+        [previous_rows.get(content, -1) for content in hashes.tolist()],
+        dtype=np.int64,
+    )
+    missing = np.flatnonzero(rows < 0)
+    dims = None
+    if previous_vectors is not None:
+        dims = previous_vectors.shape[1]
+    encoded = None
+    if len(missing):
+        encoded = normalize_rows(encode([texts[index] for index in missing.tolist()]))
+        dims = encoded.shape[1]
+    vectors = np.zeros((len(hashes), dims or 0), dtype=VECTOR_DTYPE)
+    reused = rows >= 0
+    if reused.any():
+        vectors[reused] = previous_vectors[rows[reused]]
+    if encoded is not None:
+        vectors[missing] = encoded
+    return vectors, len(missing)
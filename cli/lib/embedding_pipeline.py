@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .constants import EMBEDDING_BATCH_SIZE, EMBEDDING_CHECKPOINT_BATCHES
+from .embedding_manifest import content_hashes
+from .vector_search import VECTOR_DTYPE
+
+# Model of a pool worker, loaded once per process by load_worker_model
+_worker_model = None
+
+
+def load_worker_model(model_name: str, threads: int) -> None:
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Workers split the cores instead of each using all of them
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def encode_worker_batch(batch: int, texts: list[str]) -> tuple[int, np.ndarray]:
+    return batch, _worker_model.encode(texts, batch_size=len(texts))
+
+
+def length_sorted_batches(texts: list[str], batch_size: int) -> list[np.ndarray]:
+    # Text indexes in batches of similar length, longest first, so little of
+    # each batch is padding and the slowest batches do not finish last
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    return [
+        order[start : start + batch_size] for start in range(0, len(order), batch_size)
+    ]
+
+
+class EmbeddingPipeline:
+    # Encodes the texts of one build into a preallocated float32 file next
+    # to its vectors file. The finished batches are checkpointed in a json
+    # file, only after their rows are flushed, so a build that stopped
+    # resumes from its last checkpoint when it is run again on the same
+    # texts and settings. encode is used in process when workers is 1,
+    # otherwise every worker loads model_name itself
+    def __init__(self, model_name, vectors_path, settings, encode, workers=1):
+        self.model_name = model_name
+        self.settings = settings
+        self.encode_in_process = encode
+        self.workers = workers
+        base = os.path.splitext(vectors_path)[0]
+        self.rows_path = f"{base}.partial"
+        self.checkpoint_path = f"{base}.checkpoint"
+        self.stats = None
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        started = time.perf_counter()
+        batches = length_sorted_batches(texts, EMBEDDING_BATCH_SIZE)
+        state = self.read_checkpoint(self.build_key(texts))
+        done = set(state["done"])
+        rows = None
+        if state["dims"] is not None:
+            rows = np.memmap(
+                self.rows_path, VECTOR_DTYPE, "r+", shape=(len(texts), state["dims"])
+            )
+        if done:
+            print(
+                f"Resuming embedding build, {len(done)} of {len(batches)} batches done"
+            )
+        pending = [batch for batch in range(len(batches)) if batch not in done]
+        pending_texts = sum(len(batches[batch]) for batch in pending)
+        encoded = 0
+        try:
+            for batch, vectors in self.encoded_batches(pending, batches, texts):
+                if rows is None:
+                    state["dims"] = vectors.shape[1]
+                    rows = np.memmap(
+                        self.rows_path,
+                        VECTOR_DTYPE,
+                        "w+",
+                        shape=(len(texts), state["dims"]),
+                    )
+                rows[batches[batch]] = vectors
+                done.add(batch)
+                encoded += len(batches[batch])
+                if len(done) % EMBEDDING_CHECKPOINT_BATCHES == 0:
+                    self.checkpoint(rows, state, done)
+                    rate = encoded / (time.perf_counter() - started)
+                    print(f"Embedded {encoded} of {pending_texts} texts, {rate:.1f}/s")
+        finally:
+            # Whatever finished is kept, also when the build is interrupted
+            if rows is not None:
+                self.checkpoint(rows, state, done)
+        self.stats = {
+            "texts": encoded,
+            "resumed": len(texts) - pending_texts,
+            "seconds": time.perf_counter() - started,
+        }
+        return rows
+
+    def encoded_batches(self, pending, batches, texts):
+        # (batch, vectors) as batches finish, in any order
+        def batch_texts(batch):
+            return [texts[index] for index in batches[batch].tolist()]
+
+        if self.workers <= 1:
+            for batch in pending:
+                yield batch, self.encode_in_process(batch_texts(batch))
+            return
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=load_worker_model,
+            initargs=(self.model_name, threads),
+        ) as executor:
+            futures = [
+                executor.submit(encode_worker_batch, batch, batch_texts(batch))
+                for batch in pending
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def build_key(self, texts: list[str]) -> str:
+        # A checkpoint is only resumed by the same texts, settings and batches
+        key = hashlib.blake2b(digest_size=16)
+        key.update(json.dumps(self.settings, sort_keys=True).encode())
+        key.update(str(EMBEDDING_BATCH_SIZE).encode())
+        key.update(content_hashes(texts).tobytes())
+        return key.hexdigest()
+
+    def read_checkpoint(self, key: str) -> dict:
+        if os.path.isfile(self.checkpoint_path) and os.path.isfile(self.rows_path):
+            with open(self.checkpoint_path) as file:
+                state = json.load(file)
+            if state["key"] == key:
+                return state
+        return {"key": key, "dims": None, "done": []}
+
+    def checkpoint(self, rows, state: dict, done: set) -> None:
+        rows.flush()
+        state["done"] = sorted(done)
+        # Replaced in one rename so a crash never leaves half a checkpoint
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    def finish(self) -> None:
+        # Called once the vectors file is written
+        for path in (self.rows_path, self.checkpoint_path):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def report(self, documents: int) -> None:
+        # Throughput of the texts encoded by this run. After a resume the
+        # documents are counted in proportion to the texts left to encode
+        if not self.stats or not self.stats["texts"]:
+            return
+        texts, seconds = self.stats["texts"], self.stats["seconds"]
+        documents *= texts / (texts + self.stats["resumed"])
+        print(
+            f"Encoded {texts} texts in {seconds:.1f} s: "
+            f"{documents / seconds:.1f} docs/sec, {texts / seconds:.1f} texts/sec"
+        )
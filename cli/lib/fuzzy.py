@@ -0,0 +1,129 @@
+from bisect import bisect_left
+
+from .constants import FUZZY_ONE_EDIT_LENGTH, FUZZY_TWO_EDITS_LENGTH
+
+
+def max_edits_for(token: str) -> int:
+    # Short tokens are too ambiguous to correct, longer ones allow more edits
+    if len(token) >= FUZZY_TWO_EDITS_LENGTH:
+        return 2
+    if len(token) >= FUZZY_ONE_EDIT_LENGTH:
+        return 1
+    return 0
+
+
+class LevenshteinAutomaton:
+    # Accepts every string within max_edits insertions, deletions,
+    # substitutions or adjacent transpositions of word. States are the
+    # Damerau-Levenshtein DP rows (with the previous row and character that a
+    # transposition needs), capped at max_edits + 1 so that there are finitely
+    # many of them and transitions can be memoized like a lazily built DFA
+    def __init__(self, word: str, max_edits: int):
+        self.word = word
+        self.max_edits = max_edits
+        self.transitions = dict()
+
+    def start(self) -> tuple:
+        cap = self.max_edits + 1
+        row = tuple(min(index, cap) for index in range(len(self.word) + 1))
+        return (0, row, None, None)
+
+    def step(self, state: tuple, char: str) -> tuple:
+        key = (state, char)
+        next_state = self.transitions.get(key)
+        if next_state is None:
+            next_state = self.__step(state, char)
+            self.transitions[key] = next_state
+        return next_state
+
+    def __step(self, state: tuple, char: str) -> tuple:
+        depth, row, previous_row, previous_char = state
+        word = self.word
+        max_edits = self.max_edits
+        cap = max_edits + 1
+        depth += 1
+        new_row = [cap] * len(row)
+        if depth < cap:
+            new_row[0] = depth
+        # A cell further than max_edits from the diagonal is always over budget
+        for index in range(
+            max(1, depth - max_edits), min(len(word), depth + max_edits) + 1
+        ):
+            value = row[index] + 1
+            left = new_row[index - 1] + 1
+            if left < value:
+                value = left
+            diagonal = row[index - 1] + (word[index - 1] != char)
+            if diagonal < value:
+                value = diagonal
+            if (
+                previous_row is not None
+                and index > 1
+                and word[index - 1] == previous_char
+                and word[index - 2] == char
+                and previous_row[index - 2] + 1 < value
+            ):
+                value = previous_row[index - 2] + 1
+            new_row[index] = value if value < cap else cap
+        # Only a transposition looks back, drop the previous row when none can
+        # happen so that equal states compare equal
+        if char in word:
+            return (depth, tuple(new_row), row, char)
+        return (depth, tuple(new_row), None, None)
+
+    def distance(self, state: tuple) -> int:
+        return state[1][-1]
+
+    def is_match(self, state: tuple) -> bool:
+        return self.distance(state) <= self.max_edits
+
+    def can_match(self, state: tuple) -> bool:
+        # No extension of the path can come back under the edit budget
+        return min(state[1]) <= self.max_edits
+
+
+class VocabularyTrie:
+    # The sorted term list is an implicit trie: the terms under a prefix are a
+    # contiguous range, and each child's range is found by binary search
+    def __init__(self, terms: list[str]):
+        self.terms = terms
+
+    def __prefix_range(self, prefix: str, low=0, high=None) -> tuple[int, int]:
+        high = len(self.terms) if high is None else high
+        if not prefix:
+            return low, high
+        start = bisect_left(self.terms, prefix, low, high)
+        # Every term with the prefix sorts before the prefix with its last
+        # character bumped
+        successor = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return start, bisect_left(self.terms, successor, start, high)
+
+    def prefix(self, prefix: str, limit=None) -> list[str]:
+        start, end = self.__prefix_range(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.terms[start:end]
+
+    def fuzzy(self, word: str, max_edits: int) -> list[tuple[str, int]]:
+        # Walk the trie with the automaton, dropping a subtree as soon as no
+        # term below it can be within max_edits of word
+        automaton = LevenshteinAutomaton(word, max_edits)
+        matches = []
+        stack = [("", 0, len(self.terms), automaton.start())]
+        while stack:
+            prefix, low, high, state = stack.pop()
+            depth = len(prefix)
+            # A term equal to the prefix sorts first in its range
+            if low < high and len(self.terms[low]) == depth:
+                if automaton.is_match(state):
+                    matches.append((self.terms[low], automaton.distance(state)))
+                low += 1
+            while low < high:
+                char = self.terms[low][depth]
+                child_low, child_high = self.__prefix_range(prefix + char, low, high)
+                child_state = automaton.step(state, char)
+                if automaton.can_match(child_state):
+                    stack.append((prefix + char, child_low, child_high, child_state))
+                low = child_high
+        matches.sort(key=lambda x: (x[1], x[0]))
+        return matches
@@ -5,7 +5,6 @@ from time import sleep
 import traceback
 from sentence_transformers import CrossEncoder
 
-from .search_utils import import_json
 from .constants import (
     BM25_RANK,
     BM25_SCORE,
@@ -29,8 +28,7 @@ CROSS_ENCODER = "cross-encoder/ms-marco-TinyBERT-L2-v2"
 
 
 class HybridSearch:
-    def __init__(self, documents):
-        self.documents = documents
+    def __init__(self, documents=None):
         self.semantic_search = ChunkedSemanticSearch()
         self.semantic_search.load_or_create_embeddings(documents)
 
@@ -41,7 +39,8 @@ class HybridSearch:
 
     def _bm25_search(self, query, limit):
         self.idx.load()
-        return self.idx.bm25_search(query, limit)
+        # Fusion asks for near-complete rankings, where WAND cannot prune
+        return self.idx.bm25_search(query, limit, method="exhaustive")
 
     def weighted_search(self, query, alpha, limit=5):
         bm25_res = self._bm25_search(query, limit * 500)
@@ -99,8 +98,7 @@ def rrf_score(rank, k=60):
 
 
 def weighted_search(query, alpha, limit):
-    documents = import_json()
-    hybrid_search = HybridSearch(documents)
+    hybrid_search = HybridSearch()
     return hybrid_search.weighted_search(query, alpha, limit)
 
 
@@ -113,8 +111,7 @@ def rrf_search(
         query = llm_rewrite(query)
     elif enhance == "expand":
         query = llm_expand(query)
-    documents = import_json()
-    hybrid_search = HybridSearch(documents)
+    hybrid_search = HybridSearch()
     results = hybrid_search.rrf_search(query, k, limit)
     if rerank_method == "individual":
         try:
@@ -1,60 +1,556 @@
+import heapq
+import json
+import math
+import os
+import threading
+import uuid
+from bisect import bisect_right
 from collections import Counter
-
-from .preprocess import preprocess
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from .search_utils import import_json
+from typing import NamedTuple
+
+import numpy as np
+
+from .boolean_query import (
+    And,
+    AndIterator,
+    Not,
+    Or,
+    OrIterator,
+    Phrase,
+    PostingIterator,
+    Term,
+    iterate_matches,
+    parse_query,
+    scoring_tokens,
+)
 from .constants import (
+    BM25_B,
+    BM25_BATCH_CELLS,
+    BM25_K1,
+    BM25F_FIELD_B,
+    BM25F_FIELD_WEIGHTS,
+    CACHE_PATH,
     DOCUMENT_KEY,
-    SCORE_KEY,
-    TITLE_KEY,
-    DESCRIPTION_KEY,
+    FUZZY_DISTANCE_DECAY,
+    FUZZY_MAX_EXPANSIONS,
     ID_KEY,
-    CACHE_PATH,
-    BM25_K1,
-    BM25_B,
+    MAX_INDEX_SEGMENTS,
+    PROXIMITY_RERANK_DEPTH,
+    SCORE_KEY,
+    SEARCH_FIELDS,
 )
-import pickle
-import os
-import math
+from .fuzzy import VocabularyTrie, max_edits_for
+from .preprocess import get_analyzer, preprocess
+from .search_utils import import_json
+from .segment import (
+    IndexSegment,
+    StoredFields,
+    compress_sections,
+    document_sections,
+    postings_sections,
+    write_segment,
+)
+from .vector_search import top_k_indexes
+from .wand import TermCursor, wand_top_k
+
+MANIFEST_VERSION = 1
+
+
+class TermPostings(NamedTuple):
+    # Index-wide dense doc ids, ascending, with their BM25 impacts
+    docs: np.ndarray
+    impacts: np.ndarray
+    upper_bound: float
+    idf: float
+
+
+class FieldPostings(NamedTuple):
+    # Index-wide dense doc ids with length normalized tfs for each field
+    docs: np.ndarray
+    field_ntfs: dict
+    idf: float
+
+
+def bm25_idf(doc_count, term_doc_count):
+    return np.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+
+
+def bm25_impacts(idf, tfs, norms, k1=BM25_K1) -> np.ndarray:
+    tfs = np.asarray(tfs, dtype=np.float64)
+    return idf * (tfs * (k1 + 1)) / (tfs + k1 * norms)
+
+
+def length_norms(doc_lengths, avg_doc_length, b=BM25_B) -> np.ndarray:
+    return 1 - b + b * (doc_lengths / (avg_doc_length or 1.0))
+
+
+def bm25_sections(sections: dict[str, np.ndarray], avg_doc_length) -> dict:
+    term_offsets = sections["term_offsets"]
+    term_doc_counts = np.diff(term_offsets)
+    idfs = bm25_idf(len(sections["doc_ids"]), term_doc_counts)
+    norms = length_norms(sections["doc_lengths"], avg_doc_length)
+    impacts = bm25_impacts(
+        np.repeat(idfs, term_doc_counts), sections["tfs"], norms[sections["postings"]]
+    ).astype(np.float32)
+    # reduceat would give an empty run the next run's value (or fail on a
+    # trailing one), so only runs with postings are reduced
+    max_impacts = np.zeros(len(term_doc_counts), dtype=np.float32)
+    filled = term_doc_counts > 0
+    if filled.any():
+        max_impacts[filled] = np.maximum.reduceat(impacts, term_offsets[:-1][filled])
+    return {"bm25_idfs": idfs, "impacts": impacts, "max_impacts": max_impacts}
+
+
+def top_k(scores: np.ndarray, candidates: np.ndarray, limit) -> list:
+    # (dense id, score) of the best candidates. candidates are ascending, so
+    # ties go to the lower dense id as in wand_top_k
+    top = candidates[top_k_indexes(scores[candidates], limit)]
+    return list(zip(top.tolist(), scores[top].tolist(), strict=True))
+
+
+def bm25f_sections(sections: dict[str, np.ndarray], avg_field_lengths) -> dict:
+    # Length normalized field tfs, a query only weights and saturates them
+    ntfs = dict()
+    for field in SEARCH_FIELDS:
+        norms = length_norms(
+            sections[f"{field}_lengths"], avg_field_lengths[field], BM25F_FIELD_B[field]
+        )
+        ntfs[f"{field}_ntfs"] = (
+            sections[f"{field}_tfs"] / norms[sections["postings"]]
+        ).astype(np.float32)
+    return ntfs
+
+
+def bm25f_impacts(idf, field_ntfs: dict, field_weights: dict, k1=BM25_K1):
+    tf = sum(field_weights[field] * field_ntfs[field] for field in SEARCH_FIELDS)
+    return idf * tf * (k1 + 1) / (tf + k1)
+
+
+def proximity_score(positions: list[np.ndarray], idfs, norm, k1=BM25_K1) -> float:
+    # BM25TP (Buttcher et al.): adjacent occurrences of two different query
+    # terms add the other term's idf over their squared distance, and the
+    # accumulated evidence saturates like a BM25 tf
+    labels = np.repeat(np.arange(len(positions)), [len(p) for p in positions])
+    positions = np.concatenate(positions)
+    order = np.argsort(positions, kind="stable")
+    positions, labels = positions[order], labels[order]
+    pairs = labels[1:] != labels[:-1]
+    left, right = labels[:-1][pairs], labels[1:][pairs]
+    closeness = 1.0 / np.diff(positions)[pairs].astype(np.float64) ** 2
+    accumulators = np.bincount(
+        left, weights=idfs[right] * closeness, minlength=len(idfs)
+    ) + np.bincount(right, weights=idfs[left] * closeness, minlength=len(idfs))
+    saturated = accumulators * (k1 + 1) / (accumulators + k1 * norm)
+    return float(np.sum(np.minimum(1.0, idfs) * saturated))
+
+
+def analyze_documents(
+    movies: list[dict], with_positions=False, record_dictionary=None
+) -> dict:
+    # With record_dictionary the records come back deflated against it, so
+    # build workers compress their own shard of the stored fields
+    vocabulary = dict()
+    term_ids, docs, tfs, positions = [], [], [], []
+    doc_ids, doc_lengths, records = [], [], []
+    field_tfs = {field: [] for field in SEARCH_FIELDS}
+    field_lengths = {field: [] for field in SEARCH_FIELDS}
+    # Fields are analyzed apart, their tokens joined give the document tokens
+    tokenized = {
+        field: get_analyzer().analyze_many([movie[field] for movie in movies])
+        for field in SEARCH_FIELDS
+    }
+    for local_id, movie in enumerate(movies):
+        field_tokens = {field: tokenized[field][local_id] for field in SEARCH_FIELDS}
+        tokens = [token for field in SEARCH_FIELDS for token in field_tokens[field]]
+        doc_ids.append(movie[ID_KEY])
+        doc_lengths.append(len(tokens))
+        records.append(StoredFields.encode_document(movie))
+        if with_positions:
+            occurrences = dict()
+            for position, token in enumerate(tokens):
+                occurrences.setdefault(token, []).append(position)
+            for token_positions in occurrences.values():
+                positions.extend(token_positions)
+            term_frequencies = {
+                token: len(token_positions)
+                for token, token_positions in occurrences.items()
+            }
+        else:
+            term_frequencies = Counter(tokens)
+        doc_terms = list(term_frequencies)
+        term_ids.extend(
+            [vocabulary.setdefault(token, len(vocabulary)) for token in doc_terms]
+        )
+        docs.extend([local_id] * len(doc_terms))
+        tfs.extend(term_frequencies.values())
+        for field in SEARCH_FIELDS:
+            field_counts = Counter(field_tokens[field])
+            field_tfs[field].extend([field_counts.get(token, 0) for token in doc_terms])
+            field_lengths[field].append(len(field_tokens[field]))
+    analyzed = {
+        "terms": list(vocabulary),
+        "term_ids": np.array(term_ids, dtype=np.int64),
+        "docs": np.array(docs, dtype=np.int64),
+        "tfs": np.array(tfs, dtype=np.int64),
+        "doc_ids": np.array(doc_ids, dtype=np.int64),
+        "doc_lengths": np.array(doc_lengths, dtype=np.int64),
+        "records": records,
+        "field_tfs": {
+            field: np.array(values, dtype=np.int64)
+            for field, values in field_tfs.items()
+        },
+        "field_lengths": {
+            field: np.array(values, dtype=np.int64)
+            for field, values in field_lengths.items()
+        },
+    }
+    if with_positions:
+        analyzed["positions"] = np.array(positions, dtype=np.int64)
+    if record_dictionary is not None:
+        analyzed["records"] = StoredFields.deflate(records, record_dictionary)
+        analyzed["record_dictionary"] = record_dictionary
+    return analyzed
+
+
+def merge_postings(parts: list[dict]) -> dict:
+    # Concatenate consecutive document ranges under one sorted vocabulary
+    terms = sorted(set().union(*[part["terms"] for part in parts]))
+    term_index = {term: term_id for term_id, term in enumerate(terms)}
+    term_ids, docs = [], []
+    base = 0
+    for part in parts:
+        remap = np.array([term_index[term] for term in part["terms"]], dtype=np.int64)
+        term_ids.append(remap[part["term_ids"]])
+        docs.append(part["docs"] + base)
+        base += len(part["doc_ids"])
+    merged = {
+        "terms": terms,
+        "term_ids": np.concatenate(term_ids),
+        "docs": np.concatenate(docs),
+        "tfs": np.concatenate([part["tfs"] for part in parts]),
+        "doc_ids": np.concatenate([part["doc_ids"] for part in parts]),
+        "doc_lengths": np.concatenate([part["doc_lengths"] for part in parts]),
+        "records": [record for part in parts for record in part["records"]],
+        "field_tfs": {
+            field: np.concatenate([part["field_tfs"][field] for part in parts])
+            for field in SEARCH_FIELDS
+        },
+        "field_lengths": {
+            field: np.concatenate([part["field_lengths"][field] for part in parts])
+            for field in SEARCH_FIELDS
+        },
+    }
+    if all("positions" in part for part in parts):
+        merged["positions"] = np.concatenate([part["positions"] for part in parts])
+    if all("record_dictionary" in part for part in parts):
+        merged["record_dictionary"] = parts[0]["record_dictionary"]
+    return merged
+
+
+def segment_postings(segment: IndexSegment) -> dict:
+    # Live postings of a segment, renumbered to skip tombstoned documents
+    live_ids = segment.live_ids()
+    remap = np.full(len(segment), -1, dtype=np.int64)
+    remap[live_ids] = np.arange(len(live_ids))
+    term_ids = np.repeat(
+        np.arange(len(segment.terms), dtype=np.int64), np.diff(segment.term_offsets)
+    )
+    docs = remap[segment.column("postings")]
+    keep = docs >= 0
+    # Terms left without a live posting are dropped, segments never hold a
+    # term with an empty run
+    live_terms = np.bincount(term_ids[keep], minlength=len(segment.terms)) > 0
+    term_remap = np.cumsum(live_terms) - 1
+    postings = {
+        "terms": [
+            term for term, live in zip(segment.terms, live_terms, strict=True) if live
+        ],
+        "term_ids": term_remap[term_ids[keep]],
+        "docs": docs[keep],
+        "tfs": segment.column("tfs")[keep].astype(np.int64),
+        "doc_ids": segment.doc_ids[live_ids],
+        "doc_lengths": segment.doc_lengths[live_ids],
+        "records": [segment.documents.record(local_id) for local_id in live_ids],
+        "field_tfs": {
+            field: segment.column(f"{field}_tfs")[keep].astype(np.int64)
+            for field in SEARCH_FIELDS
+        },
+        "field_lengths": {
+            field: lengths[live_ids] for field, lengths in segment.field_lengths.items()
+        },
+    }
+    if segment.has_positions():
+        keep_positions = np.repeat(keep, segment.column("tfs"))
+        postings["positions"] = segment.all_positions()[keep_positions]
+    return postings
+
+
+def create_segment(analyzed: dict, with_bm25: bool, compress=False) -> IndexSegment:
+    sections = postings_sections(
+        analyzed["terms"],
+        analyzed["term_ids"],
+        analyzed["docs"],
+        analyzed["tfs"],
+        analyzed.get("positions"),
+        analyzed["field_tfs"],
+    )
+    sections.update(
+        document_sections(
+            analyzed["doc_ids"],
+            analyzed["doc_lengths"],
+            analyzed["records"],
+            analyzed["field_lengths"],
+            analyzed.get("record_dictionary"),
+        )
+    )
+    doc_count = len(analyzed["doc_ids"])
+    total_length = int(np.sum(analyzed["doc_lengths"]))
+    field_total_lengths = {
+        field: int(np.sum(lengths))
+        for field, lengths in analyzed["field_lengths"].items()
+    }
+    metadata = {
+        "doc_count": doc_count,
+        "total_length": total_length,
+        "field_lengths": field_total_lengths,
+    }
+    if with_bm25:
+        avg_doc_length = total_length / doc_count if doc_count else 0.0
+        avg_field_lengths = {
+            field: length / doc_count if doc_count else 0.0
+            for field, length in field_total_lengths.items()
+        }
+        sections.update(bm25_sections(sections, avg_doc_length))
+        sections.update(bm25f_sections(sections, avg_field_lengths))
+        metadata.update(
+            {
+                "avg_doc_length": avg_doc_length,
+                "avg_field_lengths": avg_field_lengths,
+                "k1": BM25_K1,
+                "b": BM25_B,
+                "field_b": BM25F_FIELD_B,
+            }
+        )
+    if compress:
+        # Float tables per posting outweigh everything else, compressed
+        # segments rebuild them from the tfs of the query terms only
+        for name in ["impacts"] + [f"{field}_ntfs" for field in SEARCH_FIELDS]:
+            sections.pop(name, None)
+        sections = compress_sections(sections)
+    return IndexSegment(sections, metadata)
 
 
 class InvertedIndex:
     def __init__(self):
-        self.index = dict()
-        self.docmap = dict()
-        self.term_frequencies = dict()
-        self.index_path = os.path.join(CACHE_PATH, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_PATH, "docmap.pkl")
-        self.tf_path = os.path.join(CACHE_PATH, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_PATH, "doc_lengths.pkl")
-        self.doc_lengths = dict()
-
-    def __add_document(self, doc_id, text) -> None:
-        tokens = preprocess(text)
-        self.term_frequencies[doc_id] = Counter()
-        self.doc_lengths[doc_id] = len(tokens)
-        for token in tokens:
-            if token not in self.index:
-                self.index[token] = set()
-            self.term_frequencies[doc_id][token] += 1
-            self.index[token].add(doc_id)
-
-    def __get_avg_doc_length(self) -> float:
-        res = 0.0
-        for length in self.doc_lengths.values():
-            res += length
-        if self.doc_lengths:
-            return res / len(self.doc_lengths.keys())
-        else:
-            return res
+        # A document's index-wide dense id is its local id in its segment plus
+        # the number of documents in the segments before it
+        self.segments: list[IndexSegment] = []
+        self.bases = []
+        self.norms = []
+        self.doc_count = 0
+        self.avg_doc_length = 0.0
+        self.avg_field_lengths = dict()
+        self.field_norms = []
+        self.generation = 0
+        self.next_segment = 0
+        self.index_dir = os.path.join(CACHE_PATH, "index")
+        self.index_path = os.path.join(self.index_dir, "manifest.json")
+        self.lock = threading.RLock()
+        self.merge_thread = None
+        # Changes on every save, None while there are unsaved changes
+        self.index_id = None
+        self.query_cache = None
+        self.trie = None
+
+    def __refresh(self) -> None:
+        # Collection statistics always cover the live documents of every segment
+        self.bases = []
+        base = 0
+        total_length = 0
+        field_total_lengths = dict.fromkeys(SEARCH_FIELDS, 0)
+        self.doc_count = 0
+        for segment in self.segments:
+            self.bases.append(base)
+            base += len(segment)
+            self.doc_count += segment.doc_count
+            total_length += segment.total_length
+            for field in SEARCH_FIELDS:
+                field_total_lengths[field] += segment.field_total_length(field)
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count else 0.0
+        self.avg_field_lengths = {
+            field: length / self.doc_count if self.doc_count else 0.0
+            for field, length in field_total_lengths.items()
+        }
+        self.norms = [None] * len(self.segments)
+        self.field_norms = [None] * len(self.segments)
+        self.index_id = None
+        self.trie = None
+
+    def has_positions(self) -> bool:
+        return bool(self.segments) and all(
+            segment.has_positions() for segment in self.segments
+        )
+
+    def is_compressed(self) -> bool:
+        return bool(self.segments) and all(
+            segment.compressed for segment in self.segments
+        )
+
+    def __uses_bm25_tables(self) -> bool:
+        return len(self.segments) == 1 and self.segments[0].has_bm25_tables()
+
+    def __length_norms(self, segment_index) -> np.ndarray:
+        if self.norms[segment_index] is None:
+            self.norms[segment_index] = length_norms(
+                self.segments[segment_index].doc_lengths, self.avg_doc_length
+            )
+        return self.norms[segment_index]
+
+    def __field_length_norms(self, segment_index) -> dict:
+        if self.field_norms[segment_index] is None:
+            segment = self.segments[segment_index]
+            self.field_norms[segment_index] = {
+                field: length_norms(
+                    segment.field_lengths[field],
+                    self.avg_field_lengths[field],
+                    BM25F_FIELD_B[field],
+                )
+                for field in SEARCH_FIELDS
+            }
+        return self.field_norms[segment_index]
+
+    def __field_postings(self, token) -> FieldPostings | None:
+        if self.__uses_bm25_tables():
+            segment = self.segments[0]
+            term_id = segment.terms.get(token)
+            if term_id is None:
+                return None
+            term_slice = segment.term_slice(token)
+            docs = segment.term_column("postings", term_slice)
+            if segment.compressed:
+                norms = self.__field_length_norms(0)
+                field_ntfs = dict()
+                for field in SEARCH_FIELDS:
+                    field_ntfs[field] = segment.cached(
+                        (f"{field}_ntfs", term_id),
+                        lambda field=field: (
+                            segment.term_column(f"{field}_tfs", term_slice)
+                            / norms[field][docs]
+                        ).astype(np.float32),
+                    )
+            else:
+                field_ntfs = {
+                    field: segment.sections[f"{field}_ntfs"][term_slice]
+                    for field in SEARCH_FIELDS
+                }
+            return FieldPostings(
+                docs, field_ntfs, float(segment.sections["bm25_idfs"][term_id])
+            )
+
+        parts = [segment.live_field_postings(token) for segment in self.segments]
+        term_doc_count = sum(len(docs) for docs, _ in parts)
+        if not term_doc_count:
+            return None
+        docs, field_ntfs = [], {field: [] for field in SEARCH_FIELDS}
+        for segment_index, (segment_docs, field_tfs) in enumerate(parts):
+            if not len(segment_docs):
+                continue
+            norms = self.__field_length_norms(segment_index)
+            docs.append(segment_docs.astype(np.int64) + self.bases[segment_index])
+            for field in SEARCH_FIELDS:
+                field_ntfs[field].append(field_tfs[field] / norms[field][segment_docs])
+        return FieldPostings(
+            np.concatenate(docs),
+            {field: np.concatenate(ntfs) for field, ntfs in field_ntfs.items()},
+            float(bm25_idf(self.doc_count, term_doc_count)),
+        )
+
+    def __term_postings(self, token) -> TermPostings | None:
+        if self.__uses_bm25_tables():
+            segment = self.segments[0]
+            term_id = segment.terms.get(token)
+            if term_id is None:
+                return None
+            term_slice = segment.term_slice(token)
+            docs = segment.term_column("postings", term_slice)
+            idf = float(segment.sections["bm25_idfs"][term_id])
+            if segment.compressed:
+                # Only exact while the segment is the whole index, like the
+                # tables it stands in for
+                impacts = segment.cached(
+                    ("impacts", term_id),
+                    lambda: bm25_impacts(
+                        idf,
+                        segment.term_column("tfs", term_slice),
+                        self.__length_norms(0)[docs],
+                    ).astype(np.float32),
+                )
+            else:
+                impacts = segment.sections["impacts"][term_slice]
+            return TermPostings(
+                docs, impacts, float(segment.sections["max_impacts"][term_id]), idf
+            )
+
+        # Several segments or tombstones, score from tfs with index-wide stats
+        parts = [segment.live_postings(token) for segment in self.segments]
+        term_doc_count = sum(len(docs) for docs, _ in parts)
+        if not term_doc_count:
+            return None
+        idf = float(bm25_idf(self.doc_count, term_doc_count))
+        docs, impacts = [], []
+        for segment_index, (segment_docs, tfs) in enumerate(parts):
+            if not len(segment_docs):
+                continue
+            norms = self.__length_norms(segment_index)[segment_docs]
+            docs.append(segment_docs.astype(np.int64) + self.bases[segment_index])
+            impacts.append(bm25_impacts(idf, tfs, norms).astype(np.float32))
+        impacts = np.concatenate(impacts)
+        return TermPostings(np.concatenate(docs), impacts, float(impacts.max()), idf)
+
+    def __locate(self, doc_id) -> tuple[int, int] | None:
+        # Newest segment first, an updated document lives in a later segment
+        for segment_index in reversed(range(len(self.segments))):
+            local_id = self.segments[segment_index].local_id(doc_id)
+            if local_id is not None:
+                return segment_index, local_id
+        return None
+
+    def __segment_of(self, dense_id) -> tuple[int, int]:
+        segment_index = bisect_right(self.bases, dense_id) - 1
+        return segment_index, dense_id - self.bases[segment_index]
+
+    def __document(self, dense_id) -> dict:
+        segment_index, local_id = self.__segment_of(dense_id)
+        return self.segments[segment_index].documents[local_id]
+
+    def __impact(self, doc_id, token) -> float:
+        location = self.__locate(doc_id)
+        term_postings = self.__term_postings(token)
+        if location is None or term_postings is None:
+            return 0.0
+        segment_index, local_id = location
+        dense_id = self.bases[segment_index] + local_id
+        docs = term_postings.docs
+        position = int(np.searchsorted(docs, dense_id))
+        if position < len(docs) and docs[position] == dense_id:
+            return float(term_postings.impacts[position])
+        return 0.0
+
+    def __single_token(self, term) -> str:
+        tokens = preprocess(term)
+        if len(tokens) != 1:
+            raise ValueError("term must be a single token")
+        return tokens[0]
 
     def get_documents(self, term) -> list[str]:
-        res = []
         term = term.lower()
-        if term in self.index:
-            for doc_id in self.index[term]:
-                res.append(doc_id)
-
+        res = []
+        for segment in self.segments:
+            docs, _ = segment.live_postings(term)
+            res.extend(segment.doc_ids[docs].tolist())
         res.sort()
         return res
 
@@ -63,39 +559,46 @@ class InvertedIndex:
         if len(term) > 1:
             raise Exception("More than one number token provided")
         term = term[0]
-        doc_id_counter = self.term_frequencies.get(doc_id)
-        res = 0
-        if doc_id_counter:
-            res = doc_id_counter.get(term)
-        return res if res else 0
+        location = self.__locate(doc_id)
+        if location is None:
+            return 0
+        segment_index, local_id = location
+        segment = self.segments[segment_index]
+        term_slice = segment.term_slice(term)
+        docs = segment.term_column("postings", term_slice)
+        position = int(np.searchsorted(docs, local_id))
+        if position < len(docs) and docs[position] == local_id:
+            return int(segment.term_column("tfs", term_slice)[position])
+        return 0
 
     def get_bm25_tf(self, doc_id, term, k1=BM25_K1, b=BM25_B) -> float:
-        tf = self.get_tf(doc_id, term)
-        length_norm = (
-            1 - b + b * (self.doc_lengths[doc_id] / self.__get_avg_doc_length())
-        )
-        res = (tf * (k1 + 1)) / (tf + k1 * length_norm)
-        return res
+        token = self.__single_token(term)
+        if k1 == BM25_K1 and b == BM25_B:
+            term_postings = self.__term_postings(token)
+            if term_postings is None:
+                return 0.0
+            return self.__impact(doc_id, token) / term_postings.idf
+
+        location = self.__locate(doc_id)
+        if location is None:
+            return 0.0
+        segment_index, local_id = location
+        doc_length = self.segments[segment_index].doc_lengths[local_id]
+        norm = length_norms(doc_length, self.avg_doc_length, b)
+        return float(bm25_impacts(1.0, self.get_tf(doc_id, token), norm, k1))
 
     def get_idf(self, term: str) -> float:
-        tokens = preprocess(term)
-        if len(tokens) != 1:
-            raise ValueError("term must be a single token")
-        token = tokens[0]
-        doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
-        return math.log((doc_count + 1) / (term_doc_count + 1))
+        token = self.__single_token(term)
+        term_doc_count = len(self.get_documents(token))
+        return math.log((self.doc_count + 1) / (term_doc_count + 1))
 
     def get_bm25_idf(self, term: str) -> float:
-        tokens = preprocess(term)
-        if len(tokens) != 1:
-            raise ValueError("term must be a single token")
-        token = tokens[0]
-        doc_count = len(self.docmap)
-        term_doc_count = 0
-        if token in self.index:
-            term_doc_count = len(self.index[token])
-        return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+        token = self.__single_token(term)
+        term_postings = self.__term_postings(token)
+        if term_postings is not None:
+            return term_postings.idf
+        # Unseen terms have a document frequency of zero
+        return float(bm25_idf(self.doc_count, 0))
 
     def get_tfidf(self, doc_id, term) -> float:
         term = preprocess(term)
@@ -107,9 +610,7 @@ class InvertedIndex:
         return tf * idf
 
     def bm25(self, doc_id, term):
-        tf = self.get_bm25_tf(doc_id, term)
-        idf = self.get_bm25_idf(term)
-        return tf * idf
+        return self.__impact(doc_id, self.__single_token(term))
 
     def search(self, term, limit):
         filtered_movies = []
@@ -122,82 +623,541 @@ class InvertedIndex:
                 if doc_id in seen:
                     continue
                 seen.add(doc_id)
-                movie = self.docmap[doc_id]
+                segment_index, local_id = self.__locate(doc_id)
+                movie = self.segments[segment_index].documents[local_id]
                 filtered_movies.append(movie)
                 if len(filtered_movies) >= limit:
                     return filtered_movies
         return filtered_movies
 
-    def bm25_search(self, query, limit) -> list[dict]:
+    def bm25_search(self, query, limit, method="wand", fuzzy=False) -> list[dict]:
         query_tokens = preprocess(query)
-        scores = dict()
-        for token in query_tokens:
-            doc_ids = self.get_documents(token)
-            for doc_id in doc_ids:
-                if not scores.get(doc_id):
-                    scores[doc_id] = 0
-                scores[doc_id] += self.bm25(doc_id, token)
+        use_cache = self.query_cache is not None and self.index_id is not None
+        if use_cache:
+            # BM25 ignores token order, reordered queries share an entry
+            key = (tuple(sorted(query_tokens)), limit, method, fuzzy, BM25_K1, BM25_B)
+            cached = self.query_cache.get(key, self.index_id)
+            if cached is not None:
+                return cached
 
-        sorted_results = sorted(list(scores.items()), key=lambda x: x[1], reverse=True)
+        if fuzzy:
+            term_weights = self.__expand_fuzzy(query_tokens)
+        else:
+            term_weights = Counter(query_tokens)
+        if method == "wand":
+            results = self.__wand_search(term_weights, limit)
+        else:
+            results = self.__exhaustive_search(term_weights, limit)
+        filtered_movies = self.__results(results)
+        if use_cache:
+            self.query_cache.put(key, self.index_id, filtered_movies)
+        return filtered_movies
+
+    def __results(self, results) -> list[dict]:
         filtered_movies = []
-        for result in sorted_results:
+        for dense_id, score in results:
             filtered_movies.append(
-                {DOCUMENT_KEY: self.docmap[result[0]], SCORE_KEY: result[1]}
+                {DOCUMENT_KEY: self.__document(dense_id), SCORE_KEY: score}
             )
-            if len(filtered_movies) == limit:
-                break
         return filtered_movies
 
-    def build(self) -> None:
+    def __dense_count(self) -> int:
+        return self.bases[-1] + len(self.segments[-1]) if self.segments else 0
+
+    def __exhaustive_search(self, term_weights, limit) -> list[tuple[int, float]]:
+        # Term at a time into a dense accumulator. A term's postings hold
+        # each dense id once, so the += scatter needs no np.add.at
+        scores = np.zeros(self.__dense_count(), dtype=np.float32)
+        matched = np.zeros(len(scores), dtype=np.bool_)
+        for token, weight in term_weights.items():
+            term_postings = self.__term_postings(token)
+            if term_postings is None:
+                continue
+            scores[term_postings.docs] += np.float32(weight) * term_postings.impacts
+            matched[term_postings.docs] = True
+        return top_k(scores, np.flatnonzero(matched), limit)
+
+    def bm25_search_batch(self, queries, limit, fuzzy=False) -> list[list[dict]]:
+        query_weights = []
+        for query_tokens in get_analyzer().analyze_many(queries):
+            if fuzzy:
+                query_weights.append(self.__expand_fuzzy(query_tokens))
+            else:
+                query_weights.append(Counter(query_tokens))
+        # Bound the queries x documents accumulator of each batch
+        batch_size = max(1, BM25_BATCH_CELLS // max(1, self.__dense_count()))
+        results = []
+        for start in range(0, len(query_weights), batch_size):
+            batch = query_weights[start : start + batch_size]
+            results.extend(self.__batch_search(batch, limit))
+        return [self.__results(query_results) for query_results in results]
+
+    def __batch_search(self, query_weights, limit) -> list[list[tuple[int, float]]]:
+        # Scores are the queries x terms weights times the terms x documents
+        # impacts, so each distinct term's postings are read once per batch
+        doc_count = self.__dense_count()
+        term_queries = dict()
+        for query_index, term_weights in enumerate(query_weights):
+            for token, weight in term_weights.items():
+                term_queries.setdefault(token, []).append((query_index, weight))
+
+        scores = np.zeros(len(query_weights) * doc_count, dtype=np.float32)
+        for token, uses in term_queries.items():
+            term_postings = self.__term_postings(token)
+            if term_postings is None:
+                continue
+            rows = np.array([query_index for query_index, _ in uses], dtype=np.int64)
+            weights = np.array([weight for _, weight in uses], dtype=np.float32)
+            cells = rows[:, None] * doc_count + term_postings.docs[None, :]
+            scores[cells.ravel()] += np.outer(weights, term_postings.impacts).ravel()
+
+        scores = scores.reshape(len(query_weights), doc_count)
+        # Impacts are positive, so only matched documents score above zero
+        results = []
+        for row in scores:
+            results.append(
+                [
+                    (dense_id, score)
+                    for dense_id, score in top_k(row, np.arange(doc_count), limit)
+                    if score > 0
+                ]
+            )
+        return results
+
+    def __wand_search(self, term_weights, limit) -> list[tuple[int, float]]:
+        cursors = []
+        for token, weight in term_weights.items():
+            term_postings = self.__term_postings(token)
+            if term_postings is None:
+                continue
+            cursors.append(
+                TermCursor(
+                    term_postings.docs,
+                    term_postings.impacts,
+                    weight,
+                    term_postings.upper_bound,
+                )
+            )
+        return wand_top_k(cursors, limit)
+
+    def vocabulary(self) -> VocabularyTrie:
+        if self.trie is None:
+            if len(self.segments) == 1:
+                terms = list(self.segments[0].terms)
+            else:
+                terms = sorted(
+                    set().union(*[segment.terms for segment in self.segments])
+                )
+            self.trie = VocabularyTrie(terms)
+        return self.trie
+
+    def doc_frequency(self, token) -> int:
+        return sum(len(segment.live_postings(token)[0]) for segment in self.segments)
+
+    def prefix_terms(self, prefix, limit=None) -> list[str]:
+        return self.vocabulary().prefix(prefix.lower(), limit)
+
+    def fuzzy_terms(self, token, max_edits=None) -> list[tuple[str, int, int]]:
+        # Vocabulary terms near an analyzed token, with edit distance and df
+        if max_edits is None:
+            max_edits = max_edits_for(token)
+        matches = []
+        for term, distance in self.vocabulary().fuzzy(token, max_edits):
+            term_doc_count = self.doc_frequency(term)
+            # Terms whose documents were all deleted linger in old segments
+            if term_doc_count:
+                matches.append((term, distance, term_doc_count))
+        return matches
+
+    def __expand_fuzzy(self, query_tokens) -> Counter:
+        # A token missing from the index is replaced by its likeliest
+        # corrections. Likelihood grows with df and decays with every edit,
+        # normalized so the expansion weighs as much as the original token
+        term_weights = Counter()
+        for token, count in Counter(query_tokens).items():
+            if self.doc_frequency(token):
+                term_weights[token] += count
+                continue
+            candidates = sorted(self.fuzzy_terms(token), key=lambda x: (x[1], -x[2]))
+            candidates = candidates[:FUZZY_MAX_EXPANSIONS]
+            likelihoods = [
+                FUZZY_DISTANCE_DECAY**distance * term_doc_count
+                for _, distance, term_doc_count in candidates
+            ]
+            total = sum(likelihoods)
+            for (term, _, _), likelihood in zip(candidates, likelihoods, strict=True):
+                term_weights[term] += count * likelihood / total
+        return term_weights
+
+    def bm25f_search(self, query, limit, field_weights=None) -> list[dict]:
+        weights = dict(BM25F_FIELD_WEIGHTS)
+        weights.update(field_weights or dict())
+        scores = np.zeros(self.__dense_count())
+        matched = np.zeros(len(scores), dtype=np.bool_)
+        # Field tfs are combined per posting before saturation, so each
+        # term adds one vector of BM25F scores
+        for token, count in Counter(preprocess(query)).items():
+            field_postings = self.__field_postings(token)
+            if field_postings is None:
+                continue
+            docs = field_postings.docs
+            scores[docs] += count * bm25f_impacts(
+                field_postings.idf, field_postings.field_ntfs, weights
+            )
+            matched[docs] = True
+        return self.__results(top_k(scores, np.flatnonzero(matched), limit))
+
+    def __require_positions(self) -> None:
+        if not self.has_positions():
+            raise ValueError(
+                "Index was built without positions, rebuild with --positions"
+            )
+
+    def phrase_search(self, phrase, limit) -> list[dict]:
+        self.__require_positions()
+        phrase_tokens = preprocess(phrase)
+        if not phrase_tokens:
+            return []
+        dense_ids, phrase_tfs, norms = self.__phrase_postings(phrase_tokens)
+        if not len(dense_ids):
+            return []
+
+        # The phrase is scored like one BM25 term with its own df and tf
+        idf = bm25_idf(self.doc_count, len(dense_ids))
+        scores = bm25_impacts(idf, phrase_tfs, norms)
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return self.__results(
+            zip(dense_ids[order].tolist(), scores[order].tolist(), strict=True)
+        )
+
+    def __phrase_postings(self, phrase_tokens) -> tuple[np.ndarray, ...]:
+        # Index-wide dense ids holding the phrase, phrase tfs and length norms
+        dense_ids, phrase_tfs, norms = [], [], []
+        for segment_index, segment in enumerate(self.segments):
+            local_ids, tfs = self.__phrase_matches(segment, phrase_tokens)
+            dense_ids.append(local_ids + self.bases[segment_index])
+            phrase_tfs.append(tfs)
+            norms.append(self.__length_norms(segment_index)[local_ids])
+        return (
+            np.concatenate(dense_ids),
+            np.concatenate(phrase_tfs),
+            np.concatenate(norms),
+        )
+
+    def __phrase_matches(self, segment, phrase_tokens) -> tuple[np.ndarray, np.ndarray]:
+        # Local ids holding the whole phrase, with how often it occurs in each
+        no_matches = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        term_slices = [segment.term_slice(token) for token in phrase_tokens]
+        if any(term_slice.start == term_slice.stop for term_slice in term_slices):
+            return no_matches
+
+        # Intersect doc lists from the rarest term, positions are only read
+        # for documents that contain every term
+        by_length = sorted(term_slices, key=lambda x: x.stop - x.start)
+        candidates = segment.term_column("postings", by_length[0])
+        if segment.live is not None:
+            candidates = candidates[segment.live[candidates]]
+        for term_slice in by_length[1:]:
+            candidates = np.intersect1d(
+                candidates,
+                segment.term_column("postings", term_slice),
+                assume_unique=True,
+            )
+        if not len(candidates):
+            return no_matches
+
+        # Shift each term back by its offset in the phrase, a start shared by
+        # every term is a match. Keys pack candidate and start in one integer
+        matches = None
+        for offset, term_slice in enumerate(term_slices):
+            positions, counts = segment.term_positions(term_slice, candidates)
+            owners = np.repeat(np.arange(len(candidates), dtype=np.int64), counts)
+            starts = positions - offset
+            keep = starts >= 0
+            keys = (owners[keep] << 32) + starts[keep]
+            matches = (
+                keys
+                if matches is None
+                else np.intersect1d(matches, keys, assume_unique=True)
+            )
+        phrase_tfs = np.bincount(matches >> 32, minlength=len(candidates))
+        found = phrase_tfs > 0
+        return candidates[found].astype(np.int64), phrase_tfs[found]
+
+    def proximity_search(self, query, limit) -> list[dict]:
+        self.__require_positions()
+        query_tokens = preprocess(query)
+        candidates = self.__wand_search(
+            Counter(query_tokens), max(limit, PROXIMITY_RERANK_DEPTH)
+        )
+        query_tokens = list(dict.fromkeys(query_tokens))
+        if len(query_tokens) < 2:
+            return self.__results(candidates[:limit])
+
+        idfs = np.array(
+            [
+                term_postings.idf if term_postings is not None else 0.0
+                for term_postings in map(self.__term_postings, query_tokens)
+            ]
+        )
+        by_segment = dict()
+        for dense_id, score in candidates:
+            segment_index, local_id = self.__segment_of(dense_id)
+            by_segment.setdefault(segment_index, []).append((dense_id, local_id, score))
+
+        results = []
+        for segment_index, hits in by_segment.items():
+            segment = self.segments[segment_index]
+            local_ids = np.array([local_id for _, local_id, _ in hits])
+            # Decode a term's positions for every candidate of the segment at once
+            term_positions = []
+            for token in query_tokens:
+                positions, counts = segment.term_positions(
+                    segment.term_slice(token), local_ids
+                )
+                term_positions.append(np.split(positions, np.cumsum(counts)[:-1]))
+            norms = self.__length_norms(segment_index)[local_ids]
+            for index, (dense_id, _, score) in enumerate(hits):
+                positions = [positions[index] for positions in term_positions]
+                score += proximity_score(positions, idfs, norms[index])
+                results.append((dense_id, score))
+        # Segments are visited in no particular order, ties go to the lower
+        # dense id as everywhere else
+        results.sort(key=lambda x: (-x[1], x[0]))
+        return self.__results(results[:limit])
+
+    def boolean_search(self, query, limit) -> list[dict]:
+        node = parse_query(query)
+        if node is None or limit <= 0:
+            return []
+        postings = dict()
+        matches = iterate_matches(self.__boolean_iterator(node, postings))
+
+        # Only matches are scored, each scoring list gallops to the next match
+        scorers = []
+        for token, weight in Counter(scoring_tokens(node)).items():
+            term_postings = self.__cached_postings(token, postings)
+            if term_postings is not None:
+                scorer = PostingIterator(term_postings.docs)
+                scorers.append((scorer, term_postings.impacts, weight))
+        heap = []
+        for dense_id in matches:
+            score = 0.0
+            for scorer, impacts, weight in scorers:
+                scorer.seek(dense_id)
+                if scorer.doc == dense_id:
+                    score += weight * float(impacts[scorer.position])
+            if len(heap) < limit:
+                heapq.heappush(heap, (score, -dense_id))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -dense_id))
+        heap.sort(reverse=True)
+        return self.__results([(-neg_doc, score) for score, neg_doc in heap])
+
+    def __cached_postings(self, token, postings) -> TermPostings | None:
+        if token not in postings:
+            postings[token] = self.__term_postings(token)
+        return postings[token]
+
+    def __boolean_iterator(self, node, postings):
+        if isinstance(node, Term):
+            term_postings = self.__cached_postings(node.token, postings)
+            docs = term_postings.docs if term_postings is not None else []
+            return PostingIterator(docs)
+        if isinstance(node, Phrase):
+            self.__require_positions()
+            return PostingIterator(self.__phrase_postings(node.tokens)[0])
+        if isinstance(node, Not):
+            # A bare NOT matches every live document except the child's
+            return AndIterator(
+                [self.__live_iterator()],
+                [self.__boolean_iterator(node.child, postings)],
+            )
+        if isinstance(node, Or):
+            return OrIterator(
+                [self.__boolean_iterator(child, postings) for child in node.children]
+            )
+        if isinstance(node, And):
+            includes = [
+                self.__boolean_iterator(child, postings)
+                for child in node.children
+                if not isinstance(child, Not)
+            ]
+            excludes = [
+                self.__boolean_iterator(child.child, postings)
+                for child in node.children
+                if isinstance(child, Not)
+            ]
+            return AndIterator(includes or [self.__live_iterator()], excludes)
+        raise ValueError(f"Unknown query node {node!r}")
+
+    def __live_iterator(self) -> PostingIterator:
+        return PostingIterator(
+            np.concatenate(
+                [
+                    segment.live_ids() + base
+                    for segment, base in zip(self.segments, self.bases, strict=True)
+                ]
+            )
+        )
+
+    def build(self, workers=1, positions=False, compress=False) -> None:
         movies = import_json()
-        for movie in movies:
-            title, description, id = (
-                movie[TITLE_KEY],
-                movie[DESCRIPTION_KEY],
-                movie[ID_KEY],
+        analyze = partial(analyze_documents, with_positions=positions)
+        if workers > 1:
+            # The record dictionary is sampled here from the same movies the
+            # serial build would pick, so workers also deflate their stored
+            # fields and the parent only concatenates them
+            sampled = movies[:: StoredFields.sample_step(len(movies))]
+            analyze = partial(
+                analyze,
+                record_dictionary=StoredFields.sample_dictionary(
+                    [StoredFields.encode_document(movie) for movie in sampled]
+                ),
             )
-            self.docmap[id] = movie
-            text = f"{title} {description}"
-            self.__add_document(id, text)
+            # Contiguous shards keep dense ids in input order, so merging the
+            # partial postings gives exactly the serial index
+            shard_size = max(1, math.ceil(len(movies) / (workers * 4)))
+            shards = [
+                movies[start : start + shard_size]
+                for start in range(0, len(movies), shard_size)
+            ]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                analyzed = merge_postings(list(executor.map(analyze, shards)))
+        else:
+            analyzed = analyze(movies)
+        with self.lock:
+            self.segments = [create_segment(analyzed, True, compress)]
+            self.__refresh()
 
-    def save(self) -> None:
-        cache_path = Path(CACHE_PATH)
-        if not cache_path.is_dir():
-            os.mkdir(CACHE_PATH)
+    def add_documents(self, movies: list[dict]) -> None:
+        # Adding an id that is already indexed replaces the old version
+        with self.lock:
+            with_positions = self.has_positions()
+            compress = self.is_compressed()
+            self.delete_documents([movie[ID_KEY] for movie in movies])
+            if movies:
+                analyzed = analyze_documents(movies, with_positions)
+                self.segments.append(create_segment(analyzed, False, compress))
+            self.__refresh()
 
-        with open(self.index_path, "wb") as file:
-            pickle.dump(self.index, file)
-            file.close()
+    def delete_documents(self, doc_ids) -> int:
+        deleted = 0
+        with self.lock:
+            for doc_id in doc_ids:
+                location = self.__locate(doc_id)
+                if location is None:
+                    continue
+                segment_index, local_id = location
+                self.segments[segment_index].delete([local_id])
+                deleted += 1
+            self.__refresh()
+        return deleted
 
-        with open(self.docmap_path, "wb") as file:
-            pickle.dump(self.docmap, file)
-            file.close()
+    def maybe_merge(self) -> threading.Thread | None:
+        if len(self.segments) > MAX_INDEX_SEGMENTS:
+            return self.merge(background=True)
+        return None
 
-        with open(self.tf_path, "wb") as file:
-            pickle.dump(self.term_frequencies, file)
-            file.close()
+    def merge(self, background=False) -> threading.Thread | None:
+        # Only swaps the segments in memory, saving is left to the caller.
+        # A background merge writes nothing, so it never holds up exit
+        if not background:
+            self.__merge()
+            return None
+        if self.merge_thread is None or not self.merge_thread.is_alive():
+            self.merge_thread = threading.Thread(target=self.__merge, daemon=True)
+            self.merge_thread.start()
+        return self.merge_thread
 
-        with open(self.doc_lengths_path, "wb") as file:
-            pickle.dump(self.doc_lengths, file)
-            file.close()
+    def __merge(self) -> None:
+        with self.lock:
+            segments = list(self.segments)
+            deleted = [segment.deleted for segment in segments]
+            compress = self.is_compressed()
+        if len(segments) == 1 and segments[0].has_bm25_tables():
+            return
 
-    def load(self):
-        if not Path.is_file(Path(self.index_path)):
-            raise Exception("File not found")
-        with open(self.index_path, "rb") as file:
-            self.index = pickle.load(file)
+        # The expensive part runs without the lock so queries and updates go on
+        merged = create_segment(
+            merge_postings([segment_postings(segment) for segment in segments]),
+            True,
+            compress,
+        )
 
-        if not Path.is_file(Path(self.docmap_path)):
-            raise Exception("File not found")
-        with open(self.docmap_path, "rb") as file:
-            self.docmap = pickle.load(file)
+        with self.lock:
+            # Carry over documents deleted while the merge was running
+            for segment, deleted_before in zip(segments, deleted, strict=True):
+                for local_id in np.setdiff1d(segment.deleted, deleted_before):
+                    merged_id = merged.local_id(segment.doc_ids[local_id])
+                    if merged_id is not None:
+                        merged.delete([merged_id])
+            self.segments = [merged] + [
+                segment for segment in self.segments if segment not in segments
+            ]
+            self.__refresh()
 
-        if not Path.is_file(Path(self.tf_path)):
-            raise Exception("File not found")
-        with open(self.tf_path, "rb") as file:
-            self.term_frequencies = pickle.load(file)
+    def save(self) -> None:
+        with self.lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            self.generation += 1
+            for segment in self.segments:
+                if segment.name is None:
+                    segment.name = f"segment_{self.next_segment:06d}.seg"
+                    self.next_segment += 1
+                    write_segment(
+                        os.path.join(self.index_dir, segment.name),
+                        segment.sections,
+                        segment.metadata,
+                    )
+                if segment.deletes_dirty:
+                    # Tombstone files are never rewritten in place
+                    stem = segment.name.removesuffix(".seg")
+                    segment.deletes_name = f"{stem}_{self.generation}.del.npy"
+                    np.save(
+                        os.path.join(self.index_dir, segment.deletes_name),
+                        segment.deleted,
+                    )
+                    segment.deletes_dirty = False
+
+            manifest = {
+                "version": MANIFEST_VERSION,
+                "index_id": uuid.uuid4().hex,
+                "generation": self.generation,
+                "next_segment": self.next_segment,
+                "segments": [
+                    {"name": segment.name, "deletes": segment.deletes_name}
+                    for segment in self.segments
+                ],
+            }
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(manifest, file, indent=2)
+            os.replace(tmp_path, self.index_path)
+            self.index_id = manifest["index_id"]
 
-        if not Path.is_file(Path(self.doc_lengths_path)):
+            # Processes that still map a dropped file keep it until they close it
+            in_use = {"manifest.json"}
+            for segment in self.segments:
+                in_use.update([segment.name, segment.deletes_name])
+            for file_name in os.listdir(self.index_dir):
+                if file_name not in in_use:
+                    os.remove(os.path.join(self.index_dir, file_name))
+
+    def load(self):
+        if not Path.is_file(Path(self.index_path)):
             raise Exception("File not found")
-        with open(self.doc_lengths_path, "rb") as file:
-            self.doc_lengths = pickle.load(file)
+        with open(self.index_path, "r") as file:
+            manifest = json.load(file)
+        if manifest["version"] != MANIFEST_VERSION:
+            raise ValueError("Index manifest version is not supported, rebuild it")
+
+        with self.lock:
+            self.generation = manifest["generation"]
+            self.next_segment = manifest["next_segment"]
+            self.segments = [
+                IndexSegment.open(self.index_dir, entry["name"], entry["deletes"])
+                for entry in manifest["segments"]
+            ]
+            self.__refresh()
+            self.index_id = manifest.get("index_id")
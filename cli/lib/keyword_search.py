@@ -1,6 +1,21 @@
+import atexit
 import math
-from .constants import DEFAULT_SEARCH_LIMIT
+from .constants import DEFAULT_SEARCH_LIMIT, QUERY_CACHE_MAX_BYTES, QUERY_CACHE_PATH
 from .inverted_index import InvertedIndex
+from .preprocess import preprocess
+from .query_cache import QueryCache
+from .search_utils import import_json
+
+_query_cache = None
+
+
+def get_query_cache() -> QueryCache:
+    global _query_cache
+    if _query_cache is None:
+        # Persisted so short lived CLI processes share the cache
+        _query_cache = QueryCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_PATH)
+        atexit.register(_query_cache.close)
+    return _query_cache
 
 
 def search_title(keyword: str, limit=DEFAULT_SEARCH_LIMIT):
@@ -9,15 +24,102 @@ def search_title(keyword: str, limit=DEFAULT_SEARCH_LIMIT):
     return idx.search(keyword, limit)
 
 
-def bm25_search_title(term: str, limit=DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def bm25_search_title(term: str, limit=DEFAULT_SEARCH_LIMIT, fuzzy=False) -> list[dict]:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    inverted_index.query_cache = get_query_cache()
+    return inverted_index.bm25_search(term, limit, fuzzy=fuzzy)
+
+
+def bm25_search_batch(queries: list[str], limit=DEFAULT_SEARCH_LIMIT) -> list:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    return inverted_index.bm25_search_batch(queries, limit)
+
+
+def prefix_terms(prefix: str, limit=DEFAULT_SEARCH_LIMIT) -> list[str]:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    return inverted_index.prefix_terms(prefix, limit)
+
+
+def fuzzy_terms(term: str) -> list[tuple[str, int, int]]:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    return [
+        match
+        for token in preprocess(term)
+        for match in inverted_index.fuzzy_terms(token)
+    ]
+
+
+def query_cache_stats() -> dict:
+    return get_query_cache().stats()
+
+
+def bm25f_search_title(
+    query: str, field_weights=None, limit=DEFAULT_SEARCH_LIMIT
+) -> list[dict]:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    return inverted_index.bm25f_search(query, limit, field_weights)
+
+
+def phrase_search_title(phrase: str, limit=DEFAULT_SEARCH_LIMIT) -> list[dict]:
     inverted_index = InvertedIndex()
     inverted_index.load()
-    return inverted_index.bm25_search(term, limit)
+    return inverted_index.phrase_search(phrase, limit)
 
 
-def build():
+def proximity_search_title(query: str, limit=DEFAULT_SEARCH_LIMIT) -> list[dict]:
     inverted_index = InvertedIndex()
-    inverted_index.build()
+    inverted_index.load()
+    return inverted_index.proximity_search(query, limit)
+
+
+def boolean_search_title(query: str, limit=DEFAULT_SEARCH_LIMIT) -> list[dict]:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    return inverted_index.boolean_search(query, limit)
+
+
+def build(workers=1, positions=False, compress=False):
+    inverted_index = InvertedIndex()
+    inverted_index.build(workers, positions, compress)
+    inverted_index.save()
+
+
+def add_documents(path: str) -> int:
+    movies = import_json(path)
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    inverted_index.add_documents(movies)
+    inverted_index.save()
+    save_merge(inverted_index)
+    return len(movies)
+
+
+def delete_document(doc_id) -> int:
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    deleted = inverted_index.delete_documents([doc_id])
+    inverted_index.save()
+    save_merge(inverted_index)
+    return deleted
+
+
+def save_merge(inverted_index: InvertedIndex) -> None:
+    # The change is saved before merging, the merged segments once it is done
+    merging = inverted_index.maybe_merge()
+    if merging is not None:
+        merging.join()
+        inverted_index.save()
+
+
+def merge():
+    inverted_index = InvertedIndex()
+    inverted_index.load()
+    inverted_index.merge()
     inverted_index.save()
 
 
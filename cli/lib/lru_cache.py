@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Values up to a total weight, weigh(value) each (1 by default, so the
+    # capacity counts entries). A read renews its entry and every put
+    # evicts the least recently used ones until the total fits again. A
+    # value heavier than the whole capacity is not kept. Values are never None
+    def __init__(self, capacity, weigh=None):
+        self.capacity = capacity
+        self.weigh = weigh or (lambda value: 1)
+        self.entries = OrderedDict()
+        self.weight = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        if key in self.entries:
+            self.weight -= self.weigh(self.entries.pop(key))
+        weight = self.weigh(value)
+        if weight > self.capacity:
+            return
+        self.entries[key] = value
+        self.weight += weight
+        while self.weight > self.capacity:
+            _, evicted = self.entries.popitem(last=False)
+            self.weight -= self.weigh(evicted)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.weight = 0
+
+    def items(self):
+        # Least recently used first, putting them back in order keeps it
+        return self.entries.items()
+
+    def __len__(self) -> int:
+        return len(self.entries)
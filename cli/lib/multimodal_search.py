@@ -2,9 +2,8 @@ from PIL import Image
 from sentence_transformers import SentenceTransformer
 
 from .search_utils import import_json
-from .constants import SCORE_KEY, TITLE_KEY, DESCRIPTION_KEY
-
-import numpy as np
+from .constants import DEFAULT_SEARCH_LIMIT, SCORE_KEY, TITLE_KEY, DESCRIPTION_KEY
+from .vector_search import cosine_top_k, normalize_rows
 
 
 class MultimodalSearch:
@@ -14,7 +13,9 @@ class MultimodalSearch:
             f"{document[TITLE_KEY]}: {document[DESCRIPTION_KEY]}"
             for document in documents
         ]
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        self.text_embeddings = normalize_rows(
+            self.model.encode(self.texts, show_progress_bar=True)
+        )
         print(self.text_embeddings[0].shape)
 
     def embed_image(self, image_path: str):
@@ -26,14 +27,13 @@ class MultimodalSearch:
         embeddings = self.model.encode([image.convert("RGB")], show_progress_bar=True)
         return embeddings
 
-    def search_with_image(self, image_path):
+    def search_with_image(self, image_path, limit=DEFAULT_SEARCH_LIMIT):
         image_embedding = self.embed_image(image_path)
         if len(image_embedding) <= 0:
             return []
+        indexes, scores = cosine_top_k(self.text_embeddings, image_embedding[0], limit)
         results = []
-        for index, text_embedding in enumerate(self.text_embeddings):
-            similarity = cosine_similarity(image_embedding, text_embedding)
-            print("Similarity is: ", similarity)
+        for index, similarity in zip(indexes.tolist(), scores.tolist(), strict=True):
             text_split = self.texts[index].split(": ")
             title = text_split[0]
             description = ": ".join(text_split[1:])
@@ -41,10 +41,9 @@ class MultimodalSearch:
                 {
                     TITLE_KEY: title,
                     DESCRIPTION_KEY: description,
-                    SCORE_KEY: similarity[0],
+                    SCORE_KEY: similarity,
                 }
             )
-        results.sort(key=lambda x: x[SCORE_KEY], reverse=True)
         return results
 
 
@@ -60,20 +59,7 @@ def search_with_image(image_path):
     documents = import_json()
     multimodal_search = MultimodalSearch(documents)
     results = multimodal_search.search_with_image(image_path)
-    for index, i in enumerate(range(5)):
-        print(
-            f"{index}. {results[index][TITLE_KEY]} (similarity: {results[index][SCORE_KEY]:.3f})"
-        )
-        print(results[index][DESCRIPTION_KEY])
+    for index, result in enumerate(results):
+        print(f"{index}. {result[TITLE_KEY]} (similarity: {result[SCORE_KEY]:.3f})")
+        print(result[DESCRIPTION_KEY])
         print("\n")
-
-
-def cosine_similarity(vec1, vec2) -> float:
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return dot_product / (norm1 * norm2)
@@ -0,0 +1,119 @@
+import json
+import os
+
+import numpy as np
+
+from .constants import (
+    ONNX_MIN_COSINE,
+    ONNX_MODEL_FILE,
+    ONNX_MODEL_PATH,
+    ONNX_QUANTIZATION_CONFIG,
+)
+from .vector_search import normalize_rows
+
+ONNX_INSTALL_HINT = 'install it with `uv pip install "sentence-transformers[onnx]"`'
+
+
+def onnx_model_path(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_PATH, model_name)
+
+
+class OnnxEncoder:
+    # A model written by export_quantized_onnx, run with onnxruntime and the
+    # fast tokenizer only. Neither torch nor sentence_transformers is
+    # imported, which is most of the torch backend's cold start
+    def __init__(self, model_path: str):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as error:
+            raise ValueError(
+                f"The onnx backend needs onnxruntime, {ONNX_INSTALL_HINT}"
+            ) from error
+
+        with open(os.path.join(model_path, "sentence_bert_config.json")) as file:
+            max_length = json.load(file)["max_seq_length"]
+        with open(os.path.join(model_path, "1_Pooling", "config.json")) as file:
+            if not json.load(file).get("pooling_mode_mean_tokens"):
+                raise ValueError("The onnx backend only supports mean pooled models")
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, ONNX_MODEL_FILE),
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+    def encode(self, texts) -> np.ndarray:
+        # Same output as SentenceTransformer.encode: mean of the token
+        # embeddings under the attention mask, normalized
+        encodings = self.tokenizer.encode_batch(list(texts))
+        inputs = {
+            "input_ids": [encoding.ids for encoding in encodings],
+            "attention_mask": [encoding.attention_mask for encoding in encodings],
+            "token_type_ids": [encoding.type_ids for encoding in encodings],
+        }
+        inputs = {
+            name: np.array(values, dtype=np.int64)
+            for name, values in inputs.items()
+            if name in self.input_names
+        }
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(
+            mask.sum(axis=1), 1e-9
+        )
+        return normalize_rows(pooled)
+
+
+def export_quantized_onnx(model_name: str, texts: list[str]) -> dict:
+    # One off: sentence-transformers exports the model to ONNX, its weights
+    # are quantized to int8, then both backends encode texts. The export
+    # is only used once every text's cosine is within ONNX_MIN_COSINE
+    try:
+        from sentence_transformers import (
+            SentenceTransformer,
+            export_dynamic_quantized_onnx_model,
+        )
+
+        path = onnx_model_path(model_name)
+        onnx_model = SentenceTransformer(model_name, backend="onnx")
+        onnx_model.save(path)
+        export_dynamic_quantized_onnx_model(
+            onnx_model, ONNX_QUANTIZATION_CONFIG, path, file_suffix="qint8"
+        )
+    except ImportError as error:
+        raise ValueError(
+            f"Exporting to onnx needs optimum, {ONNX_INSTALL_HINT}"
+        ) from error
+
+    reference = normalize_rows(SentenceTransformer(model_name).encode(texts))
+    cosines = np.sum(reference * OnnxEncoder(path).encode(texts), axis=1)
+    validation = {
+        "model": model_name,
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "tolerance": ONNX_MIN_COSINE,
+    }
+    validation["passed"] = validation["min_cosine"] >= ONNX_MIN_COSINE
+    with open(os.path.join(path, "validation.json"), "w") as file:
+        json.dump(validation, file)
+    return validation
+
+
+def load_onnx_encoder(model_name: str) -> OnnxEncoder:
+    path = onnx_model_path(model_name)
+    validation_path = os.path.join(path, "validation.json")
+    if not os.path.isfile(validation_path):
+        raise ValueError("No onnx model exported. Run `export_onnx` first.")
+    with open(validation_path) as file:
+        validation = json.load(file)
+    if not validation["passed"]:
+        raise ValueError(
+            f"The onnx model is off by up to {1 - validation['min_cosine']:.4f} "
+            f"in cosine, more than {1 - validation['tolerance']:.4f}"
+        )
+    return OnnxEncoder(path)
@@ -1,24 +1,40 @@
 import string
+from functools import lru_cache
+from .constants import STEM_CACHE_SIZE
 from .search_utils import load_stopwords
 from nltk.stem import PorterStemmer
 
 
+class Analyzer:
+    def __init__(self, stopwords=None, stem_cache_size=STEM_CACHE_SIZE):
+        # Resources are loaded once and shared by every call
+        if stopwords is None:
+            stopwords = load_stopwords()
+        self.stopwords = frozenset(stopwords)
+        self.table = str.maketrans("", "", string.punctuation)
+        self.stemmer = PorterStemmer()
+        # Vocabulary is Zipfian, so a bounded cache answers most stems
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def analyze(self, text: str) -> list[str]:
+        # Lowercase, drop punctuation, split, remove stopwords and stem
+        words = text.lower().translate(self.table).split()
+        return [self.stem(word) for word in words if word not in self.stopwords]
+
+    def analyze_many(self, texts: list[str]) -> list[list[str]]:
+        analyze = self.analyze
+        return [analyze(text) for text in texts]
+
+
+_analyzer = None
+
+
+def get_analyzer() -> Analyzer:
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = Analyzer()
+    return _analyzer
+
+
 def preprocess(word: str):
-    # Change the case of all characters
-    word = word.lower()
-
-    # Create a maketrans that removes all the punctuations
-    table = str.maketrans("", "", string.punctuation)
-    # Remove all the punctuations
-    word = word.translate(table)
-
-    # Tokenize the words into a list of strings
-    tokens = [x for x in word.split() if x]
-
-    # Remove st op words
-    stopwords = load_stopwords()
-    tokens = list(filter(lambda x: x not in stopwords, tokens))
-    stemmer = PorterStemmer()
-    for index in range(len(tokens)):
-        tokens[index] = stemmer.stem(tokens[index])
-    return tokens
+    return get_analyzer().analyze(word)
@@ -0,0 +1,202 @@
+import os
+
+import numpy as np
+
+from .constants import (
+    INT8_RESCORE_FACTOR,
+    PQ_CENTROIDS,
+    PQ_KMEANS_ITERATIONS,
+    PQ_RESCORE_FACTOR,
+    PQ_SUBVECTOR_DIMS,
+    PQ_TRAINING_ROWS,
+    QUANTIZED_SCORE_BATCH,
+)
+from .document_store import source_signature
+from .segment import Segment, write_segment
+from .vector_search import read_vectors, top_k_indexes
+
+
+class ScalarQuantizer:
+    # One signed byte per dimension, 4x smaller than float32. Each dimension
+    # maps its own min..max range onto the 256 codes
+    kind = "int8"
+    rescore_factor = INT8_RESCORE_FACTOR
+
+    def __init__(self, sections, metadata):
+        self.codes = sections["codes"].reshape(metadata["rows"], metadata["dims"])
+        self.offsets = sections["offsets"]
+        self.scales = sections["scales"]
+        self.metadata = metadata
+
+    @classmethod
+    def train(cls, unit_vectors) -> "ScalarQuantizer":
+        low = unit_vectors.min(axis=0)
+        scales = (unit_vectors.max(axis=0) - low) / 255
+        scales[scales == 0] = 1
+        codes = np.zeros(unit_vectors.shape, dtype=np.int8)
+        for start in range(0, len(unit_vectors), QUANTIZED_SCORE_BATCH):
+            batch = slice(start, start + QUANTIZED_SCORE_BATCH)
+            codes[batch] = np.rint((unit_vectors[batch] - low) / scales) - 128
+        # A value is offsets + scales * code
+        sections = {
+            "codes": codes,
+            "offsets": (low + 128 * scales).astype(np.float32),
+            "scales": scales.astype(np.float32),
+        }
+        return cls(sections, quantizer_metadata(cls.kind, unit_vectors))
+
+    def sections(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes, "offsets": self.offsets, "scales": self.scales}
+
+    def scores(self, unit_query, rows=None) -> np.ndarray:
+        bias = float(self.offsets @ unit_query)
+        weights = (self.scales * unit_query).astype(np.float32)
+        return score_blocks(
+            self.codes, rows, lambda codes: codes.astype(np.float32) @ weights + bias
+        )
+
+
+class ProductQuantizer:
+    # Each row is cut into subvectors of PQ_SUBVECTOR_DIMS and every
+    # subvector is stored as the byte id of its nearest codebook centroid.
+    # Queries are scored by asymmetric distance: one table of query x
+    # centroid dot products per subspace, then a row's score is the sum of
+    # its codes' table entries
+    kind = "pq"
+    rescore_factor = PQ_RESCORE_FACTOR
+
+    def __init__(self, sections, metadata):
+        subspaces = metadata["subspaces"]
+        self.codes = sections["codes"].reshape(metadata["rows"], subspaces)
+        self.codebooks = sections["codebooks"].reshape(subspaces, -1, PQ_SUBVECTOR_DIMS)
+        self.metadata = metadata
+
+    @classmethod
+    def train(cls, unit_vectors, seed=0) -> "ProductQuantizer":
+        rng = np.random.default_rng(seed)
+        training = unit_vectors
+        if len(unit_vectors) > PQ_TRAINING_ROWS:
+            sample = rng.choice(len(unit_vectors), PQ_TRAINING_ROWS, replace=False)
+            training = unit_vectors[np.sort(sample)]
+        codebooks = batched_kmeans(
+            split_subvectors(training), PQ_CENTROIDS, PQ_KMEANS_ITERATIONS, rng
+        )
+        codes = np.zeros((len(unit_vectors), len(codebooks)), dtype=np.uint8)
+        for start in range(0, len(unit_vectors), QUANTIZED_SCORE_BATCH):
+            batch = slice(start, start + QUANTIZED_SCORE_BATCH)
+            codes[batch] = nearest_codes(
+                split_subvectors(unit_vectors[batch]), codebooks
+            ).T
+        metadata = quantizer_metadata(cls.kind, unit_vectors)
+        metadata["subspaces"] = len(codebooks)
+        return cls({"codes": codes, "codebooks": codebooks}, metadata)
+
+    def sections(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes, "codebooks": self.codebooks}
+
+    def scores(self, unit_query, rows=None) -> np.ndarray:
+        query = split_subvectors(unit_query[None, :])[:, 0, :]
+        table = np.einsum("mks,ms->mk", self.codebooks, query).ravel()
+        # Offset of each subspace's row in the flattened table
+        offsets = np.arange(len(self.codebooks)) * self.codebooks.shape[1]
+        return score_blocks(
+            self.codes, rows, lambda codes: table[codes + offsets].sum(axis=1)
+        )
+
+
+QUANTIZERS = {
+    quantizer.kind: quantizer for quantizer in (ScalarQuantizer, ProductQuantizer)
+}
+
+
+def quantizer_metadata(kind, unit_vectors) -> dict:
+    return {"kind": kind, "rows": len(unit_vectors), "dims": unit_vectors.shape[1]}
+
+
+def score_blocks(codes, rows, score) -> np.ndarray:
+    # Decoding a block at a time keeps the float temporaries small
+    count = len(codes) if rows is None else len(rows)
+    scores = np.zeros(count, dtype=np.float32)
+    for start in range(0, count, QUANTIZED_SCORE_BATCH):
+        batch = slice(start, start + QUANTIZED_SCORE_BATCH)
+        scores[batch] = score(codes[batch] if rows is None else codes[rows[batch]])
+    return scores
+
+
+def split_subvectors(vectors) -> np.ndarray:
+    # (subspaces, rows, PQ_SUBVECTOR_DIMS), zero padded to whole subvectors
+    vectors = np.asarray(vectors, dtype=np.float32)
+    padding = -vectors.shape[1] % PQ_SUBVECTOR_DIMS
+    if padding:
+        vectors = np.pad(vectors, ((0, 0), (0, padding)))
+    subvectors = vectors.reshape(len(vectors), -1, PQ_SUBVECTOR_DIMS)
+    return np.ascontiguousarray(subvectors.transpose(1, 0, 2))
+
+
+def nearest_codes(subvectors, codebooks) -> np.ndarray:
+    # argmin |x - c|^2 is argmax x.c - |c|^2 / 2, for every subspace at once
+    half_norms = 0.5 * np.einsum("mks,mks->mk", codebooks, codebooks)[:, None, :]
+    transposed = codebooks.transpose(0, 2, 1)
+    codes = np.zeros(subvectors.shape[:2], dtype=np.int64)
+    for start in range(0, subvectors.shape[1], QUANTIZED_SCORE_BATCH):
+        batch = slice(start, start + QUANTIZED_SCORE_BATCH)
+        scores = subvectors[:, batch] @ transposed - half_norms
+        codes[:, batch] = np.argmax(scores, axis=2)
+    return codes
+
+
+def batched_kmeans(subvectors, n_clusters, iterations, rng) -> np.ndarray:
+    # Euclidean k-means run on every subspace together. A centroid that
+    # loses all its rows stays where it was
+    subspaces, rows, dims = subvectors.shape
+    n_clusters = min(n_clusters, rows)
+    seeds = np.sort(rng.choice(rows, n_clusters, replace=False))
+    centroids = subvectors[:, seeds].copy()
+    cells = subspaces * n_clusters
+    for _ in range(iterations):
+        assignments = nearest_codes(subvectors, centroids)
+        flat = (assignments + np.arange(subspaces)[:, None] * n_clusters).ravel()
+        counts = np.bincount(flat, minlength=cells).reshape(subspaces, n_clusters)
+        sums = np.stack(
+            [
+                np.bincount(flat, subvectors[..., dim].ravel(), cells)
+                for dim in range(dims)
+            ],
+            axis=-1,
+        ).reshape(subspaces, n_clusters, dims)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled][:, None]
+    return centroids.astype(np.float32)
+
+
+def quantized_path(vectors_path, kind) -> str:
+    return f"{os.path.splitext(vectors_path)[0]}.{kind}"
+
+
+def load_or_create_quantizer(vectors_path, kind):
+    # Codes live next to the vectors file they were trained on and are
+    # retrained whenever that file changed
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization {kind!r}")
+    path = quantized_path(vectors_path, kind)
+    signature = source_signature(vectors_path)
+    if os.path.isfile(path):
+        segment = Segment(path)
+        if segment.metadata["source"] == signature:
+            sections = {name: segment.array(name) for name in segment.sections}
+            return QUANTIZERS[kind](sections, segment.metadata)
+    print(f"Quantizing {os.path.basename(vectors_path)} to {kind}")
+    quantizer = QUANTIZERS[kind].train(read_vectors(vectors_path)[0])
+    quantizer.metadata["source"] = signature
+    write_segment(path, quantizer.sections(), quantizer.metadata)
+    return quantizer
+
+
+def rescored_top_k(quantizer, vectors, unit_query, limit, rows=None):
+    # First pass on the codes, then the best limit * rescore_factor
+    # candidates are scored again with their unit float vectors. Returns
+    # the candidate rows in row order with their exact scores
+    approximate = quantizer.scores(unit_query, rows)
+    candidates = top_k_indexes(approximate, limit * quantizer.rescore_factor)
+    candidates = np.sort(candidates if rows is None else rows[candidates])
+    return candidates, vectors[candidates] @ unit_query
@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import time
+
+from .lru_cache import LRUCache
+
+
+class QueryCache:
+    # Search results keyed by query, only valid for the index version they
+    # were computed on. Recent ones stay in memory, every one is also kept
+    # in an optional sqlite file. Processes sharing the file update single
+    # rows, and loading a row never runs code the way unpickling could
+    def __init__(self, max_bytes: int, path=None):
+        # Results are stored as JSON text, which gives an exact size for the
+        # budget and hands every caller its own copy
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = LRUCache(max_bytes, len)
+        self.index_id = None
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+        if path is not None:
+            self.__connect()
+
+    def __connect(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+            "index_id TEXT, result TEXT, used INTEGER) WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.connection.commit()
+
+    def __validate(self, index_id) -> None:
+        # Entries only hold for the index version they were computed on
+        if index_id != self.index_id:
+            self.entries.clear()
+            self.index_id = index_id
+            if self.connection is not None:
+                self.connection.execute(
+                    "DELETE FROM results WHERE index_id != ?", (index_id,)
+                )
+                self.connection.commit()
+
+    def get(self, key, index_id):
+        self.__validate(index_id)
+        key = json.dumps(key)
+        text = self.entries.get(key)
+        if text is None and self.connection is not None:
+            row = self.connection.execute(
+                "SELECT result FROM results WHERE key = ? AND index_id = ?",
+                (key, index_id),
+            ).fetchone()
+            if row is not None:
+                text = row[0]
+                self.entries.put(key, text)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.connection is not None:
+            self.connection.execute(
+                "UPDATE results SET used = ? WHERE key = ?", (time.time_ns(), key)
+            )
+            self.connection.commit()
+        return json.loads(text)
+
+    def put(self, key, index_id, result) -> None:
+        self.__validate(index_id)
+        key = json.dumps(key)
+        text = json.dumps(result)
+        self.entries.put(key, text)
+        if self.connection is not None:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, index_id, text, time.time_ns()),
+            )
+            self.__evict()
+            self.connection.commit()
+
+    def __evict(self) -> None:
+        # The file keeps to max_bytes as well, least recently used rows first.
+        # JSON text is ASCII, so its length is its size in bytes
+        total = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(result)), 0) FROM results"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self.connection.execute(
+            "SELECT key, LENGTH(result) FROM results ORDER BY used"
+        ):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM results WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM results")
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.entries.weight,
+        }
+        if self.connection is not None:
+            for name, value in self.connection.execute(
+                "SELECT name, value FROM counters"
+            ):
+                stats[name] += value
+            stats["entries"], stats["bytes"] = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(result)), 0) FROM results"
+            ).fetchone()
+        return stats
+
+    def close(self) -> None:
+        # Hit and miss counts are added to the stored totals once per process
+        if self.connection is None:
+            return
+        for name, value in (("hits", self.hits), ("misses", self.misses)):
+            self.connection.execute(
+                "INSERT INTO counters VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, value),
+            )
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
@@ -9,9 +9,9 @@ from .constants import (
 import regex as re
 
 
-def import_json():
+def import_json(path=DATA_PATH):
     json_dict = {}
-    with open(DATA_PATH, "r") as f:
+    with open(path, "r") as f:
         json_dict = json.load(f)
 
     return json_dict[MOVIEKEY]
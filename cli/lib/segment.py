@@ -0,0 +1,540 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from operator import attrgetter
+
+import numpy as np
+
+from .codec import (
+    PFOR_PARTS,
+    delta_decode,
+    delta_encode,
+    pfor_decode,
+    pfor_decode_run,
+    pfor_encode,
+    run_starts,
+    varint_decode,
+    varint_encode,
+    varint_lengths,
+)
+from .constants import (
+    DECODED_POSTINGS_MAX_BYTES,
+    RECORD_DICTIONARY_SIZE,
+    SEARCH_FIELDS,
+    STORED_FIELDS_CACHE_SIZE,
+)
+from .lru_cache import LRUCache
+
+SEGMENT_MAGIC = b"SBSEG\x00\x00\x00"
+SEGMENT_VERSION = 2
+# Every section starts on a 64 byte boundary so NumPy views stay aligned
+SECTION_ALIGNMENT = 64
+
+# magic, version, section count
+HEADER = struct.Struct("<8sII")
+# name, dtype, offset, element count
+SECTION_NAME_SIZE = 24
+SECTION_ENTRY = struct.Struct(f"<{SECTION_NAME_SIZE}s8sQQ")
+
+
+def _align(offset: int) -> int:
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+def write_segment(path: str, sections: dict[str, np.ndarray], metadata: dict) -> None:
+    sections = dict(sections)
+    sections["metadata"] = np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8)
+
+    entries = []
+    offset = _align(HEADER.size + SECTION_ENTRY.size * len(sections))
+    for name, values in sections.items():
+        if len(name.encode()) > SECTION_NAME_SIZE:
+            raise ValueError(f"Section name {name!r} is too long")
+        values = np.ascontiguousarray(values)
+        entries.append((name, values, offset))
+        offset = _align(offset + values.nbytes)
+
+    # Write next to the target and rename so readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(entries)))
+        for name, values, section_offset in entries:
+            file.write(
+                SECTION_ENTRY.pack(
+                    name.encode(),
+                    values.dtype.str.encode(),
+                    section_offset,
+                    values.size,
+                )
+            )
+        for _, values, section_offset in entries:
+            file.seek(section_offset)
+            file.write(values.tobytes())
+        file.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, section_count = HEADER.unpack_from(self.buffer, 0)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+        if version != SEGMENT_VERSION:
+            raise ValueError(
+                f"Segment version {version} is not supported, rebuild the index"
+            )
+
+        self.sections = dict()
+        for index in range(section_count):
+            name, dtype, offset, count = SECTION_ENTRY.unpack_from(
+                self.buffer, HEADER.size + index * SECTION_ENTRY.size
+            )
+            self.sections[name.rstrip(b"\x00").decode()] = (
+                np.dtype(dtype.rstrip(b"\x00").decode()),
+                offset,
+                count,
+            )
+        self.metadata = json.loads(self.array("metadata").tobytes())
+
+    def __contains__(self, name) -> bool:
+        return name in self.sections
+
+    def array(self, name) -> np.ndarray:
+        # Views into the mapping, pages are only read when touched
+        dtype, offset, count = self.sections[name]
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offset)
+
+
+class TermDictionary:
+    def __init__(self, term_bytes: np.ndarray, term_byte_offsets: np.ndarray):
+        self.term_bytes = memoryview(term_bytes)
+        self.term_byte_offsets = term_byte_offsets
+
+    @staticmethod
+    def encode(terms: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        encoded = [term.encode() for term in terms]
+        term_byte_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=term_byte_offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), term_byte_offsets
+
+    def term(self, term_id) -> str:
+        start = int(self.term_byte_offsets[term_id])
+        end = int(self.term_byte_offsets[term_id + 1])
+        return bytes(self.term_bytes[start:end]).decode()
+
+    def get(self, token, default=None):
+        # Terms are stored in sorted order, so a binary search finds the id
+        target = token.encode()
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            start = int(self.term_byte_offsets[middle])
+            end = int(self.term_byte_offsets[middle + 1])
+            if bytes(self.term_bytes[start:end]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.term(low) == token:
+            return low
+        return default
+
+    def __getitem__(self, token) -> int:
+        term_id = self.get(token)
+        if term_id is None:
+            raise KeyError(token)
+        return term_id
+
+    def __contains__(self, token) -> bool:
+        return self.get(token) is not None
+
+    def __len__(self) -> int:
+        return len(self.term_byte_offsets) - 1
+
+    def __iter__(self):
+        for term_id in range(len(self)):
+            yield self.term(term_id)
+
+
+class StoredFields:
+    # Records are deflated one by one against a dictionary sampled from the
+    # records themselves, so any single document inflates on its own. Stores
+    # without a dictionary hold plain JSON
+    def __init__(
+        self, record_offsets: np.ndarray, records: np.ndarray, dictionary=None
+    ):
+        self.record_offsets = record_offsets
+        self.records = memoryview(records)
+        self.dictionary = None if dictionary is None else bytes(dictionary)
+        # Decoded documents, searches keep asking for the same top results
+        self.cache = LRUCache(STORED_FIELDS_CACHE_SIZE)
+
+    @staticmethod
+    def encode_document(document: dict) -> bytes:
+        return json.dumps(document).encode()
+
+    @staticmethod
+    def sample_step(count: int) -> int:
+        # The dictionary is sampled from every sample_step-th record
+        return max(1, count // 64)
+
+    @staticmethod
+    def sample_dictionary(sampled_records: list[bytes]) -> bytes:
+        # Records spread over the whole store, deflate favours the end of the
+        # dictionary so the sample is cut from the front
+        return b"".join(sampled_records)[-RECORD_DICTIONARY_SIZE:]
+
+    @staticmethod
+    def deflate(records: list[bytes], dictionary: bytes) -> list[bytes]:
+        # Raw deflate streams, a zlib header per record would be pure overhead
+        primed = zlib.compressobj(wbits=-zlib.MAX_WBITS, zdict=dictionary)
+        packed = []
+        for record in records:
+            compressor = primed.copy()
+            packed.append(compressor.compress(record) + compressor.flush())
+        return packed
+
+    @staticmethod
+    def pack(records: list[bytes]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        dictionary = StoredFields.sample_dictionary(
+            records[:: StoredFields.sample_step(len(records))]
+        )
+        return StoredFields.pack_deflated(
+            StoredFields.deflate(records, dictionary), dictionary
+        )
+
+    @staticmethod
+    def pack_deflated(
+        packed: list[bytes], dictionary: bytes
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Records already deflated against dictionary, e.g. by build workers
+        record_offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+        np.cumsum([len(record) for record in packed], out=record_offsets[1:])
+        return (
+            record_offsets,
+            np.frombuffer(b"".join(packed), dtype=np.uint8),
+            np.frombuffer(dictionary, dtype=np.uint8),
+        )
+
+    def record(self, dense_id) -> bytes:
+        start = int(self.record_offsets[dense_id])
+        end = int(self.record_offsets[dense_id + 1])
+        if self.dictionary is None:
+            return bytes(self.records[start:end])
+        decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS, zdict=self.dictionary)
+        return decompressor.decompress(self.records[start:end])
+
+    def __getitem__(self, dense_id) -> dict:
+        document = self.cache.get(dense_id)
+        if document is None:
+            document = json.loads(self.record(dense_id))
+            self.cache.put(dense_id, document)
+        # Callers edit the documents they get back, never hand out the cached one
+        return dict(document)
+
+    def __len__(self) -> int:
+        return len(self.record_offsets) - 1
+
+
+def positions_sections(positions: np.ndarray, tfs: np.ndarray) -> dict:
+    # A posting's positions are delta encoded varints, one posting after another
+    gaps = delta_encode(positions, tfs)
+    byte_ends = np.cumsum(varint_lengths(gaps))
+    position_offsets = np.zeros(len(tfs) + 1, dtype=np.int64)
+    position_offsets[1:] = byte_ends[np.cumsum(tfs) - 1]
+    return {"position_offsets": position_offsets, "positions": varint_encode(gaps)}
+
+
+def postings_sections(
+    terms: list[str],
+    term_ids: np.ndarray,
+    docs: np.ndarray,
+    tfs: np.ndarray,
+    positions=None,
+    field_tfs=None,
+) -> dict[str, np.ndarray]:
+    # The term dictionary is binary searched, so term ids follow sorted order
+    sorted_terms = sorted(range(len(terms)), key=terms.__getitem__)
+    ranks = np.empty(len(terms), dtype=np.int64)
+    ranks[sorted_terms] = np.arange(len(terms))
+    terms = [terms[term_id] for term_id in sorted_terms]
+    term_ids = ranks[term_ids]
+    # Postings arrive in ascending doc order, a stable sort groups them by term
+    order = np.argsort(term_ids, kind="stable")
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_offsets[1:])
+    term_bytes, term_byte_offsets = TermDictionary.encode(terms)
+    # Dense ids let postings use the narrowest dtype that fits the segment
+    docs = docs[order]
+    sections = {
+        "term_bytes": term_bytes,
+        "term_byte_offsets": term_byte_offsets,
+        "term_offsets": term_offsets,
+        "postings": docs.astype(np.min_scalar_type(int(docs.max(initial=0)))),
+        "tfs": tfs[order].astype(np.min_scalar_type(int(tfs.max(initial=0)))),
+    }
+    # Per field tfs run parallel to the postings and sum to tfs
+    for field, values in (field_tfs or dict()).items():
+        sections[f"{field}_tfs"] = values[order].astype(sections["tfs"].dtype)
+    if positions is not None:
+        # Every posting owns tf positions, move each run along with its posting
+        counts = tfs[order]
+        run_offsets = np.repeat(run_starts(tfs)[order] - run_starts(counts), counts)
+        positions = positions[run_offsets + np.arange(int(counts.sum()))]
+        sections.update(positions_sections(positions, counts))
+    return sections
+
+
+def posting_columns() -> list[str]:
+    # Sections that run parallel to the postings, one value per posting
+    return ["postings", "tfs"] + [f"{field}_tfs" for field in SEARCH_FIELDS]
+
+
+def compress_sections(sections: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    # Doc ids become gaps minus one, so a run of consecutive documents packs
+    # to zero bits, and tfs drop their implicit one. Each term's run of every
+    # column is then PForDelta packed
+    counts = np.diff(sections["term_offsets"])
+    starts = run_starts(counts)
+    compressed = dict(sections)
+    for name in posting_columns():
+        values = compressed.pop(name).astype(np.int64)
+        if name == "postings":
+            values = delta_encode(values, counts) - 1
+            values[starts] += 1
+        elif name == "tfs":
+            values -= 1
+        for part, encoded in pfor_encode(values, counts).items():
+            compressed[f"{name}_{part}"] = encoded
+    return compressed
+
+
+def document_sections(
+    doc_ids: np.ndarray,
+    doc_lengths: np.ndarray,
+    records: list[bytes],
+    field_lengths,
+    record_dictionary=None,
+) -> dict[str, np.ndarray]:
+    # With record_dictionary the records are already deflated against it
+    if record_dictionary is None:
+        record_offsets, packed_records, dictionary = StoredFields.pack(records)
+    else:
+        record_offsets, packed_records, dictionary = StoredFields.pack_deflated(
+            records, record_dictionary
+        )
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    sections = {
+        "doc_ids": doc_ids,
+        "doc_order": np.argsort(doc_ids, kind="stable"),
+        "doc_lengths": np.asarray(doc_lengths, dtype=np.int32),
+        "record_offsets": record_offsets,
+        "records": packed_records,
+        "record_dictionary": dictionary,
+    }
+    for field, lengths in field_lengths.items():
+        sections[f"{field}_lengths"] = np.asarray(lengths, dtype=np.int32)
+    return sections
+
+
+class IndexSegment:
+    def __init__(self, sections: dict[str, np.ndarray], metadata: dict, name=None):
+        self.name = name
+        self.sections = sections
+        self.metadata = metadata
+        self.terms = TermDictionary(
+            sections["term_bytes"], sections["term_byte_offsets"]
+        )
+        self.term_offsets = sections["term_offsets"]
+        self.compressed = "postings_packed" in sections
+        self.encoded = dict()
+        if self.compressed:
+            self.encoded = {
+                name: {part: sections[f"{name}_{part}"] for part in PFOR_PARTS}
+                for name in posting_columns()
+            }
+        # Whole columns of a compressed segment, decoded on first use, and the
+        # most recently used term runs
+        self.columns = dict()
+        self.decoded = LRUCache(DECODED_POSTINGS_MAX_BYTES, attrgetter("nbytes"))
+        self.doc_ids = sections["doc_ids"]
+        self.doc_order = sections["doc_order"]
+        self.doc_lengths = sections["doc_lengths"]
+        self.documents = StoredFields(
+            sections["record_offsets"],
+            sections["records"],
+            sections.get("record_dictionary"),
+        )
+        self.field_lengths = {
+            field: sections[f"{field}_lengths"] for field in SEARCH_FIELDS
+        }
+        # Optional, only indexes built with positions carry them
+        self.position_offsets = sections.get("position_offsets")
+        self.positions = sections.get("positions")
+        # Tombstones: sorted local ids of deleted documents
+        self.deleted = np.zeros(0, dtype=np.int64)
+        self.live = None
+        self.deletes_name = None
+        self.deletes_dirty = False
+
+    @classmethod
+    def open(cls, directory: str, name: str, deletes_name=None):
+        segment = Segment(os.path.join(directory, name))
+        sections = {section: segment.array(section) for section in segment.sections}
+        index_segment = cls(sections, segment.metadata, name)
+        if deletes_name:
+            index_segment.delete(np.load(os.path.join(directory, deletes_name)))
+            index_segment.deletes_name = deletes_name
+            index_segment.deletes_dirty = False
+        return index_segment
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_ids) - len(self.deleted)
+
+    @property
+    def total_length(self) -> int:
+        deleted_length = int(self.doc_lengths[self.deleted].sum())
+        return self.metadata["total_length"] - deleted_length
+
+    def field_total_length(self, field) -> int:
+        deleted_length = int(self.field_lengths[field][self.deleted].sum())
+        return self.metadata["field_lengths"][field] - deleted_length
+
+    def has_bm25_tables(self) -> bool:
+        # Precomputed scores are only exact while the segment is the whole index.
+        # Compressed segments keep the per term tables but not the impacts
+        return "bm25_idfs" in self.sections and not len(self.deleted)
+
+    def __restore(self, name, values: np.ndarray, counts) -> np.ndarray:
+        if name == "postings":
+            values += 1
+            values[run_starts(counts)] -= 1
+            return delta_decode(values, counts)
+        if name == "tfs":
+            return values + 1
+        return values
+
+    def column(self, name) -> np.ndarray:
+        # Every value of a posting column, in postings order
+        if not self.compressed:
+            return self.sections[name]
+        if name not in self.columns:
+            counts = np.diff(self.term_offsets)
+            values = pfor_decode(self.encoded[name], counts)
+            self.columns[name] = self.__restore(name, values, counts)
+        return self.columns[name]
+
+    def term_column(self, name, term_slice: slice) -> np.ndarray:
+        # Values of a posting column for one term, only its run is decoded
+        if not self.compressed:
+            return self.sections[name][term_slice]
+        count = term_slice.stop - term_slice.start
+        if not count:
+            return np.zeros(0, dtype=np.int64)
+        # Every term has postings, so its slice start identifies it
+        term_id = int(np.searchsorted(self.term_offsets, term_slice.start, "right")) - 1
+        return self.cached(
+            (name, term_id),
+            lambda: self.__restore(
+                name, pfor_decode_run(self.encoded[name], term_id, count), [count]
+            ),
+        )
+
+    def cached(self, key, compute) -> np.ndarray:
+        # Term runs decoded or derived from a compressed segment. Frequent
+        # query terms stay decoded, weighed by their array bytes
+        values = self.decoded.get(key)
+        if values is not None:
+            return values
+        values = compute()
+        # Shared between callers like the mapped arrays of a plain segment
+        values.flags.writeable = False
+        self.decoded.put(key, values)
+        return values
+
+    def has_positions(self) -> bool:
+        return self.positions is not None
+
+    def term_positions(
+        self, term_slice: slice, local_ids: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Positions of one term in each of local_ids, concatenated, and how
+        # many belong to each document (zero where the term is absent)
+        docs = self.term_column("postings", term_slice)
+        indexes = np.minimum(np.searchsorted(docs, local_ids), max(len(docs) - 1, 0))
+        found = docs[indexes] == local_ids if len(docs) else indexes < 0
+        posting_ids = term_slice.start + indexes[found]
+        counts = np.zeros(len(local_ids), dtype=np.int64)
+        counts[found] = self.term_column("tfs", term_slice)[indexes[found]]
+
+        # Gather the encoded runs and decode them in one pass
+        starts = self.position_offsets[posting_ids]
+        lengths = self.position_offsets[posting_ids + 1] - starts
+        byte_ids = np.repeat(starts - run_starts(lengths), lengths)
+        encoded = self.positions[byte_ids + np.arange(int(lengths.sum()))]
+        return delta_decode(varint_decode(encoded), counts[found]), counts
+
+    def all_positions(self) -> np.ndarray:
+        # Absolute positions of every posting, in postings order
+        return delta_decode(varint_decode(self.positions), self.column("tfs"))
+
+    def term_slice(self, token) -> slice:
+        term_id = self.terms.get(token)
+        if term_id is None:
+            return slice(0, 0)
+        return slice(
+            int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        )
+
+    def live_postings(self, token) -> tuple[np.ndarray, np.ndarray]:
+        term_slice = self.term_slice(token)
+        docs = self.term_column("postings", term_slice)
+        tfs = self.term_column("tfs", term_slice)
+        if self.live is not None:
+            live = self.live[docs]
+            docs, tfs = docs[live], tfs[live]
+        return docs, tfs
+
+    def live_field_postings(self, token) -> tuple[np.ndarray, dict]:
+        term_slice = self.term_slice(token)
+        docs = self.term_column("postings", term_slice)
+        field_tfs = {
+            field: self.term_column(f"{field}_tfs", term_slice)
+            for field in SEARCH_FIELDS
+        }
+        if self.live is not None:
+            live = self.live[docs]
+            docs = docs[live]
+            field_tfs = {field: tfs[live] for field, tfs in field_tfs.items()}
+        return docs, field_tfs
+
+    def local_id(self, doc_id) -> int | None:
+        position = int(np.searchsorted(self.doc_ids, doc_id, sorter=self.doc_order))
+        if position < len(self.doc_order):
+            local_id = int(self.doc_order[position])
+            if self.doc_ids[local_id] == doc_id and self.is_live(local_id):
+                return local_id
+        return None
+
+    def is_live(self, local_id) -> bool:
+        return self.live is None or bool(self.live[local_id])
+
+    def live_ids(self) -> np.ndarray:
+        if self.live is None:
+            return np.arange(len(self), dtype=np.int64)
+        return np.flatnonzero(self.live)
+
+    def delete(self, local_ids) -> None:
+        self.deleted = np.union1d(self.deleted, np.asarray(local_ids, dtype=np.int64))
+        self.live = np.ones(len(self), dtype=np.bool_)
+        self.live[self.deleted] = False
+        self.deletes_dirty = True
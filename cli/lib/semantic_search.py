@@ -1,98 +1,262 @@
+import atexit
 import os
+import time
+from functools import partial
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
 from .constants import (
     CACHE_PATH,
     DEFAULT_SEARCH_LIMIT,
     DESCRIPTION_KEY,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_SIZE,
+    ONNX_VALIDATION_DOCUMENTS,
+    QUERY_KEY,
     SCORE_KEY,
     TITLE_KEY,
 )
-from .search_utils import import_json
+from .document_store import DocumentStore
+from .embedding_cache import EmbeddingCache
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_manifest import (
+    content_hashes,
+    manifest_settings,
+    previous_build,
+    splice_vectors,
+)
+from .onnx_encoder import export_quantized_onnx, load_onnx_encoder
+from .quantization import load_or_create_quantizer, rescored_top_k
+from .search_utils import import_golden_dataset, import_json
+from .segment import Segment
+from .vector_search import (
+    cosine_top_k,
+    normalize_rows,
+    read_vectors,
+    top_k_indexes,
+    write_vectors,
+)
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        # Shared by every search in the process and saved for later ones
+        _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH)
+        atexit.register(_embedding_cache.close)
+    return _embedding_cache
 
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        quantization=None,
+        embedding_cache=None,
+        backend="torch",
+    ):
+        # Models are loaded on first use, see model and query_encoder
+        self._model = None
+        self._query_encoder = None
+        self.model_name = model_name
+        # "onnx" encodes queries with the quantized export, documents are
+        # always encoded by the torch model
+        self.backend = backend
+        # Query embeddings, EmbeddingCache without a path keeps them in memory
+        self.embedding_cache = embedding_cache or get_embedding_cache()
         self.embeddings = None
-        self.documents = None
-        self.document_map = dict()
-        self.embedding_path = os.path.join(CACHE_PATH, "embeddings.npy")
+        # Document position of every embedding row
+        self.doc_positions = None
+        # "int8" or "pq" scores compressed codes first, see open_vectors
+        self.quantization = quantization
+        self.quantizers = dict()
+        # Documents stay on disk, searches only decode the ones they return
+        self.documents = DocumentStore()
+        self.embedding_path = os.path.join(CACHE_PATH, "embeddings.vectors")
 
     def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
-        similarity_scores = []
-        if self.embeddings is None or self.documents is None:
+        if self.embeddings is None or not self.documents.is_open():
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
             )
         q_embedding = self.generate_embedding(query)
-        for index, embedding in enumerate(self.embeddings):
-            similarity = cosine_similarity(embedding, q_embedding)
-            similarity_scores.append((similarity, self.documents[index]))
-
-        similarity_scores.sort(key=lambda x: x[0], reverse=True)
-        limit = min(limit, len(similarity_scores))
+        quantizer = self.quantizers.get(self.embedding_path)
+        if quantizer is None:
+            indexes, scores = cosine_top_k(self.embeddings, q_embedding, limit)
+        else:
+            candidates, scores = rescored_top_k(
+                quantizer,
+                self.embeddings,
+                normalize_rows(q_embedding),
+                limit,
+            )
+            top = top_k_indexes(scores, limit)
+            indexes, scores = candidates[top], scores[top]
         res = []
-        for index in range(limit):
+        for index, score in zip(indexes.tolist(), scores.tolist(), strict=True):
+            document = self.documents[int(self.doc_positions[index])]
             curr_res = {}
-            curr_res[SCORE_KEY] = similarity_scores[index][0]
-            curr_res[TITLE_KEY] = similarity_scores[index][1][TITLE_KEY]
-            curr_res[DESCRIPTION_KEY] = similarity_scores[index][1][DESCRIPTION_KEY]
+            curr_res[SCORE_KEY] = score
+            curr_res[TITLE_KEY] = document[TITLE_KEY]
+            curr_res[DESCRIPTION_KEY] = document[DESCRIPTION_KEY]
             res.append(curr_res)
         return res
 
+    @property
+    def model(self):
+        # Searches served from built vectors and cached query embeddings
+        # never import torch
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def query_encoder(self):
+        if self._query_encoder is None:
+            if self.backend == "torch":
+                self._query_encoder = self.model
+            elif self.backend == "onnx":
+                self._query_encoder = load_onnx_encoder(self.model_name)
+            else:
+                raise ValueError(f"Unknown encoder backend {self.backend!r}")
+        return self._query_encoder
+
     def generate_embedding(self, text):
         if not text:
             raise ValueError("Empty text cannot have embeddings")
 
-        embedding = self.model.encode([text])
-        return embedding[0]
+        # Each backend caches its own embeddings
+        cache_name = self.model_name
+        if self.backend != "torch":
+            cache_name = f"{self.model_name}:{self.backend}"
+        embedding = self.embedding_cache.get(cache_name, text)
+        if embedding is None:
+            embedding = self.embedding_cache.put(
+                cache_name, text, self.query_encoder.encode([text])[0]
+            )
+        return embedding
 
-    def build_embeddings(self, documents):
-        self.documents = documents
+    def build_embeddings(self, documents, workers=1):
+        # Incremental: only documents whose text is not in the previous
+        # build are encoded, see splice_vectors. Encoding goes through a
+        # checkpointed EmbeddingPipeline on workers processes
+        self.documents.load(documents)
         string_rep = []
+        doc_positions = []
 
-        for document in self.documents:
+        for position, document in enumerate(documents):
             if not document.get("id"):
                 continue
-            self.document_map[document["id"]] = document
 
             if not document.get("title") or not document.get("description"):
                 continue
             string_rep.append(f"{document['title']}: {document['description']}")
+            doc_positions.append(position)
 
-        self.embeddings = self.model.encode(string_rep, show_progress_bar=True)
-        self.save()
-        return self.embeddings
+        hashes = content_hashes(string_rep)
+        manifest = {
+            "hashes": hashes,
+            "doc_positions": np.array(doc_positions, dtype=np.int64),
+        }
+        metadata = {
+            "settings": self.embedding_settings(),
+            "documents": self.documents.metadata["source"],
+        }
+        previous = previous_build(self.embedding_path, metadata["settings"])
+        if previous is not None and self.is_unchanged(previous[1], manifest, metadata):
+            return self.open_embeddings()
+
+        previous_vectors, previous_hashes = None, None
+        if previous is not None:
+            previous_vectors, segment = previous
+            previous_hashes = segment.array("hashes")
+        pipeline = self.embedding_pipeline(
+            self.embedding_path, metadata["settings"], workers
+        )
+        self.embeddings, encoded = splice_vectors(
+            pipeline.encode,
+            hashes,
+            string_rep,
+            previous_vectors,
+            previous_hashes,
+        )
+        print(f"Embedded {encoded} of {len(string_rep)} documents")
+        pipeline.report(encoded)
+        self.save(manifest, metadata)
+        pipeline.finish()
+        return self.open_embeddings()
 
-    def load_or_create_embeddings(self, documents):
+    def embedding_pipeline(self, vectors_path, settings, workers) -> EmbeddingPipeline:
+        # With one worker the model is loaded here, pool workers load their own
+        encode = None
+        if workers <= 1:
+            encode = partial(self.model.encode, batch_size=EMBEDDING_BATCH_SIZE)
+        return EmbeddingPipeline(
+            self.model_name, vectors_path, settings, encode, workers
+        )
+
+    def embedding_settings(self) -> dict:
+        return manifest_settings(self.model_name)
+
+    @staticmethod
+    def is_unchanged(segment, manifest, metadata) -> bool:
+        # Same rows in the same order for the same movies file
+        return segment.metadata.get("documents") == metadata["documents"] and all(
+            name in segment and np.array_equal(segment.array(name), values)
+            for name, values in manifest.items()
+        )
+
+    def load_or_create_embeddings(self, documents=None, workers=1):
+        # Without documents the movies file is only read when it changed. A
+        # current build is used as is, anything else goes through the
+        # incremental rebuild
+        documents = self.documents.load(documents)
         embed_path = Path(self.embedding_path)
         print("Does the embed path exist", embed_path.is_file())
-        if not embed_path.is_file():
-            return self.build_embeddings(documents)
-
-        self.embeddings = np.load(file=self.embedding_path)
-        if len(self.embeddings) == len(documents):
-            self.documents = documents
-            for document in documents:
-                if not document.get("id"):
-                    continue
-                self.document_map[document["id"]] = document
-            return self.embeddings
-        else:
-            return self.build_embeddings(documents)
+        if documents is None and self.is_current(
+            self.embedding_path, self.embedding_settings()
+        ):
+            return self.open_embeddings()
 
-    def save(self) -> None:
+        return self.build_embeddings(
+            documents if documents is not None else import_json(), workers
+        )
+
+    def is_current(self, path, settings) -> bool:
+        # Built from the current movies file under the same settings
+        if not os.path.isfile(path):
+            return False
+        metadata = Segment(path).metadata
+        return (
+            metadata.get("settings") == settings
+            and metadata.get("documents") == self.documents.metadata["source"]
+        )
+
+    def open_embeddings(self) -> np.ndarray:
+        self.embeddings, segment = self.open_vectors(self.embedding_path)
+        self.doc_positions = segment.array("doc_positions")
+        return self.embeddings
+
+    def open_vectors(self, path) -> tuple[np.ndarray, Segment]:
+        # Quantized search scores the codes and only reads the float rows
+        # it rescores from the mapping
+        if self.quantization is not None:
+            self.quantizers[path] = load_or_create_quantizer(path, self.quantization)
+        return read_vectors(path)
+
+    def save(self, manifest: dict, metadata: dict) -> None:
         cache_path = Path(CACHE_PATH)
         if not cache_path.is_dir():
             os.mkdir(CACHE_PATH)
 
         if self.embeddings is None:
             raise ValueError("No embeddings to store")
-        with open(self.embedding_path, "wb") as file:
-            np.save(arr=self.embeddings, file=file)
+        write_vectors(self.embedding_path, self.embeddings, metadata, manifest)
 
 
 def verify_model():
@@ -110,17 +274,60 @@ def embed_text(text):
     print(f"Dimensions: {embedding.shape[0]}")
 
 
-def verify_embeddings():
+def verify_embeddings(workers=1):
     sem_search = SemanticSearch()
-    documents = import_json()
-    embeddings = sem_search.load_or_create_embeddings(documents)
+    embeddings = sem_search.load_or_create_embeddings(workers=workers)
 
-    print(f"Number of docs: {len(documents)}")
+    print(f"Number of docs: {len(sem_search.documents)}")
     print(
         f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions"
     )
 
 
+def embedding_cache_stats() -> dict:
+    return get_embedding_cache().stats()
+
+
+def golden_queries() -> list[str]:
+    return [testcase[QUERY_KEY] for testcase in import_golden_dataset()]
+
+
+def export_onnx(model_name="all-MiniLM-L6-v2") -> dict:
+    # Validated on the golden queries and the first movies
+    documents = import_json()[:ONNX_VALIDATION_DOCUMENTS]
+    texts = golden_queries() + [
+        f"{document['title']}: {document['description']}" for document in documents
+    ]
+    return export_quantized_onnx(model_name, texts)
+
+
+def encoder_latency(backend="torch") -> dict:
+    # Cold start is loading the encoder and the first query, per query
+    # latency is encoding each golden query alone. The query cache is not
+    # used, and the numbers are only cold in a fresh process
+    queries = golden_queries()
+    if not queries:
+        raise ValueError("No golden dataset queries to time")
+    start = time.perf_counter()
+    encoder = SemanticSearch(backend=backend).query_encoder
+    loaded = time.perf_counter()
+    encoder.encode([queries[0]])
+    first = time.perf_counter()
+    timings = []
+    for query in queries:
+        query_start = time.perf_counter()
+        encoder.encode([query])
+        timings.append((time.perf_counter() - query_start) * 1000)
+    return {
+        "backend": backend,
+        "load_ms": (loaded - start) * 1000,
+        "cold_start_ms": (first - start) * 1000,
+        "queries": len(timings),
+        "median_ms": float(np.median(timings)),
+        "p95_ms": float(np.percentile(timings, 95)),
+    }
+
+
 def embed_query_text(query: str):
     sem_search = SemanticSearch()
     embedding = sem_search.generate_embedding(query)
@@ -129,25 +336,9 @@ def embed_query_text(query: str):
     print(f"Shape: {embedding.shape}")
 
 
-def cosine_similarity(vec1, vec2) -> float:
-    # print(np.linalg.norm(vec1))
-    # print(np.isnan(vec1).any(), np.isinf(vec1).any())
-    # print(np.linalg.norm(vec2))
-    # print(np.isnan(vec2).any(), np.isinf(vec2).any())
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return dot_product / (norm1 * norm2)
-
-
-def search(query: str, limit=DEFAULT_SEARCH_LIMIT):
-    sem_search = SemanticSearch()
-    documents = import_json()
-    sem_search.load_or_create_embeddings(documents)
+def search(query: str, limit=DEFAULT_SEARCH_LIMIT, quantization=None, backend="torch"):
+    sem_search = SemanticSearch(quantization=quantization, backend=backend)
+    sem_search.load_or_create_embeddings()
     results = sem_search.search(query, limit)
     for index, movie in enumerate(results):
         print(f"{index}. {movie[TITLE_KEY]} (score: {movie[SCORE_KEY]:.4f})")
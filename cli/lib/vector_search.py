@@ -0,0 +1,98 @@
+import numpy as np
+
+from .constants import CHUNK_POOLING_TEMPERATURE, CHUNK_POOLING_TOP_N
+from .segment import Segment, write_segment
+
+# Stored and searched embeddings
+VECTOR_DTYPE = np.float32
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    # Unit length float32 rows make cosine a plain dot product, all zero rows
+    # stay zero and score 0 against any query
+    matrix = np.asarray(matrix, dtype=VECTOR_DTYPE)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def top_k_indexes(scores: np.ndarray, limit) -> np.ndarray:
+    # Highest scores first, ties by index. Partitioning only finds the
+    # limit-th score: everything above it is kept, then the lowest indexes
+    # tied with it, so the sort stays at limit entries and the set does not
+    # depend on how the partition orders ties
+    limit = min(limit, len(scores))
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.arange(len(scores))
+    if limit < len(scores):
+        kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[: limit - len(above)]
+        candidates = np.concatenate((above, tied))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def cosine_top_k(unit_matrix, query, limit) -> tuple[np.ndarray, np.ndarray]:
+    # unit_matrix rows must already be normalized, one matrix-vector product
+    # scores all of them
+    scores = unit_matrix @ normalize_rows(query)
+    top = top_k_indexes(scores, limit)
+    return top, scores[top]
+
+
+def write_vectors(path, unit_vectors, metadata=None, sections=None) -> None:
+    # Rows must already be unit vectors (see normalize_rows). They land in
+    # a segment file, aligned, headered and ready to be mapped as is, so
+    # searches never normalize or copy the matrix
+    unit_vectors = np.asarray(unit_vectors, dtype=VECTOR_DTYPE)
+    metadata = dict(metadata or {})
+    metadata["rows"], metadata["dims"] = unit_vectors.shape
+    write_segment(path, dict(sections or {}, vectors=unit_vectors), metadata)
+
+
+def read_vectors(path) -> tuple[np.ndarray, Segment]:
+    # A read only view of the mapped file. Processes opening the same file
+    # share its pages and only the rows they touch are read from disk. Other
+    # sections and the metadata stay reachable through the segment
+    segment = Segment(path)
+    metadata = segment.metadata
+    vectors = segment.array("vectors").reshape(metadata["rows"], metadata["dims"])
+    return vectors, segment
+
+
+def segment_starts(group_ids: np.ndarray) -> np.ndarray:
+    # First position of every run of equal ids, ids must be sorted
+    if not len(group_ids):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], group_ids[1:] != group_ids[:-1])))
+
+
+def pool_segments(scores: np.ndarray, starts: np.ndarray, mode="max") -> np.ndarray:
+    # One score per segment of scores, segments begin at starts and none
+    # may be empty
+    if not len(starts):
+        return np.zeros(0, dtype=scores.dtype)
+    best = np.maximum.reduceat(scores, starts)
+    if mode == "max":
+        return best
+    counts = np.diff(np.append(starts, len(scores)))
+    if mode == "mean_top":
+        # One max pass per kept score, each knocks out the first occurrence
+        # of its segment's best so ties still count once each
+        remaining = scores.astype(np.float64)
+        sums = np.zeros(len(starts))
+        for _ in range(CHUNK_POOLING_TOP_N):
+            taken = np.maximum.reduceat(remaining, starts)
+            sums += np.where(np.isfinite(taken), taken, 0)
+            hits = remaining == np.repeat(taken, counts)
+            running = np.cumsum(hits)
+            before = np.repeat(running[starts] - hits[starts], counts)
+            remaining[hits & (running - before == 1)] = -np.inf
+        return (sums / np.minimum(counts, CHUNK_POOLING_TOP_N)).astype(scores.dtype)
+    if mode == "softmax":
+        # Temperature scaled log-sum-exp: a smooth max that also rewards
+        # several good chunks. Shifted by the best score to stay finite
+        shifted = np.exp((scores - np.repeat(best, counts)) / CHUNK_POOLING_TEMPERATURE)
+        sums = np.add.reduceat(shifted, starts)
+        return (best + CHUNK_POOLING_TEMPERATURE * np.log(sums)).astype(scores.dtype)
+    raise ValueError(f"Unknown pooling {mode!r}")
@@ -0,0 +1,119 @@
+import heapq
+from bisect import bisect_left
+from operator import attrgetter
+
+import numpy as np
+
+from .constants import WAND_BLOCK_SIZE
+
+# Doc id of an exhausted cursor, sorts after every real posting
+EXHAUSTED = float("inf")
+
+
+class TermCursor:
+    __slots__ = (
+        "docs",
+        "impacts",
+        "weight",
+        "upper_bound",
+        "position",
+        "doc",
+        "block_start",
+        "block_docs",
+        "block_impacts",
+    )
+
+    def __init__(self, docs: np.ndarray, impacts: np.ndarray, weight, upper_bound):
+        # Postings are copied to lists one block at a time, only where the
+        # cursor lands, so a query never converts the runs it skips
+        self.docs = docs
+        self.impacts = impacts
+        self.weight = weight
+        self.upper_bound = weight * upper_bound
+        self.block_start = 0
+        self.block_docs = []
+        self.block_impacts = []
+        self.move(0)
+
+    def move(self, position) -> None:
+        self.position = position
+        offset = position - self.block_start
+        if offset >= len(self.block_docs):
+            if position >= len(self.docs):
+                self.doc = EXHAUSTED
+                return
+            end = position + WAND_BLOCK_SIZE
+            self.block_start = position
+            self.block_docs = self.docs[position:end].tolist()
+            self.block_impacts = self.impacts[position:end].tolist()
+            offset = 0
+        self.doc = self.block_docs[offset]
+
+    def score(self) -> float:
+        return self.weight * self.block_impacts[self.position - self.block_start]
+
+    def next(self) -> None:
+        self.position += 1
+        offset = self.position - self.block_start
+        if offset < len(self.block_docs):
+            self.doc = self.block_docs[offset]
+        else:
+            self.move(self.position)
+
+    def seek(self, target) -> None:
+        # Skip every posting before target without scoring it: bisect the
+        # block when target is in it, otherwise the whole run
+        if self.block_docs and self.block_docs[-1] >= target:
+            offset = bisect_left(
+                self.block_docs, target, self.position - self.block_start
+            )
+            self.move(self.block_start + offset)
+        else:
+            # A target of the run's own dtype, any other casts the whole run
+            self.move(int(self.docs.searchsorted(self.docs.dtype.type(target))))
+
+
+def wand_top_k(cursors: list[TermCursor], limit: int) -> list[tuple[int, float]]:
+    if limit <= 0:
+        return []
+    heap = []
+    threshold = 0.0
+    by_doc = attrgetter("doc")
+
+    while cursors:
+        cursors.sort(key=by_doc)
+
+        # Find the first document whose summed upper bounds can beat the heap
+        pivot = None
+        bound = 0.0
+        for index, cursor in enumerate(cursors):
+            bound += cursor.upper_bound
+            if bound > threshold:
+                pivot = index
+                break
+        if pivot is None:
+            break
+        pivot_doc = cursors[pivot].doc
+        if pivot_doc == EXHAUSTED:
+            break
+
+        if cursors[0].doc == pivot_doc:
+            score = 0.0
+            for cursor in cursors:
+                if cursor.doc != pivot_doc:
+                    break
+                score += cursor.score()
+                cursor.next()
+
+            if len(heap) < limit:
+                heapq.heappush(heap, (score, -pivot_doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -pivot_doc))
+            if len(heap) == limit:
+                threshold = heap[0][0]
+        else:
+            for cursor in cursors[:pivot]:
+                cursor.seek(pivot_doc)
+
+    heap.sort(reverse=True)
+    return [(-neg_doc, score) for score, neg_doc in heap]
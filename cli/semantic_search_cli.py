@@ -3,12 +3,29 @@
 import argparse
 
 from cli.lib.argparse_util import get_parser
-from lib.constants import DESCRIPTION_KEY, DOCUMENT_KEY, TITLE_KEY
-from lib.chunked_semantic_search import embed_chunks, search_chunked
+from lib.constants import (
+    CHUNK_POOLING_MODES,
+    DESCRIPTION_KEY,
+    DOCUMENT_KEY,
+    DOCUMENT_VECTOR_SOURCES,
+    ENCODER_BACKENDS,
+    TITLE_KEY,
+)
+from lib.chunked_semantic_search import (
+    ann_recall,
+    build_ann_index,
+    embed_chunks,
+    quantization_recall,
+    search_chunked,
+    two_stage_recall,
+)
 from lib.search_utils import chunk_text, semantic_chunk_text
 from lib.semantic_search import (
     embed_query_text,
     embed_text,
+    embedding_cache_stats,
+    encoder_latency,
+    export_onnx,
     search,
     verify_embeddings,
     verify_model,
@@ -25,13 +42,37 @@ commands = {
     "chunk": ["text"],
     "semantic_chunk": ["text"],
     "embed_chunks": [],
+    "build_ann": [],
+    "ann_recall": [],
+    "quantize_recall": [],
+    "two_stage_recall": [],
+    "cachestats": [],
+    "export_onnx": [],
+    "encode_latency": [],
 }
 
 opt_args = {
     "search": [("limit", 5)],
-    "search_chunked": [("limit", 5)],
+    "verify_embeddings": [("workers", 1)],
+    "embed_chunks": [("workers", 1)],
+    "search_chunked": [("limit", 5), ("nprobe", 0), ("docs", 0)],
+    "build_ann": [("lists", 0)],
+    "ann_recall": [("recall-limit", 10), ("nprobes", "1,2,4,8,16")],
     "chunk": [("chunk-size", 200), ("overlap", 20)],
     "semantic_chunk": [("max-chunk-size", 4), ("overlap", 0)],
+    "quantize_recall": [("recall-limit", 10), ("kinds", "int8,pq")],
+    "two_stage_recall": [("recall-limit", 10), ("docs-values", "20,50,100,200")],
+}
+
+choice_args = {
+    "search": {"quantize": ["int8", "pq"], "backend": ENCODER_BACKENDS},
+    "search_chunked": {
+        "quantize": ["int8", "pq"],
+        "pooling": CHUNK_POOLING_MODES,
+        "backend": ENCODER_BACKENDS,
+        "doc-vectors": DOCUMENT_VECTOR_SOURCES,
+    },
+    "encode_latency": {"backend": ENCODER_BACKENDS},
 }
 
 query_type = {
@@ -43,6 +84,18 @@ query_type = {
     "chunk-size": int,
     "overlap": int,
     "max-chunk-size": int,
+    "nprobe": int,
+    "lists": int,
+    "recall-limit": int,
+    "nprobes": str,
+    "quantize": str,
+    "kinds": str,
+    "pooling": str,
+    "backend": str,
+    "workers": int,
+    "docs": int,
+    "docs-values": str,
+    "doc-vectors": str,
 }
 
 help = {
@@ -56,6 +109,13 @@ help = {
     "chunk": "Chunk the provided text into fixed size chunks",
     "semantic_chunk": "Convert text into semantic chunks",
     "embed_chunks": "Embed chunks from the documents and cache it",
+    "build_ann": "Build the IVF approximate nearest neighbour index over chunk embeddings",
+    "ann_recall": "Compare IVF chunk search against exact search on the golden dataset",
+    "quantize_recall": "Compare quantized embedding search against exact search on the golden dataset",
+    "cachestats": "Show hit and miss counts of the query embedding cache",
+    "export_onnx": "Export an int8 quantized ONNX model for query encoding and validate it",
+    "two_stage_recall": "Compare two stage chunked search against full chunk search on the golden dataset",
+    "encode_latency": "Time loading the query encoder and encoding the golden queries",
     # Help for arguments
     "query": "The term you need to search for",
     "text": "Text input to be processed",
@@ -64,19 +124,40 @@ help = {
     "chunk-size": "The size of each chunk (Default 200)",
     "overlap": "Number of words to overlap in chunks (Default 0)",
     "max-chunk-size": "Maximum allowed size of the chunk (Default 4)",
+    "nprobe": "IVF lists to scan, 0 scores every chunk (Default 0)",
+    "lists": "Number of IVF lists, 0 picks about sqrt(chunks) (Default 0)",
+    "recall-limit": "k of the recall@k report (Default 10)",
+    "nprobes": "Comma separated nprobe values to report (Default 1,2,4,8,16)",
+    "quantize": "Score int8 or product quantized codes first, then rescore the best with the float vectors",
+    "kinds": "Comma separated quantizations to report (Default int8,pq)",
+    "pooling": "How chunk scores make a movie score: best chunk, mean of the best two or softmax weighted (Default max)",
+    "docs": "Two stage search: only score the chunks of this many movies ranked by document vector, 0 scores every chunk (Default 0)",
+    "docs-values": "Comma separated first stage movie counts to report (Default 20,50,100,200)",
+    "doc-vectors": "Document vectors of the first stage: mean of the chunk vectors or the movie embeddings (Default chunk_mean)",
+    "workers": "Number of processes that encode new texts when embeddings are built (Default 1)",
+    "backend": "Encode queries with the torch model or the quantized ONNX export (Default torch)",
 }
 
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
-    parser = get_parser(parser, commands, opt_args, {}, {}, query_type, help)
+    parser = get_parser(parser, commands, opt_args, choice_args, {}, query_type, help)
     args = parser.parse_args()
 
     match args.command:
         case "search":
-            search(args.query, args.limit)
+            search(args.query, args.limit, args.quantize, args.backend or "torch")
         case "search_chunked":
-            movies = search_chunked(args.query, args.limit)
+            movies = search_chunked(
+                args.query,
+                args.limit,
+                args.nprobe,
+                args.quantize,
+                args.pooling or "max",
+                args.backend or "torch",
+                args.docs,
+                args.doc_vectors or "chunk_mean",
+            )
             for index, movie_dict in enumerate(movies):
                 movie = movie_dict[DOCUMENT_KEY]
                 print(
@@ -88,7 +169,7 @@ def main():
         case "embed_text":
             embed_text(args.text)
         case "verify_embeddings":
-            verify_embeddings()
+            verify_embeddings(args.workers)
         case "embedquery":
             embed_query_text(args.query)
         case "chunk":
@@ -104,8 +185,69 @@ def main():
             for index, sentence in enumerate(sentences):
                 print(f"{index + 1}. {sentence}")
         case "embed_chunks":
-            embeddings = embed_chunks()
+            embeddings = embed_chunks(args.workers)
             print(f"Generated {len(embeddings)} chunked embeddings")
+        case "build_ann":
+            index = build_ann_index(args.lists or None)
+            print(f"IVF index has {len(index)} lists")
+        case "ann_recall":
+            nprobes = [int(nprobe) for nprobe in args.nprobes.split(",")]
+            report = ann_recall(args.recall_limit, nprobes)
+            print(
+                f"{report['queries']} queries, {report['lists']} lists, "
+                f"exact search {report['exact_ms']:.2f} ms/query"
+            )
+            for row in report["probes"]:
+                print(
+                    f"nprobe {row['nprobe']:>4}: chunk recall@{args.recall_limit} "
+                    f"{row['chunk_recall']:.3f}, movie recall@{args.recall_limit} "
+                    f"{row['movie_recall']:.3f}, {row['ms']:.2f} ms/query"
+                )
+        case "quantize_recall":
+            kinds = args.kinds.split(",")
+            for row in quantization_recall(args.recall_limit, kinds):
+                print(
+                    f"{row['vectors']} {row['kind']}: {row['ratio']:.1f}x smaller, "
+                    f"recall@{args.recall_limit} {row['first_pass_recall']:.3f} "
+                    f"on codes, {row['recall']:.3f} rescored, "
+                    f"{row['ms']:.2f} ms/query (exact {row['exact_ms']:.2f})"
+                )
+        case "cachestats":
+            stats = embedding_cache_stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_rate = stats["hits"] / lookups if lookups else 0.0
+            print(f"Hits: {stats['hits']}, Misses: {stats['misses']}")
+            print(f"Hit rate: {hit_rate:.2%}")
+            print(
+                f"Cached queries: {stats['stored_entries']} stored, "
+                f"{stats['memory_entries']} in memory"
+            )
+        case "two_stage_recall":
+            docs_values = [int(docs) for docs in args.docs_values.split(",")]
+            for row in two_stage_recall(args.recall_limit, docs_values):
+                print(
+                    f"{row['source']} {row['docs']:>5} movies: movie "
+                    f"recall@{args.recall_limit} {row['recall']:.3f}, "
+                    f"{row['chunk_fraction']:.2%} of chunks scored, "
+                    f"{row['ms']:.2f} ms/query (full {row['exact_ms']:.2f})"
+                )
+        case "export_onnx":
+            validation = export_onnx()
+            print(
+                f"Cosine to the torch model over {validation['texts']} texts: "
+                f"min {validation['min_cosine']:.4f}, "
+                f"mean {validation['mean_cosine']:.4f}"
+            )
+            if not validation["passed"]:
+                print(f"Below {validation['tolerance']}, the onnx backend is disabled")
+        case "encode_latency":
+            report = encoder_latency(args.backend or "torch")
+            print(
+                f"{report['backend']}: cold start {report['cold_start_ms']:.0f} ms "
+                f"(load {report['load_ms']:.0f} ms), per query median "
+                f"{report['median_ms']:.2f} ms, p95 {report['p95_ms']:.2f} ms "
+                f"over {report['queries']} queries"
+            )
         case _:
             parser.print_help()
 
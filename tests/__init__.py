@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The CLI scripts run with cli/ on the path and import the library as lib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "cli"))
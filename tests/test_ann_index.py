@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.ann_index import IVFIndex
+from lib.vector_search import cosine_top_k, normalize_rows
+
+
+def clustered_vectors(rng, rows, dims=24, clusters=20) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dims))
+    assignments = rng.integers(0, clusters, rows)
+    vectors = centers[assignments] + 0.4 * rng.standard_normal((rows, dims))
+    return normalize_rows(vectors.astype(np.float32))
+
+
+class TestIVFIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = clustered_vectors(rng, 3000)
+        self.queries = rng.standard_normal((30, 24)).astype(np.float32)
+        self.index = IVFIndex.build(self.vectors, 32)
+
+    def test_lists_partition_the_rows(self):
+        self.assertEqual(len(self.index), 32)
+        np.testing.assert_array_equal(
+            np.sort(self.index.list_rows), np.arange(len(self.vectors))
+        )
+        full = self.index.candidates(normalize_rows(self.queries[0]), len(self.index))
+        np.testing.assert_array_equal(full, np.arange(len(self.vectors)))
+
+    def test_probing_every_list_is_exact(self):
+        for query in self.queries:
+            rows, scores = self.index.search(self.vectors, query, 10, len(self.index))
+            exact_rows, exact_scores = cosine_top_k(self.vectors, query, 10)
+            np.testing.assert_array_equal(rows, exact_rows)
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-6)
+
+    def test_recall_grows_with_nprobe(self):
+        exact = [
+            set(cosine_top_k(self.vectors, q, 10)[0].tolist()) for q in self.queries
+        ]
+        recalls = []
+        for nprobe in (1, 4, 16, 32):
+            hits = sum(
+                len(set(self.index.search(self.vectors, q, 10, nprobe)[0].tolist()) & e)
+                for q, e in zip(self.queries, exact, strict=True)
+            )
+            recalls.append(hits / (10 * len(self.queries)))
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertGreater(recalls[1], 0.5)
+        self.assertEqual(recalls[-1], 1.0)
+
+    def test_save_and_open(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ivf", "chunks.index")
+            self.index.save(path)
+            opened = IVFIndex.open(path)
+            query = normalize_rows(self.queries[0])
+            np.testing.assert_array_equal(
+                opened.candidates(query, 4), self.index.candidates(query, 4)
+            )
+            self.assertEqual(opened.metadata, self.index.metadata)
+
+
+if __name__ == "__main__":
+    unittest.main()
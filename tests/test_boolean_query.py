@@ -0,0 +1,172 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib import inverted_index
+from lib.boolean_query import (
+    And,
+    AndIterator,
+    Not,
+    Or,
+    OrIterator,
+    Phrase,
+    PostingIterator,
+    Term,
+    gallop,
+    iterate_matches,
+    parse_query,
+)
+from lib.constants import DOCUMENT_KEY, ID_KEY
+from lib.inverted_index import InvertedIndex
+from lib.preprocess import preprocess
+
+WORDS = ["river", "boat", "night", "moon", "star", "sea"]
+
+
+def evaluate(node, tokens: list[str]) -> bool:
+    # The query semantics spelled out on one movie's tokens
+    if isinstance(node, Term):
+        return node.token in tokens
+    if isinstance(node, Phrase):
+        size = len(node.tokens)
+        return any(
+            tokens[start : start + size] == node.tokens
+            for start in range(len(tokens) - size + 1)
+        )
+    if isinstance(node, Not):
+        return not evaluate(node.child, tokens)
+    if isinstance(node, And):
+        return all(evaluate(child, tokens) for child in node.children)
+    return any(evaluate(child, tokens) for child in node.children)
+
+
+class TestQueryParser(unittest.TestCase):
+    def test_precedence(self):
+        river, boat, night = Term("river"), Term("boat"), Term("night")
+        self.assertEqual(
+            parse_query("river OR boat AND night"), Or([river, And([boat, night])])
+        )
+        self.assertEqual(
+            parse_query("river boat OR night"), Or([And([river, boat]), night])
+        )
+        self.assertEqual(parse_query("NOT river boat"), And([Not(river), boat]))
+        self.assertEqual(
+            parse_query("NOT (river OR boat) night"),
+            And([Not(Or([river, boat])), night]),
+        )
+        self.assertEqual(
+            parse_query('(river OR "night boat") AND NOT NOT sea'),
+            And([Or([river, Phrase(["night", "boat"])]), Not(Not(Term("sea")))]),
+        )
+
+    def test_lowercase_operators_are_words(self):
+        self.assertNotIsInstance(parse_query("river or boat"), Or)
+        self.assertEqual(parse_query("river AND boat"), parse_query("river boat"))
+
+    def test_empty_queries(self):
+        self.assertIsNone(parse_query(""))
+        self.assertIsNone(parse_query("   "))
+        self.assertIsNone(parse_query('""'))
+
+    def test_errors(self):
+        for query in (
+            "(river boat",
+            "river boat)",
+            "river OR",
+            "AND river",
+            "river AND",
+            "NOT",
+            "()",
+            'river "boat',
+        ):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                parse_query(query)
+
+
+class TestIterators(unittest.TestCase):
+    def test_gallop_finds_the_first_doc_not_below_target(self):
+        docs = list(range(0, 3000, 3))
+        for position in (0, 5, 500):
+            for target in (0, 14, 15, 16, 1500, 2997, 2998, 5000):
+                expected = max(position, int(np.searchsorted(docs, target)))
+                self.assertEqual(gallop(docs, target, position), expected)
+
+    def test_and_or_with_excludes_match_sets(self):
+        rng = np.random.default_rng(0)
+        lists = [
+            np.flatnonzero(rng.random(2000) < density)
+            for density in (0.5, 0.1, 0.02, 0.3)
+        ]
+        sets = [set(docs.tolist()) for docs in lists]
+
+        def iterator(index):
+            return PostingIterator(lists[index])
+
+        conjunction = AndIterator([iterator(0), iterator(1)], [iterator(3)])
+        self.assertEqual(
+            list(iterate_matches(conjunction)),
+            sorted((sets[0] & sets[1]) - sets[3]),
+        )
+        disjunction = OrIterator([iterator(1), iterator(2), PostingIterator([])])
+        self.assertEqual(list(iterate_matches(disjunction)), sorted(sets[1] | sets[2]))
+        nested = AndIterator([OrIterator([iterator(1), iterator(2)]), iterator(0)], [])
+        nested.seek(1000)
+        self.assertEqual(
+            list(iterate_matches(nested)),
+            sorted(doc for doc in (sets[1] | sets[2]) & sets[0] if doc >= 1000),
+        )
+
+
+class TestBooleanSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(1)
+        self.movies = [
+            {
+                ID_KEY: doc_id,
+                "title": str(rng.choice(WORDS)),
+                "description": " ".join(rng.choice(WORDS, rng.integers(2, 8))),
+            }
+            for doc_id in range(1, 201)
+        ]
+        self.index = InvertedIndex()
+        self.index.index_dir = self.directory.name
+        self.index.index_path = f"{self.directory.name}/manifest.json"
+        with mock.patch.object(inverted_index, "import_json", return_value=self.movies):
+            self.index.build(positions=True)
+        self.index.delete_documents([5, 50, 150])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_agree_with_the_query_semantics(self):
+        live = [movie for movie in self.movies if movie[ID_KEY] not in (5, 50, 150)]
+        for query in (
+            "river",
+            "river boat",
+            "river OR boat AND night",
+            "NOT river",
+            "NOT (river OR sea) moon",
+            '"river boat" OR star',
+            'NOT "night moon" AND sea',
+            "submarine OR star",
+        ):
+            node = parse_query(query)
+            expected = {
+                movie[ID_KEY]
+                for movie in live
+                if evaluate(
+                    node, preprocess(f"{movie['title']} {movie['description']}")
+                )
+            }
+            results = self.index.boolean_search(query, len(self.movies))
+            found = [result[DOCUMENT_KEY][ID_KEY] for result in results]
+            with self.subTest(query=query):
+                self.assertEqual(len(found), len(set(found)))
+                self.assertEqual(set(found), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.ann_index import IVFIndex
+from lib.chunked_semantic_search import ChunkedSemanticSearch, recall
+from lib.constants import MOVIE_INDEX
+from lib.embedding_cache import EmbeddingCache
+from lib.quantization import ScalarQuantizer
+from lib.vector_search import normalize_rows, pool_segments, write_vectors
+
+
+def chunked_search(movies=80, dims=16, seed=0, spread=None) -> ChunkedSemanticSearch:
+    # Random unit chunk vectors, one to six chunks per movie. With spread
+    # the chunks of a movie lie around a random movie vector, like chunks of
+    # one description do
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 7, movies)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    vectors = rng.standard_normal((offsets[-1], dims))
+    if spread is not None:
+        centers = np.repeat(rng.standard_normal((movies, dims)), counts, axis=0)
+        vectors = centers + spread * vectors
+    # An in memory embedding cache, the shared one lives in the project cache
+    with mock.patch(
+        "lib.semantic_search.get_embedding_cache", return_value=EmbeddingCache(1)
+    ):
+        search = ChunkedSemanticSearch()
+    search.chunk_embeddings = normalize_rows(vectors.astype(np.float32))
+    search.chunk_metadata = {MOVIE_INDEX: np.repeat(np.arange(movies), counts)}
+    search.movie_starts = offsets[:-1]
+    search.movie_ends = offsets[1:]
+    search.movie_indexes = np.arange(movies)
+    return search
+
+
+class TestApproximatePooling(unittest.TestCase):
+    def setUp(self):
+        self.search = chunked_search()
+        rng = np.random.default_rng(1)
+        self.queries = rng.standard_normal((10, 16)).astype(np.float32)
+
+    def exact_scores(self, query, pooling) -> np.ndarray:
+        scores = self.search.chunk_embeddings @ normalize_rows(query)
+        return pool_segments(scores, self.search.movie_starts, pooling)
+
+    def assert_exact_pooling(self, **options):
+        for pooling in ("mean_top", "softmax"):
+            for query in self.queries:
+                exact = self.exact_scores(query, pooling)
+                ranked = self.search.rank_movies(query, 5, pooling=pooling, **options)
+                self.assertEqual(len(ranked), 5)
+                for movie, score in ranked:
+                    self.assertAlmostEqual(score, float(exact[movie]), places=5)
+
+    def test_quantized_candidates_pool_every_chunk(self):
+        path = self.search.chunk_embeddings_path
+        self.search.quantizers[path] = ScalarQuantizer.train(
+            self.search.chunk_embeddings
+        )
+        self.assert_exact_pooling()
+
+    def test_probed_candidates_pool_every_chunk(self):
+        self.search.ann_index = IVFIndex.build(self.search.chunk_embeddings, 16)
+        self.assert_exact_pooling(nprobe=2)
+
+
+class TestProbedSearch(unittest.TestCase):
+    def test_probing_every_list_ranks_like_exact_search(self):
+        search = chunked_search(movies=150, spread=0.5)
+        search.ann_index = IVFIndex.build(search.chunk_embeddings, 12)
+        queries = np.random.default_rng(3).standard_normal((20, 16))
+        for pooling in ("max", "mean_top", "softmax"):
+            for query in queries.astype(np.float32):
+                self.assertEqual(
+                    search.rank_movies(query, 10, nprobe=12, pooling=pooling),
+                    search.rank_movies(query, 10, pooling=pooling),
+                )
+
+
+class TestQuantizedCandidates(unittest.TestCase):
+    def setUp(self):
+        self.search = chunked_search(movies=200, spread=0.02)
+        path = self.search.chunk_embeddings_path
+        self.search.quantizers[path] = ScalarQuantizer.train(
+            self.search.chunk_embeddings
+        )
+        rng = np.random.default_rng(2)
+        self.queries = rng.standard_normal((50, 16)).astype(np.float32)
+
+    def assert_full_results(self, **options):
+        for pooling in ("max", "mean_top", "softmax"):
+            for query in self.queries:
+                ranked = self.search.rank_movies(query, 10, pooling=pooling, **options)
+                self.assertEqual(len(ranked), 10)
+                self.assertEqual(len({movie for movie, _ in ranked}), 10)
+
+    def test_quantized_search_returns_limit_movies(self):
+        self.assert_full_results()
+
+    def test_probed_quantized_search_returns_limit_movies(self):
+        self.search.ann_index = IVFIndex.build(self.search.chunk_embeddings, 8)
+        self.assert_full_results(nprobe=4)
+
+
+class TestTwoStageSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.search = chunked_search(movies=300, spread=0.5)
+        self.search.chunk_embeddings_path = os.path.join(
+            self.directory.name, "chunk_embeddings.vectors"
+        )
+        self.search.chunk_centroids_path = os.path.join(
+            self.directory.name, "chunk_centroids.vectors"
+        )
+        write_vectors(self.search.chunk_embeddings_path, self.search.chunk_embeddings)
+        self.search.load_document_vectors()
+        rng = np.random.default_rng(4)
+        self.queries = rng.standard_normal((30, 16)).astype(np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_document_vectors_are_chunk_means(self):
+        search = self.search
+        for segment in (0, 7, 299):
+            chunks = search.chunk_embeddings[
+                search.movie_starts[segment] : search.movie_ends[segment]
+            ]
+            np.testing.assert_allclose(
+                search.document_vectors[segment],
+                normalize_rows(chunks.sum(axis=0)),
+                atol=1e-6,
+            )
+
+    def test_candidates_are_the_chunks_of_the_best_movies(self):
+        for query in self.queries:
+            unit_query = normalize_rows(query)
+            best = np.argsort(-(self.search.document_vectors @ unit_query))[:20]
+            rows = self.search.document_candidates(unit_query, 20)
+            self.assertTrue(np.all(np.diff(rows) > 0))
+            self.assertEqual(set(self.search.row_segments(rows).tolist()), set(best))
+            self.assertEqual(
+                len(rows),
+                int((self.search.movie_ends - self.search.movie_starts)[best].sum()),
+            )
+
+    def test_every_movie_as_candidate_is_exact(self):
+        for pooling in ("max", "mean_top", "softmax"):
+            for query in self.queries:
+                self.assertEqual(
+                    self.search.rank_movies(query, 10, pooling=pooling, docs=300),
+                    self.search.rank_movies(query, 10, pooling=pooling),
+                )
+
+    def test_recall_grows_with_docs(self):
+        exact = [
+            {movie for movie, _ in self.search.rank_movies(query, 10)}
+            for query in self.queries
+        ]
+        recalls = []
+        for docs in (10, 30, 100, 300):
+            found = [
+                {movie for movie, _ in self.search.rank_movies(query, 10, docs=docs)}
+                for query in self.queries
+            ]
+            recalls.append(recall(found, exact))
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertGreater(recalls[1], 0.8)
+        self.assertEqual(recalls[-1], 1.0)
+
+    def test_movies_without_chunks_are_skipped(self):
+        # Document vectors built from descriptions can include movies that
+        # have no chunks, their segment is -1
+        self.search.document_vectors = np.concatenate(
+            [self.search.document_vectors, normalize_rows(self.queries[:3])]
+        )
+        self.search.document_segments = np.concatenate(
+            [self.search.document_segments, [-1, -1, -1]]
+        )
+        ranked = self.search.rank_movies(self.queries[0], 5, docs=20)
+        self.assertEqual(len(ranked), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
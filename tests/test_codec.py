@@ -0,0 +1,139 @@
+import unittest
+
+import numpy as np
+
+from lib.codec import (
+    delta_decode,
+    delta_encode,
+    pfor_decode,
+    pfor_decode_run,
+    pfor_encode,
+    varint_decode,
+    varint_encode,
+    varint_lengths,
+)
+from lib.constants import ID_KEY
+from lib.inverted_index import analyze_documents, create_segment
+from lib.segment import posting_columns
+
+
+def leb128(value: int) -> list[int]:
+    encoded = []
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        encoded.append(byte | (0x80 if value else 0))
+        if not value:
+            return encoded
+
+
+def skewed_runs(rng, run_count) -> tuple[np.ndarray, np.ndarray]:
+    # Mostly small values with rare large ones, and some empty runs, so
+    # runs pick different widths and carry exceptions
+    counts = rng.integers(0, 300, run_count)
+    counts[::7] = 0
+    values = rng.geometric(0.2, int(counts.sum())).astype(np.int64)
+    outliers = rng.random(len(values)) < 0.02
+    values[outliers] = rng.integers(1, 2**40, int(outliers.sum()))
+    return values, counts
+
+
+class TestVarint(unittest.TestCase):
+    def test_matches_reference_encoding(self):
+        values = [0, 1, 127, 128, 300, 16383, 16384, 2**32, 2**63 - 1]
+        expected = [byte for value in values for byte in leb128(value)]
+        encoded = varint_encode(values)
+        self.assertEqual(encoded.tolist(), expected)
+        self.assertEqual(
+            varint_lengths(values).tolist(), [len(leb128(v)) for v in values]
+        )
+        self.assertEqual(varint_decode(encoded).tolist(), values)
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 2**50, 5000) >> rng.integers(0, 50, 5000)
+        np.testing.assert_array_equal(varint_decode(varint_encode(values)), values)
+        self.assertEqual(len(varint_encode([])), 0)
+        self.assertEqual(len(varint_decode([])), 0)
+
+
+class TestDelta(unittest.TestCase):
+    def test_runs_round_trip(self):
+        rng = np.random.default_rng(1)
+        counts = np.array([3, 0, 1, 5, 0, 0, 4])
+        values = np.concatenate(
+            [np.sort(rng.choice(1000, count, replace=False)) for count in counts]
+        )
+        gaps = delta_encode(values, counts)
+        self.assertTrue(np.all(gaps >= 0))
+        np.testing.assert_array_equal(delta_decode(gaps, counts), values)
+
+
+class TestPFor(unittest.TestCase):
+    def test_round_trip_with_exceptions(self):
+        values, counts = skewed_runs(np.random.default_rng(2), 200)
+        encoded = pfor_encode(values, counts)
+        self.assertGreater(len(encoded["xhigh"]), 0)
+        np.testing.assert_array_equal(pfor_decode(encoded, counts), values)
+
+        starts = np.cumsum(counts) - counts
+        for run in range(len(counts)):
+            np.testing.assert_array_equal(
+                pfor_decode_run(encoded, run, int(counts[run])),
+                values[starts[run] : starts[run] + counts[run]],
+            )
+
+    def test_packs_smaller_than_int64(self):
+        values, counts = skewed_runs(np.random.default_rng(3), 100)
+        encoded = pfor_encode(values, counts)
+        size = sum(part.nbytes for part in encoded.values())
+        self.assertLess(size, values.nbytes / 3)
+
+    def test_edge_cases(self):
+        for values, counts in (
+            ([], []),
+            ([], [0, 0]),
+            ([0, 0, 0], [3]),
+            ([5], [1]),
+            ([2**62, 1, 0], [1, 2]),
+        ):
+            values = np.array(values, dtype=np.int64)
+            encoded = pfor_encode(values, counts)
+            np.testing.assert_array_equal(pfor_decode(encoded, counts), values)
+
+
+class TestCompressedSegment(unittest.TestCase):
+    def test_postings_match_the_plain_segment(self):
+        rng = np.random.default_rng(4)
+        words = [f"word{index}" for index in range(40)]
+        movies = [
+            {
+                ID_KEY: doc_id,
+                "title": " ".join(rng.choice(words, 2)),
+                "description": " ".join(rng.choice(words, rng.integers(1, 60))),
+            }
+            for doc_id in range(500)
+        ]
+        analyzed = analyze_documents(movies, with_positions=True)
+        plain = create_segment(analyzed, True)
+        compressed = create_segment(analyzed, True, compress=True)
+        self.assertTrue(compressed.compressed)
+        for name in posting_columns():
+            np.testing.assert_array_equal(compressed.column(name), plain.column(name))
+        local_ids = np.arange(len(movies))
+        for term in plain.terms:
+            term_slice = plain.term_slice(term)
+            for name in posting_columns():
+                np.testing.assert_array_equal(
+                    compressed.term_column(name, term_slice),
+                    plain.term_column(name, term_slice),
+                )
+            for found, expected in zip(
+                compressed.term_positions(term_slice, local_ids),
+                plain.term_positions(term_slice, local_ids),
+                strict=True,
+            ):
+                np.testing.assert_array_equal(found, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
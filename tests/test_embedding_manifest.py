@@ -0,0 +1,165 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.document_store import DocumentStore
+from lib.embedding_cache import EmbeddingCache
+from lib.embedding_manifest import (
+    content_hash,
+    content_hashes,
+    manifest_settings,
+    previous_build,
+    splice_vectors,
+)
+from lib.embedding_pipeline import EmbeddingPipeline
+from lib.semantic_search import SemanticSearch
+from lib.vector_search import write_vectors
+
+
+class FakeEncoder:
+    # Stands in for the model: a fixed random vector per text, and a record
+    # of every text it was asked to encode
+    def __init__(self, dims=8):
+        self.dims = dims
+        self.texts = []
+
+    def encode(self, texts) -> np.ndarray:
+        self.texts.extend(texts)
+        return np.array(
+            [
+                np.random.default_rng(content_hash(text)).standard_normal(self.dims)
+                for text in texts
+            ],
+            dtype=np.float32,
+        )
+
+
+def movies(count) -> list[dict]:
+    return [
+        {
+            "id": doc_id,
+            "title": f"Movie {doc_id}",
+            "description": f"a story number {doc_id} about a river",
+        }
+        for doc_id in range(1, count + 1)
+    ]
+
+
+class TestSpliceVectors(unittest.TestCase):
+    def test_previous_rows_are_copied(self):
+        encoder = FakeEncoder()
+        texts = [f"text {number}" for number in range(10)]
+        previous, encoded = splice_vectors(
+            encoder.encode, content_hashes(texts), texts, None, None
+        )
+        self.assertEqual(encoded, 10)
+
+        changed = texts[3:] + ["new text"]
+        encoder.texts.clear()
+        vectors, encoded = splice_vectors(
+            encoder.encode,
+            content_hashes(changed),
+            changed,
+            previous,
+            content_hashes(texts),
+        )
+        self.assertEqual(encoded, 1)
+        self.assertEqual(encoder.texts, ["new text"])
+        np.testing.assert_array_equal(vectors[:7], previous[3:])
+        fresh, _ = splice_vectors(
+            encoder.encode, content_hashes(changed), changed, None, None
+        )
+        np.testing.assert_allclose(vectors, fresh, rtol=1e-6)
+
+    def test_nothing_new_encodes_nothing(self):
+        encoder = FakeEncoder()
+        texts = ["one", "two", "three"]
+        previous, _ = splice_vectors(
+            encoder.encode, content_hashes(texts), texts, None, None
+        )
+        encoder.texts.clear()
+        hashes = content_hashes(texts[::-1])
+        vectors, encoded = splice_vectors(
+            encoder.encode, hashes, [None] * 3, previous, content_hashes(texts)
+        )
+        self.assertEqual((encoded, encoder.texts), (0, []))
+        np.testing.assert_array_equal(vectors, previous[::-1])
+
+
+class TestPreviousBuild(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "embeddings.vectors")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_only_builds_with_the_same_settings_are_reused(self):
+        self.assertIsNone(previous_build(self.path, manifest_settings("model")))
+        vectors = np.eye(4, dtype=np.float32)
+        write_vectors(self.path, vectors, {"settings": manifest_settings("model")})
+        reused, _ = previous_build(self.path, manifest_settings("model"))
+        np.testing.assert_array_equal(reused, vectors)
+        self.assertIsNone(previous_build(self.path, manifest_settings("other")))
+
+
+class TestIncrementalBuild(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.encoder = FakeEncoder()
+        # An in memory embedding cache, the shared one lives in the project cache
+        with mock.patch(
+            "lib.semantic_search.get_embedding_cache", return_value=EmbeddingCache(1)
+        ):
+            self.search = SemanticSearch()
+        self.search.documents = DocumentStore(
+            os.path.join(self.directory.name, "documents.store")
+        )
+        self.search.embedding_path = os.path.join(
+            self.directory.name, "embeddings.vectors"
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def build(self, documents) -> np.ndarray:
+        def pipeline(vectors_path, settings, workers):
+            return EmbeddingPipeline(
+                "model", vectors_path, settings, self.encoder.encode
+            )
+
+        self.encoder.texts.clear()
+        with (
+            mock.patch("lib.semantic_search.CACHE_PATH", self.directory.name),
+            mock.patch.object(self.search, "embedding_pipeline", pipeline),
+        ):
+            return np.array(self.search.build_embeddings(documents))
+
+    def test_only_changed_documents_are_encoded(self):
+        documents = movies(30)
+        first = self.build(documents)
+        self.assertEqual(len(self.encoder.texts), 30)
+
+        documents[4]["description"] = "a different story"
+        documents.append({"id": 31, "title": "Movie 31", "description": "new"})
+        del documents[10]
+        second = self.build(documents)
+        self.assertEqual(
+            sorted(self.encoder.texts),
+            ["Movie 31: new", "Movie 5: a different story"],
+        )
+        unchanged = [position for position in range(30) if position not in (4, 10)]
+        kept = [position for position in range(29) if position != 4]
+        np.testing.assert_array_equal(second[kept], first[unchanged])
+        np.testing.assert_array_equal(
+            self.search.doc_positions, np.arange(len(documents))
+        )
+
+    def test_unchanged_documents_encode_nothing(self):
+        first = self.build(movies(12))
+        second = self.build(movies(12))
+        self.assertEqual(self.encoder.texts, [])
+        np.testing.assert_array_equal(second, first)
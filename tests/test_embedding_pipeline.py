@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.embedding_manifest import content_hash
+from lib.embedding_pipeline import EmbeddingPipeline, length_sorted_batches
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeEncoder:
+    # A fixed random vector per text. After fail_after calls it raises, like
+    # a build that was stopped halfway
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.texts = []
+        self.calls = 0
+
+    def encode(self, texts) -> np.ndarray:
+        if self.calls == self.fail_after:
+            raise Interrupted
+        self.calls += 1
+        self.texts.extend(texts)
+        return np.array(
+            [
+                np.random.default_rng(content_hash(text)).standard_normal(6)
+                for text in texts
+            ],
+            dtype=np.float32,
+        )
+
+
+class TestLengthSortedBatches(unittest.TestCase):
+    def test_batches_cover_every_text_longest_first(self):
+        texts = ["x" * length for length in (3, 9, 1, 7, 7, 2, 5)]
+        batches = length_sorted_batches(texts, 3)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        order = np.concatenate(batches)
+        self.assertEqual(sorted(order.tolist()), list(range(len(texts))))
+        lengths = [len(texts[index]) for index in order.tolist()]
+        self.assertEqual(lengths, sorted(lengths, reverse=True))
+
+
+@mock.patch("lib.embedding_pipeline.EMBEDDING_BATCH_SIZE", 4)
+@mock.patch("lib.embedding_pipeline.EMBEDDING_CHECKPOINT_BATCHES", 2)
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.vectors_path = os.path.join(self.directory.name, "embeddings.vectors")
+        self.texts = [
+            f"movie {number} " + "word " * (number % 7) for number in range(30)
+        ]
+        self.expected = np.array(FakeEncoder().encode(self.texts))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def pipeline(self, encoder, settings=None) -> EmbeddingPipeline:
+        return EmbeddingPipeline(
+            "model", self.vectors_path, settings or {"model": "model"}, encoder.encode
+        )
+
+    def interrupted_build(self, fail_after):
+        encoder = FakeEncoder(fail_after)
+        with self.assertRaises(Interrupted):
+            self.pipeline(encoder).encode(self.texts)
+        return encoder
+
+    def test_uninterrupted_build(self):
+        pipeline = self.pipeline(FakeEncoder())
+        np.testing.assert_array_equal(pipeline.encode(self.texts), self.expected)
+        self.assertEqual(pipeline.stats["texts"], 30)
+        self.assertEqual(pipeline.stats["resumed"], 0)
+
+    def test_resume_encodes_only_the_rest(self):
+        first = self.interrupted_build(3)
+        base = os.path.splitext(self.vectors_path)[0]
+        self.assertTrue(os.path.isfile(f"{base}.partial"))
+        self.assertTrue(os.path.isfile(f"{base}.checkpoint"))
+
+        encoder = FakeEncoder()
+        pipeline = self.pipeline(encoder)
+        rows = pipeline.encode(self.texts)
+        np.testing.assert_array_equal(rows, self.expected)
+        self.assertEqual(len(first.texts) + len(encoder.texts), 30)
+        self.assertFalse(set(first.texts) & set(encoder.texts))
+        self.assertEqual(pipeline.stats["resumed"], 12)
+
+    def test_resume_after_several_interruptions(self):
+        done = []
+        for fail_after in (2, 1, 3):
+            done.extend(self.interrupted_build(fail_after).texts)
+        encoder = FakeEncoder()
+        rows = self.pipeline(encoder).encode(self.texts)
+        np.testing.assert_array_equal(rows, self.expected)
+        self.assertEqual(sorted(done + encoder.texts), sorted(self.texts))
+
+    def test_other_texts_start_over(self):
+        self.interrupted_build(3)
+        self.texts[0] = "an edited description"
+        self.expected = np.array(FakeEncoder().encode(self.texts))
+        encoder = FakeEncoder()
+        rows = self.pipeline(encoder).encode(self.texts)
+        np.testing.assert_array_equal(rows, self.expected)
+        self.assertEqual(len(encoder.texts), 30)
+
+    def test_other_settings_start_over(self):
+        self.interrupted_build(3)
+        encoder = FakeEncoder()
+        self.pipeline(encoder, {"model": "other"}).encode(self.texts)
+        self.assertEqual(len(encoder.texts), 30)
+
+    def test_finish_removes_the_checkpoint(self):
+        self.interrupted_build(3)
+        pipeline = self.pipeline(FakeEncoder())
+        pipeline.encode(self.texts)
+        pipeline.finish()
+        self.assertEqual(os.listdir(self.directory.name), [])
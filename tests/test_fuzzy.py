@@ -0,0 +1,114 @@
+import tempfile
+import unittest
+from itertools import product
+
+import numpy as np
+
+from lib.constants import DOCUMENT_KEY, ID_KEY
+from lib.fuzzy import VocabularyTrie, max_edits_for
+from lib.inverted_index import InvertedIndex
+
+
+def osa_distance(source: str, target: str) -> int:
+    # Optimal string alignment: Levenshtein plus adjacent transpositions,
+    # no substring edited twice
+    rows = [[0] * (len(target) + 1) for _ in range(len(source) + 1)]
+    for i in range(len(source) + 1):
+        rows[i][0] = i
+    for j in range(len(target) + 1):
+        rows[0][j] = j
+    for i, j in product(range(1, len(source) + 1), range(1, len(target) + 1)):
+        cost = source[i - 1] != target[j - 1]
+        rows[i][j] = min(
+            rows[i - 1][j] + 1, rows[i][j - 1] + 1, rows[i - 1][j - 1] + cost
+        )
+        if (
+            i > 1
+            and j > 1
+            and source[i - 1] == target[j - 2]
+            and source[i - 2] == target[j - 1]
+        ):
+            rows[i][j] = min(rows[i][j], rows[i - 2][j - 2] + 1)
+    return rows[-1][-1]
+
+
+def random_words(rng, count) -> list[str]:
+    # A small alphabet so many words are within a couple of edits
+    return [
+        "".join(rng.choice(list("abcde"), rng.integers(1, 8))) for _ in range(count)
+    ]
+
+
+class TestVocabularyTrie(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.terms = sorted(set(random_words(rng, 1500)))
+        self.trie = VocabularyTrie(self.terms)
+        self.words = random_words(rng, 40) + ["", "ab", "ba", "abcdeabcde"]
+
+    def test_fuzzy_matches_brute_force_osa(self):
+        for word in self.words:
+            distances = [(osa_distance(word, term), term) for term in self.terms]
+            for max_edits in (0, 1, 2):
+                expected = sorted(
+                    (distance, term)
+                    for distance, term in distances
+                    if distance <= max_edits
+                )
+                found = self.trie.fuzzy(word, max_edits)
+                self.assertEqual(
+                    [(distance, term) for term, distance in found], expected
+                )
+
+    def test_prefix_matches_startswith(self):
+        for prefix in ("", "a", "ab", "eed", "abcdeabcde"):
+            expected = [term for term in self.terms if term.startswith(prefix)]
+            self.assertEqual(self.trie.prefix(prefix), expected)
+            self.assertEqual(self.trie.prefix(prefix, 3), expected[:3])
+
+    def test_edit_budget_grows_with_length(self):
+        self.assertEqual(
+            [max_edits_for(token) for token in ("ab", "abc", "abcde", "abcdef")],
+            [0, 1, 1, 2],
+        )
+
+
+class TestFuzzySearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = InvertedIndex()
+        self.index.index_dir = self.directory.name
+        self.index.index_path = f"{self.directory.name}/manifest.json"
+        self.index.add_documents(
+            [
+                {ID_KEY: 1, "title": "Dragon", "description": "a dragon flies"},
+                {ID_KEY: 2, "title": "Wagon", "description": "an old wagon"},
+                {ID_KEY: 3, "title": "Castle", "description": "a castle story"},
+            ]
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def search(self, query, fuzzy) -> list[int]:
+        results = self.index.bm25_search(query, 10, fuzzy=fuzzy)
+        return [result[DOCUMENT_KEY][ID_KEY] for result in results]
+
+    def test_missing_tokens_expand_to_close_terms(self):
+        self.assertEqual(self.search("dargon", False), [])
+        # One transposition from "dragon", two edits from "wagon"
+        self.assertEqual(self.search("dargon", True), [1, 2])
+        self.assertEqual(sorted(self.search("dragoon castle", True)), [1, 3])
+
+    def test_indexed_tokens_are_not_expanded(self):
+        self.assertEqual(self.search("wagon", True), [2])
+        # "dragon" is two edits away, more than a five letter token allows
+        self.assertEqual(self.index.fuzzy_terms("wagon"), [("wagon", 0, 1)])
+        self.assertEqual(
+            self.index.fuzzy_terms("wagon", max_edits=2),
+            [("wagon", 0, 1), ("dragon", 2, 1)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
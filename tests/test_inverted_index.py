@@ -0,0 +1,334 @@
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.constants import DOCUMENT_KEY, ID_KEY, SCORE_KEY
+from lib import inverted_index
+from lib.inverted_index import InvertedIndex
+from lib.vector_search import top_k_indexes
+
+
+def movie(doc_id, title, description):
+    return {ID_KEY: doc_id, "title": title, "description": description}
+
+
+def open_index(directory) -> InvertedIndex:
+    index = InvertedIndex()
+    index.index_dir = directory
+    index.index_path = f"{directory}/manifest.json"
+    return index
+
+
+def ranked_ids(results) -> list[int]:
+    return [result[DOCUMENT_KEY][ID_KEY] for result in results]
+
+
+def build_index(directory, movies, **options) -> InvertedIndex:
+    # InvertedIndex.build over movies instead of the movies file
+    index = open_index(directory)
+    with mock.patch.object(inverted_index, "import_json", return_value=movies):
+        index.build(**options)
+    return index
+
+
+def random_movies(count, seed=0) -> list[dict]:
+    # Few distinct words, so most queries match many movies and scores tie
+    rng = np.random.default_rng(seed)
+    words = [f"word{index}" for index in range(60)]
+    return [
+        movie(
+            doc_id,
+            " ".join(rng.choice(words, rng.integers(1, 4))),
+            " ".join(rng.choice(words, rng.integers(5, 30))),
+        )
+        for doc_id in range(1, count + 1)
+    ]
+
+
+class TestMergeDeletedTerms(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = open_index(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_terms_of_deleted_documents_are_dropped(self):
+        # "aardvark" sorts first and "zebra" last, their only documents
+        # go, so the merge would leave empty runs at both ends
+        self.index.add_documents(
+            [
+                movie(1, "Aardvark", "an aardvark wanders the river"),
+                movie(2, "River", "a river story about a boat"),
+                movie(3, "Boat", "a boat on the river at night"),
+            ]
+        )
+        self.index.add_documents([movie(4, "Zebra", "a zebra crosses the river")])
+        self.assertEqual(self.index.delete_documents([1, 4]), 2)
+        self.index.merge()
+
+        (segment,) = self.index.segments
+        self.assertNotIn("aardvark", segment.terms)
+        self.assertNotIn("zebra", segment.terms)
+        self.assertTrue(np.all(np.diff(segment.term_offsets) > 0))
+
+        for method in ("wand", "exhaustive"):
+            results = self.index.bm25_search("river boat", 5, method)
+            self.assertEqual(sorted(ranked_ids(results)), [2, 3])
+            self.assertEqual(self.index.bm25_search("zebra", 5, method), [])
+
+    def test_upper_bounds_cover_every_impact(self):
+        self.index.add_documents(
+            [
+                movie(1, "Alpha", "lonely unique words here"),
+                movie(2, "Beta", "river river river boat"),
+                movie(3, "Gamma", "boat river"),
+            ]
+        )
+        self.index.delete_documents([1])
+        self.index.merge()
+
+        (segment,) = self.index.segments
+        offsets = segment.term_offsets
+        impacts = segment.column("impacts")
+        max_impacts = segment.sections["max_impacts"]
+        for term_id in range(len(segment.terms)):
+            run = impacts[offsets[term_id] : offsets[term_id + 1]]
+            self.assertEqual(max_impacts[term_id], run.max())
+
+
+class TestWandSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.movies = random_movies(400)
+        rng = np.random.default_rng(1)
+        self.queries = [
+            " ".join(rng.choice([f"word{index}" for index in range(70)], size))
+            for size in rng.integers(1, 5, 40)
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_wand_matches_exhaustive(self, index):
+        # The exhaustive accumulator is float32, so scores that tie in
+        # exact arithmetic may come back in either order. Every rank must
+        # hold the same score, and both must find the same movies
+        def scores(results):
+            return [result[SCORE_KEY] for result in results]
+
+        for query in self.queries:
+            for limit in (1, 10, 50):
+                np.testing.assert_allclose(
+                    scores(index.bm25_search(query, limit, "wand")),
+                    scores(index.bm25_search(query, limit, "exhaustive")),
+                    rtol=1e-5,
+                )
+            every = [
+                {
+                    result[DOCUMENT_KEY][ID_KEY]: result[SCORE_KEY]
+                    for result in index.bm25_search(query, len(self.movies), method)
+                }
+                for method in ("wand", "exhaustive")
+            ]
+            self.assertEqual(every[0].keys(), every[1].keys())
+            for doc_id, score in every[0].items():
+                self.assertAlmostEqual(score, every[1][doc_id], places=5)
+
+    def test_built_index(self):
+        self.assert_wand_matches_exhaustive(
+            build_index(self.directory.name, self.movies)
+        )
+
+    def test_compressed_index(self):
+        self.assert_wand_matches_exhaustive(
+            build_index(self.directory.name, self.movies, compress=True)
+        )
+
+    def test_segments_with_deletes(self):
+        index = open_index(self.directory.name)
+        for start in range(0, 400, 100):
+            index.add_documents(self.movies[start : start + 100])
+        index.delete_documents(range(1, 400, 7))
+        self.assert_wand_matches_exhaustive(index)
+
+
+class TestPhraseSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = build_index(
+            self.directory.name,
+            [
+                movie(1, "Alpha", "the river boat sails down the river boat lane"),
+                movie(2, "Bravo", "a boat sails past the river"),
+                movie(3, "Charlie", "river boat"),
+                movie(4, "Delta", "boat river boat river"),
+            ],
+            positions=True,
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_only_movies_with_the_terms_in_order_match(self):
+        results = self.index.phrase_search("river boat", 10)
+        self.assertEqual(sorted(ranked_ids(results)), [1, 3, 4])
+        self.assertEqual(ranked_ids(self.index.phrase_search("boat river", 10)), [4])
+        self.assertEqual(self.index.phrase_search("boat lane river", 10), [])
+        self.assertEqual(self.index.phrase_search("submarine", 10), [])
+
+    def test_phrase_in_a_later_segment_and_after_delete(self):
+        self.index.add_documents([movie(5, "Echo", "late river boat sails night")])
+        self.index.delete_documents([3])
+        self.assertEqual(
+            sorted(ranked_ids(self.index.phrase_search("river boat", 10))),
+            [1, 4, 5],
+        )
+        self.index.merge()
+        self.assertEqual(
+            sorted(ranked_ids(self.index.phrase_search("river boat night", 10))), []
+        )
+        self.assertEqual(
+            ranked_ids(self.index.phrase_search("boat sails night", 10)), [5]
+        )
+
+    def test_index_without_positions(self):
+        index = build_index(self.directory.name, [movie(1, "Boat", "a boat")])
+        with self.assertRaises(ValueError):
+            index.phrase_search("a boat", 10)
+        with self.assertRaises(ValueError):
+            index.proximity_search("a boat", 10)
+
+
+class TestProximitySearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_adjacent_terms_rank_first(self):
+        # Same words and lengths, only the distance between the terms differs
+        index = build_index(
+            self.directory.name,
+            [
+                movie(1, "Far", "river alpha bravo charlie delta echo foxtrot boat"),
+                movie(2, "Near", "alpha bravo charlie river boat delta echo foxtrot"),
+                movie(3, "Mid", "alpha river bravo charlie boat delta echo foxtrot"),
+            ],
+            positions=True,
+        )
+        bm25 = index.bm25_search("river boat", 10)
+        self.assertEqual(len({round(result[SCORE_KEY], 6) for result in bm25}), 1)
+        self.assertEqual(
+            ranked_ids(index.proximity_search("river boat", 10)), [2, 3, 1]
+        )
+        # A single term has no proximity, results stay in BM25 order
+        self.assertEqual(
+            ranked_ids(index.proximity_search("river", 10)),
+            ranked_ids(index.bm25_search("river", 10)),
+        )
+
+    def test_ties_across_segments_go_to_the_lower_id(self):
+        night = "a boat on the river at night"
+        index = build_index(
+            self.directory.name,
+            [movie(1, "Night", night), movie(2, "Other", "nothing here")],
+            positions=True,
+        )
+        # The best match is in the second segment, so it is visited first
+        index.add_documents(
+            [movie(3, "River Boat", "river boat river boat"), movie(4, "Night", night)]
+        )
+        self.assertEqual(
+            ranked_ids(index.proximity_search("river boat", 10)), [3, 1, 4]
+        )
+
+
+class TestBackgroundMerge(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = open_index(self.directory.name)
+        for doc_id in range(1, 5):
+            self.index.add_documents([movie(doc_id, "River", f"boat story {doc_id}")])
+        self.index.save()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def manifest_segments(self) -> list[str]:
+        with open(self.index.index_path) as file:
+            return [entry["name"] for entry in json.load(file)["segments"]]
+
+    def test_delete_during_merge(self):
+        started, resume = threading.Event(), threading.Event()
+        create_segment = inverted_index.create_segment
+
+        def paused_create_segment(*args):
+            # Holds the merge after it took its snapshot of the segments
+            started.set()
+            resume.wait(5)
+            return create_segment(*args)
+
+        saved = self.manifest_segments()
+        with mock.patch.object(inverted_index, "create_segment", paused_create_segment):
+            merging = self.index.merge(background=True)
+            self.assertTrue(started.wait(5))
+            self.assertEqual(self.index.delete_documents([2]), 1)
+            self.index.save()
+            resume.set()
+            merging.join(5)
+        self.assertFalse(merging.is_alive())
+
+        # The merge swapped segments in memory only
+        self.assertEqual(len(self.index.segments), 1)
+        self.assertEqual(self.manifest_segments(), saved)
+        self.assertEqual(
+            sorted(ranked_ids(self.index.bm25_search("boat", 10))), [1, 3, 4]
+        )
+
+        self.index.save()
+        reopened = open_index(self.directory.name)
+        reopened.load()
+        self.assertEqual(len(reopened.segments), 1)
+        self.assertEqual(
+            sorted(ranked_ids(reopened.bm25_search("boat", 10))), [1, 3, 4]
+        )
+
+
+class TestTiedScores(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = open_index(self.directory.name)
+        # Identical movies score exactly the same, whatever their id
+        movies = [movie(doc_id, "River", "a boat on the river") for doc_id in range(60)]
+        movies[17] = movie(17, "River", "a boat on the river river")
+        movies[41] = movie(41, "Boat", "a boat")
+        self.index.add_documents(movies)
+        self.index.merge()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_wand_and_exhaustive_agree_on_ties(self):
+        for limit in (1, 2, 5, 13, 40, 70):
+            wand = self.index.bm25_search("river boat", limit, "wand")
+            exhaustive = self.index.bm25_search("river boat", limit, "exhaustive")
+            self.assertEqual(ranked_ids(wand), ranked_ids(exhaustive))
+            batch = self.index.bm25_search_batch(["river boat"], limit)[0]
+            self.assertEqual(ranked_ids(batch), ranked_ids(exhaustive))
+
+    def test_top_k_indexes_breaks_ties_by_index(self):
+        rng = np.random.default_rng(0)
+        scores = rng.integers(0, 4, 1000).astype(np.float32)
+        for limit in (1, 10, 100, 999, 1000, 2000):
+            expected = np.lexsort((np.arange(len(scores)), -scores))[:limit]
+            np.testing.assert_array_equal(top_k_indexes(scores, limit), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
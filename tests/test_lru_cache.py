@@ -0,0 +1,32 @@
+import unittest
+
+from lib.lru_cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([key for key, _ in cache.items()], ["a", "c"])
+
+    def test_weighs_values(self):
+        cache = LRUCache(5, len)
+        cache.put("a", b"abc")
+        cache.put("b", b"de")
+        cache.put("a", b"x")
+        self.assertEqual(cache.weight, 3)
+        cache.put("c", b"wxyz")
+        self.assertEqual([key for key, _ in cache.items()], ["a", "c"])
+        self.assertEqual(cache.weight, 5)
+        # Heavier than the whole cache, not kept
+        cache.put("d", b"abcdef")
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
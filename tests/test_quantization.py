@@ -0,0 +1,163 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from lib.constants import DESCRIPTION_KEY, ID_KEY, SCORE_KEY, TITLE_KEY
+from lib.document_store import DocumentStore
+from lib.embedding_cache import EmbeddingCache
+from lib.quantization import (
+    ProductQuantizer,
+    ScalarQuantizer,
+    load_or_create_quantizer,
+    quantized_path,
+    rescored_top_k,
+)
+from lib.semantic_search import SemanticSearch
+from lib.vector_search import normalize_rows, write_vectors
+
+
+def unit_vectors(rows=600, dims=24, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return normalize_rows(rng.standard_normal((rows, dims)).astype(np.float32))
+
+
+class TestQuantizerScores(unittest.TestCase):
+    def setUp(self):
+        self.vectors = unit_vectors()
+        self.queries = unit_vectors(10, seed=1)
+
+    def test_int8_scores_are_close_to_exact(self):
+        quantizer = ScalarQuantizer.train(self.vectors)
+        for query in self.queries:
+            np.testing.assert_allclose(
+                quantizer.scores(query), self.vectors @ query, atol=0.02
+            )
+
+    def test_pq_scores_follow_exact(self):
+        quantizer = ProductQuantizer.train(self.vectors)
+        for query in self.queries:
+            correlation = np.corrcoef(quantizer.scores(query), self.vectors @ query)
+            self.assertGreater(correlation[0, 1], 0.8)
+
+    def test_scores_for_rows(self):
+        rows = np.array([3, 50, 7, 599])
+        for quantizer in (
+            ScalarQuantizer.train(self.vectors),
+            ProductQuantizer.train(self.vectors),
+        ):
+            query = self.queries[0]
+            np.testing.assert_array_equal(
+                quantizer.scores(query, rows), quantizer.scores(query)[rows]
+            )
+
+
+class TestRescoredTopK(unittest.TestCase):
+    def setUp(self):
+        self.vectors = unit_vectors()
+        self.query = unit_vectors(1, seed=1)[0]
+
+    def test_candidates_have_exact_scores(self):
+        for quantizer in (
+            ScalarQuantizer.train(self.vectors),
+            ProductQuantizer.train(self.vectors),
+        ):
+            candidates, scores = rescored_top_k(quantizer, self.vectors, self.query, 5)
+            self.assertEqual(len(candidates), 5 * quantizer.rescore_factor)
+            self.assertTrue(np.all(np.diff(candidates) > 0))
+            np.testing.assert_allclose(scores, self.vectors[candidates] @ self.query)
+
+    def test_candidates_come_from_rows(self):
+        quantizer = ScalarQuantizer.train(self.vectors)
+        rows = np.arange(0, 600, 3)
+        candidates, _ = rescored_top_k(quantizer, self.vectors, self.query, 5, rows)
+        self.assertTrue(np.isin(candidates, rows).all())
+
+    def test_rescoring_finds_the_exact_best(self):
+        quantizer = ScalarQuantizer.train(self.vectors)
+        for query in unit_vectors(20, seed=2):
+            candidates, scores = rescored_top_k(quantizer, self.vectors, query, 5)
+            exact = np.argsort(-(self.vectors @ query))[:5]
+            self.assertEqual(set(candidates[np.argsort(-scores)[:5]]), set(exact))
+
+
+class TestQuantizedSemanticSearch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.vectors = unit_vectors()
+        documents = [
+            {ID_KEY: doc_id, TITLE_KEY: f"Movie {doc_id}", DESCRIPTION_KEY: "a film"}
+            for doc_id in range(len(self.vectors))
+        ]
+        # An in memory embedding cache, the shared one lives in the project cache
+        with mock.patch(
+            "lib.semantic_search.get_embedding_cache", return_value=EmbeddingCache(1)
+        ):
+            self.search = SemanticSearch()
+        self.search.documents = DocumentStore(
+            os.path.join(self.directory.name, "documents.store")
+        )
+        self.search.documents.build(documents)
+        self.search.embeddings = self.vectors
+        self.search.doc_positions = np.arange(len(self.vectors))
+        self.search.embedding_path = os.path.join(
+            self.directory.name, "embeddings.vectors"
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def results(self, query, limit) -> list[tuple[str, float]]:
+        with mock.patch.object(self.search, "generate_embedding", return_value=query):
+            return [
+                (result[TITLE_KEY], result[SCORE_KEY])
+                for result in self.search.search("query", limit)
+            ]
+
+    def test_quantized_search_returns_limit_exact_results(self):
+        queries = unit_vectors(10, seed=3)
+        exact = [self.results(query, 10) for query in queries]
+        for kind in ("int8", "pq"):
+            self.search.quantizers[self.search.embedding_path] = (
+                ScalarQuantizer if kind == "int8" else ProductQuantizer
+            ).train(self.vectors)
+            for query, expected in zip(queries, exact, strict=True):
+                results = self.results(query, 10)
+                self.assertEqual(len(results), 10)
+                for (title, score), (_, best) in zip(results, expected, strict=True):
+                    index = int(title.split()[1])
+                    self.assertAlmostEqual(
+                        score, float(self.vectors[index] @ query), places=5
+                    )
+                    self.assertLessEqual(score, best + 1e-6)
+
+
+class TestLoadOrCreateQuantizer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "embeddings.vectors")
+        write_vectors(self.path, unit_vectors())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_codes_are_reused_until_the_vectors_change(self):
+        trained = load_or_create_quantizer(self.path, "int8")
+        self.assertTrue(os.path.isfile(quantized_path(self.path, "int8")))
+        with mock.patch.object(ScalarQuantizer, "train") as train:
+            loaded = load_or_create_quantizer(self.path, "int8")
+            train.assert_not_called()
+        np.testing.assert_array_equal(loaded.codes, trained.codes)
+
+        write_vectors(self.path, unit_vectors(seed=5))
+        # Same size, so only the modification time tells the files apart
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        retrained = load_or_create_quantizer(self.path, "int8")
+        self.assertFalse(np.array_equal(retrained.codes, trained.codes))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            load_or_create_quantizer(self.path, "int4")
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import unittest
+
+from lib.constants import DOCUMENT_KEY, ID_KEY
+from lib.inverted_index import InvertedIndex
+from lib.query_cache import QueryCache
+
+
+def result(doc_id, size=10) -> list[dict]:
+    return [{"document": {"id": doc_id, "title": "x" * size}, "score": 1.5}]
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "queries.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_results_are_copies_that_persist(self):
+        cache = QueryCache(10_000, self.path)
+        key = (("river", "boat"), 10, "wand", False)
+        cache.put(key, "index-1", result(1))
+        cached = cache.get(key, "index-1")
+        self.assertEqual(cached, result(1))
+        cached[0]["score"] = 0.0
+        self.assertEqual(cache.get(key, "index-1"), result(1))
+        cache.close()
+
+        reopened = QueryCache(10_000, self.path)
+        self.assertEqual(reopened.get(key, "index-1"), result(1))
+        self.assertIsNone(reopened.get((("sea",), 10, "wand", False), "index-1"))
+        reopened.close()
+        stats = QueryCache(10_000, self.path).stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 1))
+
+    def test_a_new_index_version_drops_every_entry(self):
+        cache = QueryCache(10_000, self.path)
+        cache.put("river", "index-1", result(1))
+        self.assertIsNone(cache.get("river", "index-2"))
+        cache.close()
+        reopened = QueryCache(10_000, self.path)
+        self.assertIsNone(reopened.get("river", "index-1"))
+        self.assertEqual(reopened.stats()["entries"], 0)
+
+    def test_processes_sharing_the_file_keep_each_others_entries(self):
+        first = QueryCache(10_000, self.path)
+        second = QueryCache(10_000, self.path)
+        first.put("river", "index-1", result(1))
+        second.put("boat", "index-1", result(2))
+        first.close()
+        second.close()
+        reopened = QueryCache(10_000, self.path)
+        self.assertEqual(reopened.get("river", "index-1"), result(1))
+        self.assertEqual(reopened.get("boat", "index-1"), result(2))
+        self.assertEqual(reopened.stats()["entries"], 2)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        size = len(json.dumps(result(0, 100)))
+        cache = QueryCache(size * 2, self.path)
+        cache.put("a", "index-1", result(1, 100))
+        cache.put("b", "index-1", result(2, 100))
+        cache.get("a", "index-1")
+        cache.put("c", "index-1", result(3, 100))
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertLessEqual(stats["bytes"], size * 2)
+        cache.close()
+        reopened = QueryCache(size * 2, self.path)
+        self.assertIsNone(reopened.get("b", "index-1"))
+        self.assertEqual(reopened.get("a", "index-1"), result(1, 100))
+
+    def test_memory_only_cache(self):
+        cache = QueryCache(10_000)
+        cache.put("river", "index-1", result(1))
+        self.assertEqual(cache.get("river", "index-1"), result(1))
+        self.assertEqual(cache.stats()["entries"], 1)
+        cache.close()
+
+
+class TestIndexInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "queries.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_index(self) -> InvertedIndex:
+        index = InvertedIndex()
+        index.index_dir = os.path.join(self.directory.name, "index")
+        index.index_path = os.path.join(index.index_dir, "manifest.json")
+        index.query_cache = QueryCache(10_000, self.cache_path)
+        return index
+
+    def search(self, index, query="river") -> list[int]:
+        return [result[DOCUMENT_KEY][ID_KEY] for result in index.bm25_search(query, 10)]
+
+    def test_saved_changes_invalidate_cached_results(self):
+        index = self.open_index()
+        index.add_documents(
+            [
+                {ID_KEY: 1, "title": "River", "description": "a river story"},
+                {ID_KEY: 2, "title": "Boat", "description": "a boat story"},
+            ]
+        )
+        # Unsaved changes have no index version, nothing is cached
+        self.assertEqual(self.search(index), [1])
+        self.assertEqual(index.query_cache.stats()["entries"], 0)
+        index.save()
+        self.assertEqual(self.search(index), [1])
+        self.assertEqual(self.search(index), [1])
+        self.assertEqual(index.query_cache.stats()["hits"], 1)
+
+        # Another process changes and saves the index
+        writer = self.open_index()
+        writer.load()
+        writer.add_documents([{ID_KEY: 3, "title": "River", "description": "river"}])
+        self.assertEqual(self.search(writer), [3, 1])
+        writer.save()
+
+        reader = self.open_index()
+        reader.load()
+        self.assertEqual(self.search(reader), [3, 1])
+        self.assertEqual(reader.query_cache.stats()["entries"], 1)
+        # The process still on the old version never sees the new results
+        self.assertEqual(self.search(index), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
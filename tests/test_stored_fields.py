@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.constants import ID_KEY
+from lib.document_store import DocumentStore
+from lib.inverted_index import analyze_documents, create_segment, merge_postings
+from lib.segment import StoredFields
+
+
+def movies(count) -> list[dict]:
+    return [
+        {
+            ID_KEY: doc_id,
+            "title": f"Movie {doc_id}",
+            "description": f"a story number {doc_id} about a river and a boat",
+        }
+        for doc_id in range(count)
+    ]
+
+
+class TestShardedStoredFields(unittest.TestCase):
+    def test_sharded_records_match_serial_build(self):
+        documents = movies(300)
+        serial = create_segment(analyze_documents(documents), True)
+
+        sampled = documents[:: StoredFields.sample_step(len(documents))]
+        dictionary = StoredFields.sample_dictionary(
+            [StoredFields.encode_document(movie) for movie in sampled]
+        )
+        shards = [documents[start : start + 70] for start in range(0, 300, 70)]
+        sharded = create_segment(
+            merge_postings(
+                [
+                    analyze_documents(shard, record_dictionary=dictionary)
+                    for shard in shards
+                ]
+            ),
+            True,
+        )
+        for name in ("record_offsets", "records", "record_dictionary"):
+            np.testing.assert_array_equal(serial.sections[name], sharded.sections[name])
+        self.assertEqual(sharded.documents[123], documents[123])
+
+
+class TestDocumentStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.directory.name, "movies.json")
+        self.documents = movies(20)
+        with open(self.source_path, "w") as file:
+            json.dump({"movies": self.documents}, file)
+        self.store = DocumentStore(os.path.join(self.directory.name, "documents.store"))
+        self.store.load(source_path=self.source_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_length_edit_rebuilds(self):
+        edited = [dict(document) for document in self.documents]
+        edited[5]["title"] = "Movie X"
+        self.store.load(edited, self.source_path)
+        self.assertEqual(self.store[5]["title"], "Movie X")
+
+    def test_unchanged_documents_are_current(self):
+        self.assertTrue(self.store.matches(self.documents))
+        self.assertIsNone(self.store.load(source_path=self.source_path))
+        self.assertEqual(self.store.load(self.documents), self.documents)
+        self.assertIsNone(self.store.load(source_path=self.source_path))
+
+    def test_caller_documents_need_no_source_file(self):
+        store = DocumentStore(os.path.join(self.directory.name, "other.store"))
+        missing = os.path.join(self.directory.name, "missing.json")
+        self.assertEqual(store.load(self.documents, missing), self.documents)
+        self.assertIsNone(store.metadata["source"])
+
+    def test_caller_documents_are_not_current_for_the_file(self):
+        edited = [dict(document) for document in self.documents]
+        edited[5]["title"] = "Movie X"
+        self.store.load(edited)
+        self.assertIsNone(self.store.metadata["source"])
+        # The file's documents come back on the next plain load
+        self.assertEqual(self.store.load(source_path=self.source_path), self.documents)
+        self.assertEqual(self.store[5]["title"], "Movie 5")
+
+
+if __name__ == "__main__":
+    unittest.main()
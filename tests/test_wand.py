@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from lib.constants import WAND_BLOCK_SIZE
+from lib.wand import EXHAUSTED, TermCursor, wand_top_k
+
+
+def random_postings(rng, doc_count, density):
+    docs = np.flatnonzero(rng.random(doc_count) < density).astype(np.int32)
+    impacts = rng.random(len(docs)).astype(np.float32)
+    return docs, impacts
+
+
+def exhaustive_top_k(postings, weights, doc_count, limit):
+    scores = np.zeros(doc_count)
+    for (docs, impacts), weight in zip(postings, weights, strict=True):
+        scores[docs] += weight * impacts.astype(np.float64)
+    order = np.lexsort((np.arange(doc_count), -scores))
+    return [(int(doc), float(scores[doc])) for doc in order[:limit] if scores[doc]]
+
+
+class TestTermCursor(unittest.TestCase):
+    def test_seek_and_next_across_blocks(self):
+        docs = np.arange(0, 10 * WAND_BLOCK_SIZE * 3, 3, dtype=np.int32)
+        impacts = np.arange(len(docs), dtype=np.float32)
+        cursor = TermCursor(docs, impacts, 2.0, impacts.max())
+        self.assertEqual(cursor.doc, 0)
+        # Within the block, then far past it
+        cursor.seek(7)
+        self.assertEqual((cursor.doc, cursor.score()), (9, 6.0))
+        cursor.seek(5 * WAND_BLOCK_SIZE * 3 + 1)
+        self.assertEqual(cursor.doc, 5 * WAND_BLOCK_SIZE * 3 + 3)
+        for _ in range(2 * WAND_BLOCK_SIZE):
+            cursor.next()
+        self.assertEqual(cursor.doc, int(docs[cursor.position]))
+        self.assertEqual(cursor.score(), 2.0 * float(impacts[cursor.position]))
+        cursor.seek(int(docs[-1]) + 1)
+        self.assertEqual(cursor.doc, EXHAUSTED)
+
+    def test_wand_matches_exhaustive(self):
+        rng = np.random.default_rng(0)
+        doc_count = 20_000
+        for densities in ((0.5, 0.01), (0.3, 0.2, 0.002), (0.05,)):
+            postings = [random_postings(rng, doc_count, d) for d in densities]
+            weights = rng.random(len(postings)) + 0.5
+            for limit in (1, 10, 200):
+                cursors = [
+                    TermCursor(docs, impacts, weight, impacts.max())
+                    for (docs, impacts), weight in zip(postings, weights, strict=True)
+                ]
+                found = wand_top_k(cursors, limit)
+                expected = exhaustive_top_k(postings, weights, doc_count, limit)
+                self.assertEqual([doc for doc, _ in found], [d for d, _ in expected])
+                np.testing.assert_allclose(
+                    [score for _, score in found],
+                    [score for _, score in expected],
+                    rtol=1e-6,
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()